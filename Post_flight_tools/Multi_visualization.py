@@ -1,19 +1,20 @@
-import csv
 import plotly.express as px
 import plotly.graph_objects as go
-from scipy import interpolate
-import glob, os
+from helixio.traces import LINE_TOLERANCE, MAX_ANIMATION_FRAMES, level_of_detail, load_traces, resample_trajectories, shared_time_grid
+import numpy as np
 import math
 
 def multi_visualizer (**Input): 
     """
     Draws the path of drones based on the file and animates them in Cartesian coordinate
     Arguments:
-        csv_folder: directory of the folder containing all the csv files created by functions visualize_ulg and visualize_path_following
+        folder_of_input_csvs: directory of the folder containing all the trace files (csv, parquet or npz) created by functions visualize_ulg and visualize_path_following
         drone_size: size of drones in visualization
         ticks_num: number of ticks for each cartesian axis
         frame_duration: duratin of each frame of animation (second)
         dt=time step (used for interpolation)
+        max_frames: most frames in the animation, longer flights skip time steps (None keeps all)
+        line_tolerance: distance (m) the trace lines may deviate from the drones' paths (None keeps all points)
 
     Returns:
         An animated figure of all drones with interpolated positions
@@ -23,6 +24,8 @@ def multi_visualizer (**Input):
     drone_size=10
     Ticks_num=10
     frame_duration=None
+    max_frames=MAX_ANIMATION_FRAMES
+    line_tolerance=LINE_TOLERANCE
     for key, value in Input.items():
         if key=="folder_of_input_csvs":
             folder_of_input_csvs=value
@@ -34,6 +37,10 @@ def multi_visualizer (**Input):
             dt=value
         elif key=='frame_duration':
             frame_duration=value
+        elif key=='max_frames':
+            max_frames=value
+        elif key=='line_tolerance':
+            line_tolerance=value
         
     if folder_of_input_csvs==None:
         print('Error: A directory to folder of containing csv files should be provided')
@@ -59,60 +66,36 @@ def multi_visualizer (**Input):
     interp_length=0
     
     all_drones={}
-    # opening csv files ----------------------
-    os.chdir(folder_of_input_csvs)
-    for csv_file in glob.glob("*.csv"):
-        # Getting data from gps csv file from a csv file ------
-        opened_csv_file=open(folder_of_input_csvs+"/"+csv_file, newline="")
-        Object_of_dictionaries=csv.DictReader(opened_csv_file, delimiter=",")
-        for row_dict in Object_of_dictionaries: # we should create the lists when the file is still open
-            drone_id=row_dict["drone id"]
+    # opening trace files (csv, parquet or npz) in bulk ----------------------
+    for trace in load_traces(folder_of_input_csvs).values():
+        for drone_id, drone in trace.drones.items():
             if drone_id not in all_drones:
-                all_drones[drone_id]=[[],[],[],[],[]] # x, y, z, timestamp, type of experiment
-            
-            all_drones[drone_id][0].append(float(row_dict["x(m)"]))
-            x_max=max(x_max, float(row_dict["x(m)"]))
-            x_min=min(x_min, float(row_dict["x(m)"]))
-
-            all_drones[drone_id][1].append(float(row_dict["y(m)"]))
-            y_max=max(y_max, float(row_dict["y(m)"]))
-            y_min=min(y_min, float(row_dict["y(m)"]))
-
-
-            all_drones[drone_id][2].append(float(row_dict["z(m)"]))
-            z_max=max(z_max, float(row_dict["z(m)"]))
-            z_min=min(z_min, float(row_dict["z(m)"]))
-
-            all_drones[drone_id][3].append(float(row_dict["time(s)"]))
-            all_drones[drone_id][4].append(str(row_dict["type of experiment"]))
-        
-        opened_csv_file.close()
-
-    # End of opening csv files  --------------------- 
-    #interpolation
-    min_finish_time=math.inf
-    max_start_time=-1*math.inf
-    for drone_id in all_drones:
-        min_finish_time=min(min_finish_time, max(all_drones[drone_id][3]))
-        max_start_time=max(max_start_time, min(all_drones[drone_id][3]))
-        all_drones[drone_id].append(interpolate.interp1d(all_drones[drone_id][3],all_drones[drone_id][0])) # interpolation of time and x position at all_drones[drone_id][5]
-        all_drones[drone_id].append(interpolate.interp1d(all_drones[drone_id][3],all_drones[drone_id][1])) # interpolation of time and y position at all_drones[drone_id][6]
-        all_drones[drone_id].append(interpolate.interp1d(all_drones[drone_id][3],all_drones[drone_id][2])) # interpolation of time and z position at all_drones[drone_id][7]
-    
+                all_drones[drone_id]=[np.empty((0, 3)), np.empty(0), trace.experiment_type] # positions (x, y, z), timestamps, type of experiment
+            all_drones[drone_id][0]=np.concatenate((all_drones[drone_id][0], drone["position"]))
+            all_drones[drone_id][1]=np.concatenate((all_drones[drone_id][1], drone["time"]))
+            x_max=max(x_max, drone["position"][:, 0].max())
+            x_min=min(x_min, drone["position"][:, 0].min())
+            y_max=max(y_max, drone["position"][:, 1].max())
+            y_min=min(y_min, drone["position"][:, 1].min())
+            z_max=max(z_max, drone["position"][:, 2].max())
+            z_min=min(z_min, drone["position"][:, 2].min())
+
+    # End of opening trace files  --------------------- 
+    #interpolation of all drones on a shared time grid in one pass
     fig_colors=['red','lightgreen', 'blue', 'orange','aqua', 'silver', 'magenta', 'darkkhaki','dodgerblue','green','black','brown']
-    drones=[] # to know the order of the drones in interpolation
-    for drone_id in all_drones:
-        t=max_start_time
-        drones.append(drone_id)
-        interp_length=0
-        while(t<=min_finish_time):
-            X_total.append(float(all_drones[drone_id][5](t))) # using x interpolation for drone
-            Y_total.append(float(all_drones[drone_id][6](t))) # using y interpolation for drone
-            Z_total.append(float(all_drones[drone_id][7](t))) # using z interpolation for drone
-            Time_total.append(t)
-            labels_total.append(drone_id+' ('+all_drones[drone_id][4][0]+')')
-            t+=dt
-            interp_length+=1
+    drones=list(all_drones) # to know the order of the drones in interpolation
+    times=[all_drones[drone_id][1] for drone_id in drones]
+    interp_time=shared_time_grid(times, dt) # from the latest start to the earliest finish
+    resampled=resample_trajectories(times, [all_drones[drone_id][0] for drone_id in drones], interp_time) # drones x time x (x, y, z)
+    # Level of detail, plotly slows down with the number of points it is given
+    resampled, interp_time, lines, stride=level_of_detail(resampled, interp_time, max_frames, line_tolerance)
+    interp_length=len(interp_time)
+    X_total=resampled[:, :, 0].reshape(-1).tolist()
+    Y_total=resampled[:, :, 1].reshape(-1).tolist()
+    Z_total=resampled[:, :, 2].reshape(-1).tolist()
+    Time_total=interp_time.tolist()*len(drones)
+    for drone_id in drones:
+        labels_total+=[drone_id+' ('+all_drones[drone_id][2]+')']*interp_length
 
 
     x_right_margin=x_max+(x_max-x_min)*0.05
@@ -165,16 +148,16 @@ def multi_visualizer (**Input):
     for j in range(len(drones)):
         fig.add_trace(            #should be an object of go
             go.Scatter3d(
-                x=X_total[j*interp_length: ((j+1)*interp_length)], 
-                y=Y_total[j*interp_length: ((j+1)*interp_length)],
-                z=Z_total[j*interp_length: ((j+1)*interp_length)], 
+                x=lines[j][:, 0], 
+                y=lines[j][:, 1],
+                z=lines[j][:, 2], 
                 mode='lines',
                 name="trace of "+ drones[j],
                 marker=dict(color=fig_colors[index_checker(j,len(fig_colors))])
         )
     )
     if frame_duration==None:
-        frame_duration=dt # in seconds
+        frame_duration=dt*stride # in seconds
     fig.layout.updatemenus[0].buttons[0].args[1]['frame']['duration'] = frame_duration*1000 # in milliseconds
     fig.layout.updatemenus[0].buttons[0].args[1]['frame']['duration'] = frame_duration*1000 # in milliseconds
     fig.layout.updatemenus[0].buttons[0].args[1]['transition']['duration'] = 1 # in milliseconds
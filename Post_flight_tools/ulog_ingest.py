@@ -0,0 +1,109 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+try:
+    from pyulog import ULog
+except ImportError:  # only needed to parse the files, offboard_intervals works without
+    ULog = None
+
+# ULog topics read by the post flight tools
+ULOG_TOPICS = ["vehicle_gps_position", "offboard_control_mode"]
+
+
+def _topic(ulog, name):
+    # the columns of the first instance of a topic, empty if it was not logged
+    try:
+        return ulog.get_dataset(name).data
+    except (KeyError, IndexError, ValueError):
+        return {}
+
+
+def ingest_ulog(ulg_path):
+    """
+    Parses the topics of one ulog file straight into numpy arrays
+
+    Arguments:
+        ulg_path: path to the .ulg file
+    Returns:
+        A dict of the columns of the drone:
+            name: file name without .ulg
+            gps_timestamp: time since turning on of the gps samples (s, asynchronous)
+            time: Unix time of the gps samples (s, synchronized)
+            lat, lon: latitude and longitude of the gps samples (degrees)
+            alt: altitude of the gps samples relative to sea level (m)
+            offboard_timestamp: time since turning on of the offboard_control_mode
+                messages (s, asynchronous)
+    """
+    if ULog is None:
+        raise ImportError("parsing ulog files requires pyulog")
+    ulog = ULog(ulg_path, ULOG_TOPICS)
+    gps = _topic(ulog, "vehicle_gps_position")
+    offboard = _topic(ulog, "offboard_control_mode")
+    # newer PX4 logs the position in degrees and meters instead of integers
+    if "lat" in gps:
+        lat = gps["lat"] / 10000000
+        lon = gps["lon"] / 10000000
+        alt = gps["alt"] / 1000
+    else:
+        lat = gps["latitude_deg"].astype("float64")
+        lon = gps["longitude_deg"].astype("float64")
+        alt = gps["altitude_msl_m"].astype("float64")
+    return {
+        "name": os.path.basename(ulg_path).replace(".ulg", ""),
+        "gps_timestamp": gps["timestamp"] / 1000000,
+        "time": gps["time_utc_usec"] / 1000000,
+        "lat": lat,
+        "lon": lon,
+        "alt": alt,
+        "offboard_timestamp": offboard.get("timestamp", np.empty(0)) / 1000000,
+    }
+
+
+def offboard_intervals(gps_timestamp, offboard_timestamp, max_gap=None):
+    """
+    Finds when a drone was in offboard mode from its offboard_control_mode messages,
+    with a binary search of every gps sample among the intervals
+
+    Arguments:
+        gps_timestamp: time since turning on of the gps samples (s)
+        offboard_timestamp: time since turning on of the offboard_control_mode
+            messages (s)
+        max_gap: messages further apart than max_gap seconds start a new interval, by
+            default all messages form one interval from the first to the last
+    Returns:
+        starts, ends: arrays of the start and end times of the offboard intervals
+        mask: boolean array, True for the gps samples within an interval
+    """
+    gps_timestamp = np.asarray(gps_timestamp, dtype="float64")
+    offboard_timestamp = np.sort(np.asarray(offboard_timestamp, dtype="float64"))
+    if len(offboard_timestamp) < 2:
+        # an interval needs two messages
+        empty = np.empty(0, dtype="float64")
+        return empty, empty, np.zeros(len(gps_timestamp), dtype="bool")
+    if max_gap is None:
+        breaks = np.empty(0, dtype="int64")
+    else:
+        (breaks,) = np.nonzero(np.diff(offboard_timestamp) > max_gap)
+    starts = offboard_timestamp[np.concatenate(([0], breaks + 1))]
+    ends = offboard_timestamp[np.concatenate((breaks, [len(offboard_timestamp) - 1]))]
+    interval = np.searchsorted(starts, gps_timestamp, side="right") - 1
+    mask = interval >= 0
+    mask[mask] = gps_timestamp[mask] <= ends[interval[mask]]
+    return starts, ends, mask
+
+
+def ingest_ulogs(ulg_paths, max_workers=None):
+    """
+    Parses many ulog files in a pool of processes, one file per worker at a time
+
+    Arguments:
+        ulg_paths: paths to the .ulg files
+        max_workers: number of processes, defaults to the number of CPUs
+    Returns:
+        A list of ingest_ulog dicts in the order of ulg_paths
+    """
+    if len(ulg_paths) <= 1:
+        return [ingest_ulog(path) for path in ulg_paths]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(ingest_ulog, ulg_paths))
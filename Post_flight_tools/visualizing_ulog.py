@@ -1,9 +1,9 @@
-import csv
-from pyulog.ulog2csv import convert_ulog2csv  # convert_ulog2csv is a function in ulog2csv file in pyulog package
-from pymap3d.ned import geodetic2ned
+from ulog_ingest import ingest_ulogs, offboard_intervals
+import numpy as np
+from helixio.geodetic import NedFrame
 import plotly.express as px
 import plotly.graph_objects as go
-from scipy import interpolate
+from helixio.traces import LINE_TOLERANCE, MAX_ANIMATION_FRAMES, Trace, level_of_detail, resample_trajectories, save_trace
 import glob, os
 import math
 
@@ -20,6 +20,10 @@ def visualize_ulg (**Input):  # input keyword arguments: ref_lat, ref_long, ref_
         dt= time step of animation in seconds
         sitl_or_real: if its value is 'real', it means ulg is for a real experiment and if the value is 'sitl' it means ulg is for a sitl simulation (the default value is 'real'), 
         frame_duration: duratin of each frame of animation (second)
+        max_workers: number of processes parsing the ulg files (the default is the number of CPUs)
+        offboard_max_gap: offboard_control_mode messages further apart than this many seconds split the offboard mode into separate intervals (by default the drone counts as in offboard mode from the first message to the last)
+        max_frames: most frames in the animation, longer flights skip time steps (None keeps all)
+        line_tolerance: distance (m) the trace lines may deviate from the drones' paths (None keeps all points)
 
         Note: if a user does not provide one arguments of ref_lat, ref_long and ref_alt, the function considers 
             a point with the least latitude, longitude and altitude as the reference point
@@ -36,6 +40,10 @@ def visualize_ulg (**Input):  # input keyword arguments: ref_lat, ref_long, ref_
     Drone_size=10
     Ticks_num=10
     frame_duration=None
+    max_workers=None
+    offboard_max_gap=None
+    max_frames=MAX_ANIMATION_FRAMES
+    line_tolerance=LINE_TOLERANCE
     for key, value in Input.items():
         if key=="ref_lat":
             ref_lat=value
@@ -57,6 +65,14 @@ def visualize_ulg (**Input):  # input keyword arguments: ref_lat, ref_long, ref_
             output_CSV_file_dir=value
         elif key=='frame_duration':
             frame_duration=value
+        elif key=='max_workers':
+            max_workers=value
+        elif key=='offboard_max_gap':
+            offboard_max_gap=value
+        elif key=='max_frames':
+            max_frames=value
+        elif key=='line_tolerance':
+            line_tolerance=value
         
     if folder_of_ulg==None:
         print('Error: A directory to folder of input ulg files should be provided')
@@ -70,19 +86,16 @@ def visualize_ulg (**Input):  # input keyword arguments: ref_lat, ref_long, ref_
     x=[]
     x_max=-1*math.inf  #for figure range
     x_min=math.inf     #for figure range  
-    fx=[]              #x interpolation 
     X_total=[]         #total interpolated x
 
     y=[]
     y_max=-1*math.inf  #for figure range
     y_min=math.inf     #for figure range
-    fy=[]              #y interpolation
     Y_total=[]         #total interpolated y
 
     z=[]
     z_max=-1*math.inf  #for figure range
     z_min=0            #for figure range
-    fz=[]              #z interpolation
     Z_total=[]         #total interpolated z
     
     Time_total=[]      #Time span of interpolation used for figure
@@ -110,53 +123,31 @@ def visualize_ulg (**Input):  # input keyword arguments: ref_lat, ref_long, ref_
     max_start_time=-1*math.inf
     min_finish_time=math.inf
     
-    # opening ulg files ----------------------
+    # opening ulg files, parsed straight into arrays by a pool of processes ----------------------
     os.chdir(folder_of_ulg)
-    for ulg_file in glob.glob("*.ulg"):
-        convert_ulog2csv(folder_of_ulg+"/"+ulg_file, 'vehicle_gps_position', folder_of_ulg, delimiter=";") # to get positions of a drone and synchronized time
-        convert_ulog2csv(folder_of_ulg+"/"+ulg_file, 'offboard_control_mode',folder_of_ulg, delimiter=";") # to check when offboard mode is active (timing is asynchronous)
-        file_names.append(ulg_file.replace(".ulg","")) # file names is the name of a ulg file without .ulg
-        latitude.append([])         # new line for latitudes of drone i
-        longitude.append([])        # new line for longitudes of drone i
-        altitude.append([])         # new line for altitudes of drone i
-        Time.append([])             # new line for sampling time of drone i
-        gps_timestamp.append([])       # new line for gps timestamp drone i
-        offboard_timestamp.append([])  # new line for offboard mode timestamp of drone i
+    ulg_paths=[folder_of_ulg+"/"+ulg_file for ulg_file in glob.glob("*.ulg")]
+    for drone in ingest_ulogs(ulg_paths, max_workers):
+        file_names.append(drone["name"]) # file names is the name of a ulg file without .ulg
+        gps_timestamp.append(drone["gps_timestamp"].tolist()) # in seconds, since turning on (asynchronous)
+        Time.append(drone["time"].tolist()) # in seconds, Unix (synchronized)
+        latitude.append(drone["lat"].tolist())
+        longitude.append(drone["lon"].tolist())
+        altitude.append(drone["alt"].tolist()) # in meters, relative to sea level
+        offboard_timestamp.append(drone["offboard_timestamp"].tolist())
 
-        # Getting data from gps csv file created from ulg file ------
-        csv_file_gps=open(folder_of_ulg+"/"+ulg_file.replace(".ulg","")+"_vehicle_gps_position_0.csv", newline="")
-        Object_of_dictionaries_gps=csv.DictReader(csv_file_gps, delimiter=";")
-        for row_dict in Object_of_dictionaries_gps: # we should create the lists when the file is still open
-            gps_timestamp[i].append(float(row_dict["timestamp"])/1000000) # in seconds, since turning on (asynchronous)
-            Time[i].append(float(row_dict["time_utc_usec"])/1000000) # in seconds, Unix (synchronized)
+        min_lat=min(min_lat, drone["lat"].min())
+        max_lat=max(max_lat, drone["lat"].max())
+        min_long=min(min_long, drone["lon"].min())
+        max_long=max(max_long, drone["lon"].max())
+        min_alt=min(min_alt, drone["alt"].min())
+        max_alt=max(max_alt, drone["alt"].max())
 
-            latitude[i].append(float(row_dict ["lat"])/10000000)
-            min_lat=min(min_lat, float(row_dict ["lat"])/10000000)
-            max_lat=max(max_lat, float(row_dict ["lat"])/10000000)
-
-            longitude[i].append(float(row_dict["lon"])/10000000)
-            min_long=min(min_long, float(row_dict ["lon"])/10000000)
-            max_long=max(max_long, float(row_dict ["lon"])/1000000)
-
-            altitude[i].append(float(row_dict ["alt"])/1000) # in meters, relative to sea level
-            min_alt=min(min_alt, float(row_dict ["alt"])/1000)
-            max_alt=max(max_alt, float(row_dict ["alt"])/1000)
-
-        csv_file_gps.close()
-        
         if max_start_time<Time[i][0]:
             max_start_time=Time[i][0]
             latest_drone=i
         
         min_finish_time=min(min_finish_time, Time[i][len(Time[i])-1])
 
-        # Getting data from offboard csv file created from ulg file --------
-        csv_file_offboard=open(folder_of_ulg+"/"+ulg_file.replace(".ulg","")+"_offboard_control_mode_0.csv", newline="")
-        Object_of_dictionaries_offboard=csv.DictReader(csv_file_offboard, delimiter=";")  
-        for row_dict in Object_of_dictionaries_offboard: # we should create the lists when the file is still open  
-            offboard_timestamp[i].append(float(row_dict['timestamp'])/1000000)    
-        csv_file_offboard.close()
-
         i+=1 #number of files (drones)
         # End of opening ulg files  ---------------------
 
@@ -176,80 +167,56 @@ def visualize_ulg (**Input):  # input keyword arguments: ref_lat, ref_long, ref_
     offboard_mode_status=[] # shows the offboard status of a drone
     offboard_finish=[-1*math.inf for j in range(i)]
     offboard_start=[math.inf for j in range(i)]
+    ned_frame=NedFrame(ref_lat, ref_long, ref_alt) # reference frame computed once for all samples
     for j in range(i):  # j is the number of a drone
-        x.append([])  #new line for x coordinates
-        y.append([])  #new line for y coordinates
-        z.append([])  #new line for z coordinates 
-        for  k in range(len(Time[j])): # k is the number of a sample of drone j
-            n,e,d =geodetic2ned(latitude[j][k], longitude[j][k], altitude[j][k], ref_lat, ref_long, ref_alt, ell=None, deg=True)
-            x[j].append(e)
-            x_max=max(x_max, e)
-            x_min=min(x_min, e)
+        n,e,d =ned_frame.geodetic2ned(latitude[j], longitude[j], altitude[j]) # all samples of drone j at once
+        x.append(e.tolist())  #new line for x coordinates
+        x_max=max(x_max, e.max())
+        x_min=min(x_min, e.min())
 
-            y[j].append(n)
-            y_max=max(y_max, n)
-            y_min=min(y_min, n)
-            
-            z[j].append(-1*d)
-            z_max=max(z_max, -1*d)
-            z_min=min(z_min, -1*d)
+        y.append(n.tolist())  #new line for y coordinates
+        y_max=max(y_max, n.max())
+        y_min=min(y_min, n.min())
+
+        z.append((-1*d).tolist())  #new line for z coordinates 
+        z_max=max(z_max, (-1*d).max())
+        z_min=min(z_min, (-1*d).min())
             
-        offboard_mode_status.append([0 for n in range(len(gps_timestamp[j]))])
+        starts, ends, in_offboard=offboard_intervals(gps_timestamp[j], offboard_timestamp[j], offboard_max_gap) # to check when drone j was on offboard mode
+        offboard_mode_status.append(in_offboard.astype(int).tolist())
+        if in_offboard.any():
+            offboard_start[j]=np.asarray(Time[j])[in_offboard].min() # offboard start for drone j based on synchronized time
+            offboard_finish[j]=np.asarray(Time[j])[in_offboard].max() # offboard finish for drone j based on synchronized time
 
-        for l in range(len(offboard_timestamp[j])-1): # to check when drone j was on offboard mode
-            for m in range (len(gps_timestamp[j])):
-                if (gps_timestamp[j][m] >= offboard_timestamp[j][l] and gps_timestamp[j][m] <= offboard_timestamp[j][l+1]): # drone j were on offboard mode at gps_timestamp [j][m]
-                    offboard_mode_status[j][m]=1
-                    if offboard_start[j]>=Time[j][m]:
-                        offboard_start[j]=Time[j][m] # offboard start for drone j based on synchronized time
-                    if offboard_finish[j]<=Time[j][m]:
-                        offboard_finish[j]=Time[j][m] # offboard finish for drone j based on synchronized time
-
-    
-        fx.append(interpolate.interp1d(Time[j], x[j]))
-        fy.append(interpolate.interp1d(Time[j], y[j]))
-        fz.append(interpolate.interp1d(Time[j], z[j]))
 
     latest_offboard_start=max(offboard_start)
     earliest_offboard_finish=min(offboard_finish)
 
-    # Creating output CSV file --------
-    Output_CSV_file=open(output_CSV_file_dir, 'w')
-    writer = csv.writer(Output_CSV_file)
-    header=['x(m)', 'y(m)', 'z(m)', 'time(s)', 'drone id', 'offboard mode status','type of experiment']
-    writer.writerow(header)
+    # Creating output trace file (csv, or parquet/npz by the file extension) --------
+    drones={}
     for j in range(i):
-        for k in range(len(Time[j])):
-            if (Time[j][k]>=latest_offboard_start and Time[j][k]<=earliest_offboard_finish): # drone j was on range of offboard mode at Time[j][k]   
-                row=[x[j][k], y[j][k], z[j][k], Time[j][k]-latest_offboard_start, file_names[j], offboard_mode_status[j][k], sitl_or_real] # x, y , z, time (s), id, status of offboard mode, type of experiment
-                writer.writerow(row)
-    Output_CSV_file.close()
-    
-    # Creating interpolated positions
-    # Adding positions of the latest drone to the interpolted lists
+        in_window=(np.asarray(Time[j])>=latest_offboard_start) & (np.asarray(Time[j])<=earliest_offboard_finish) # drone j was on range of offboard mode at Time[j]
+        drones[file_names[j]]={
+            "time": np.asarray(Time[j])[in_window]-latest_offboard_start,
+            "position": np.array([x[j], y[j], z[j]]).T[in_window],
+            "offboard": np.asarray(offboard_mode_status[j], dtype="int8")[in_window],
+        }
+    save_trace(Trace(drones, sitl_or_real, {"ref_lat": ref_lat, "ref_long": ref_long, "ref_alt": ref_alt}), output_CSV_file_dir)
     
-    for k in range(len(x[latest_drone])): # k is the number of samples of the latest drone
-        if Time[latest_drone][k]<= min_finish_time:
-            interp_time.append(Time[latest_drone][k])
-            interp_length+=1
-    # Adding positions of the latest drone and calculating & adding interpolated positions of the other drones to the total lists
+    # Creating interpolated positions of all drones in one pass, at the sampling times of the latest drone
+    latest_time=np.asarray(Time[latest_drone])
+    interp_time=latest_time[latest_time<=min_finish_time]
     fig_colors=['blue','red', 'lightgreen', 'orange','aqua', 'silver', 'magenta', 'darkkhaki','dodgerblue','green','black','brown']
+    resampled=resample_trajectories(Time[:i], [np.array([x[j], y[j], z[j]]).T for j in range(i)], interp_time) # drones x time x (x, y, z)
+    # Level of detail, plotly slows down with the number of points it is given
+    resampled, interp_time, lines, stride=level_of_detail(resampled, interp_time, max_frames, line_tolerance)
+    interp_length=len(interp_time)
+    X_total=resampled[:, :, 0].reshape(-1).tolist()
+    Y_total=resampled[:, :, 1].reshape(-1).tolist()
+    Z_total=resampled[:, :, 2].reshape(-1).tolist()
+    Time_total=(interp_time-max_start_time).tolist()*i
     for j in range(i): # j is the number of a drone
-        if j==latest_drone:
-            for k in range(len(x[latest_drone])): # k is the number of samples of the latest drone
-                if Time[latest_drone][k]<= min_finish_time:
-                    X_total.append(x[latest_drone][k])
-                    Y_total.append(y[latest_drone][k])
-                    Z_total.append(z[latest_drone][k])
-                    Time_total.append(Time[latest_drone][k]-max_start_time)
-                    labels_total.append(file_names[latest_drone])
-        else:
-            for t in interp_time:
-                X_total.append(float(fx[j](t)))
-                Y_total.append(float(fy[j](t)))
-                Z_total.append(float(fz[j](t)))
-                Time_total.append(t-max_start_time)
-                labels_total.append(file_names[j])
+        labels_total+=[file_names[j]]*interp_length
 
     x_right_margin=x_max+(x_max-x_min)*0.05
     x_left_margin=x_min-(x_max-x_min)*0.05
@@ -302,9 +269,9 @@ def visualize_ulg (**Input):  # input keyword arguments: ref_lat, ref_long, ref_
         
         fig.add_trace(            #should be an object of go
             go.Scatter3d(
-                x=X_total[j*interp_length: ((j+1)*interp_length)], 
-                y=Y_total[j*interp_length: ((j+1)*interp_length)],
-                z=Z_total[j*interp_length: ((j+1)*interp_length)], 
+                x=lines[j][:, 0], 
+                y=lines[j][:, 1],
+                z=lines[j][:, 2], 
                 mode='lines',
                 name="trace of "+file_names[j],
                 marker=dict(color=fig_colors[index_checker(j,len(fig_colors))])
@@ -326,5 +293,6 @@ def visualize_ulg (**Input):  # input keyword arguments: ref_lat, ref_long, ref_
         )
     fig.show()
      
-visualize_ulg(output_CSV_file_dir='/home/m74744sa/Desktop/All_csvs/Real_shot.csv',folder_of_ulg="/home/m74744sa/Desktop/July_5th_shot",ref_lat= 52.816522986211055, ref_long= -4.1271978280723225, ref_alt= 6,drone_size=15, ticks_num=10, sitl_or_real='real')
-#visualize_ulg(output_CSV_file_dir='/path_to_csv_file/csv_file_name.csv', folder_of_ulg='/path_to_folder_containing_ulg_files',ref_lat=latitude of the reference point, ref_long= longitude of the reference point, ref_alt= altitude of the reference point,drone_size= size of drone, ticks_num=number of partitions in the final fig, frame_duration= duration of each frame of animation in seconds)
+if __name__ == "__main__": # the pool of processes parsing the ulg files imports this file again
+    visualize_ulg(output_CSV_file_dir='/home/m74744sa/Desktop/All_csvs/Real_shot.csv',folder_of_ulg="/home/m74744sa/Desktop/July_5th_shot",ref_lat= 52.816522986211055, ref_long= -4.1271978280723225, ref_alt= 6,drone_size=15, ticks_num=10, sitl_or_real='real')
+    #visualize_ulg(output_CSV_file_dir='/path_to_csv_file/csv_file_name.csv', folder_of_ulg='/path_to_folder_containing_ulg_files',ref_lat=latitude of the reference point, ref_long= longitude of the reference point, ref_alt= altitude of the reference point,drone_size= size of drone, ticks_num=number of partitions in the final fig, frame_duration= duration of each frame of animation in seconds)
@@ -2,7 +2,9 @@ import asyncio
 import time
 import paho.mqtt.client as mqtt
 import gtools
+import numpy as np
 from data_structures import AgentTelemetry
+from telemetry_codec import decode_state_frame, decode_swarm_snapshot, decode_telemetry
 
 
 class DroneCommunication:
@@ -17,16 +19,31 @@ class DroneCommunication:
         self.id = agent.id
         self.command_functions = {}
         self.current_command = "none"
+        self.use_swarm_relay = agent.use_swarm_relay
+        self.metrics = agent.metrics
+        # return altitude checksums, Dict{pre_start round (int): Dict{agent id: checksum}},
+        # see gtools.alt_checksum
+        self.alt_checksums = {}
 
     async def run_comms(self):
         self.client.message_callback_add(
-            "+/telemetry/geodetic", self.on_message_geodetic
+            "+/telemetry/geodetic",
+            self.instrumented("geodetic", self.on_message_geodetic),
         )
         self.client.message_callback_add(
-            "+/telemetry/position_ned", self.on_message_position
+            "+/telemetry/position_ned",
+            self.instrumented("position", self.on_message_position),
         )
         self.client.message_callback_add(
-            "+/telemetry/velocity_ned", self.on_message_velocity
+            "+/telemetry/velocity_ned",
+            self.instrumented("velocity", self.on_message_velocity),
+        )
+        self.client.message_callback_add(
+            "+/telemetry/state", self.instrumented("state", self.on_message_state)
+        )
+        self.client.message_callback_add(
+            "swarm/state",
+            self.instrumented("swarm_state", self.on_message_swarm_state),
         )
         self.client.message_callback_add(
             self.id + "/home/altitude", self.on_message_home
@@ -34,6 +51,7 @@ class DroneCommunication:
         self.client.message_callback_add(
             self.id + "/corridor_points", self.on_message_corridor
         )
+        self.client.message_callback_add("+/alt_checksum", self.on_message_alt_checksum)
         self.client.message_callback_add(
             self.id + "/update_parameters", self.on_message_update_parameters
         )
@@ -54,6 +72,28 @@ class DroneCommunication:
         self.client.on_disconnect = self.on_disconnect
         self.client.loop_start()
 
+    def instrumented(self, name, callback):
+        # counts and times the messages handled by callback in the agent metrics
+        def instrumented_callback(mosq, obj, msg):
+            self.metrics.count("mqtt_" + name)
+            with self.metrics.timer("mqtt_" + name):
+                callback(mosq, obj, msg)
+
+        return instrumented_callback
+
+    def stamp(self, agent_id, sequence, timestamp, position=True):
+        # stamps the row of agent_id, returns False for messages arriving out of order,
+        # see SwarmState.stamp for position
+        if timestamp is not None:
+            self.metrics.record("telemetry_latency", time.time() - timestamp)
+        telemetry = self.swarm_manager.telemetry
+        if telemetry.stamp(
+            telemetry.rows[agent_id], sequence, timestamp, position=position
+        ):
+            return True
+        self.metrics.count("telemetry_out_of_order")
+        return False
+
     def close(self):
         self.client.disconnect()
         self.client.loop_stop()
@@ -66,8 +106,11 @@ class DroneCommunication:
         client.subscribe("commands/" + self.id)
         client.subscribe("+/home/altitude")
         client.subscribe("+/corridor_points")
+        client.subscribe("+/alt_checksum")
         client.subscribe(self.id + "/update_parameters")
         client.subscribe(self.id + "/current_experiment")
+        if self.use_swarm_relay:
+            client.subscribe("swarm/state")
         if self.first_connection:
             client.publish(
                 "detection",
@@ -105,34 +148,81 @@ class DroneCommunication:
         print("received new corridor")
         # self.experiment.set_corridor(msg.payload.decode())
 
+    def on_message_alt_checksum(self, mosq, obj, msg):
+        # payload "<round>:<checksum>"
+        alt_round, checksum = msg.payload.decode().split(":")
+        checksums = self.alt_checksums.setdefault(int(alt_round), {})
+        checksums[msg.topic.split("/")[0]] = checksum
+
     def on_message_current_experiment(self, mosq, obj, msg):
         print("selecting experiment")
         self.agent.current_experiment = msg.payload.decode()
 
     def on_message_geodetic(self, mosq, obj, msg):
-        # Remove none numeric parts of string and then split into north east and down
-        received_string = msg.payload.decode().strip("()")
-        string_list = received_string.split(", ")
-        geodetic = [float(i) for i in string_list]
+        # payloads can be in the text or the binary telemetry format
+        geodetic, sequence, timestamp = decode_telemetry(msg.payload)
         # time.sleep(1)  # simulating comm latency
         # replace reference to first 4 characters of topic with splitting topic at /
-        self.swarm_manager.telemetry[msg.topic[0:4]].geodetic = geodetic
+        if self.stamp(msg.topic[0:4], sequence, timestamp, position=False):
+            self.swarm_manager.telemetry[msg.topic[0:4]].geodetic = geodetic
 
     def on_message_position(self, mosq, obj, msg):
-        # Remove none numeric parts of string and then split into north east and down
-        received_string = msg.payload.decode().strip("()")
-        string_list = received_string.split(", ")
-        position = [float(i) for i in string_list]
+        position, sequence, timestamp = decode_telemetry(msg.payload)
         # time.sleep(1)  # simulating comm latency
-        self.swarm_manager.telemetry[msg.topic[0:4]].position_ned = position
+        # positions arriving out of order are dropped, text payloads are stamped with
+        # the receive time
+        if self.stamp(msg.topic[0:4], sequence, timestamp):
+            self.swarm_manager.telemetry[msg.topic[0:4]].position_ned = position
 
     def on_message_velocity(self, mosq, obj, msg):
-        # Remove none numeric parts of string and then split into north east and down
-        received_string = msg.payload.decode().strip("[]")
-        string_list = received_string.split(", ")
-        velocity = [float(i) for i in string_list]
+        velocity, sequence, timestamp = decode_telemetry(msg.payload)
         # time.sleep(1)  # simulating comm latency
-        self.swarm_manager.telemetry[msg.topic[0:4]].velocity_ned = velocity
+        if self.stamp(msg.topic[0:4], sequence, timestamp, position=False):
+            self.swarm_manager.telemetry[msg.topic[0:4]].velocity_ned = velocity
+
+    def on_message_state(self, mosq, obj, msg):
+        # one state frame updates every field of the agent from the same instant
+        (
+            position,
+            velocity,
+            geodetic,
+            heading,
+            sequence,
+            timestamp,
+        ) = decode_state_frame(msg.payload)
+        if not self.stamp(msg.topic[0:4], sequence, timestamp):
+            return
+        agent_telemetry = self.swarm_manager.telemetry[msg.topic[0:4]]
+        agent_telemetry.position_ned = position
+        agent_telemetry.velocity_ned = velocity
+        agent_telemetry.geodetic = geodetic
+        agent_telemetry.heading = heading
+
+    def on_message_swarm_state(self, mosq, obj, msg):
+        # the relay publishes every agent in one message, the own row is kept as it is
+        # updated from the autopilot directly
+        ids, records, sequence, timestamp = decode_swarm_snapshot(msg.payload)
+        telemetry = self.swarm_manager.telemetry
+        rows = []
+        indices = []
+        for index, agent_id in enumerate(ids):
+            if agent_id == self.id:
+                continue
+            if agent_id not in telemetry:
+                telemetry[agent_id] = AgentTelemetry()
+            rows.append(telemetry.rows[agent_id])
+            indices.append(index)
+        if len(rows) == 0:
+            return
+        records = records[indices]
+        telemetry.update_rows(
+            np.array(rows),
+            records["position_ned"],
+            records["velocity_ned"],
+            records["geodetic"],
+            records["heading"],
+            records["timestamp"],
+        )
 
     def on_message_update_parameters(self, mosq, obj, msg):
         print("received updated parameter")
@@ -150,7 +240,8 @@ class DroneCommunication:
         # adds a new agent to the swarm if they are not already present
         if new_id not in self.swarm_manager.telemetry:
             self.swarm_manager.telemetry[new_id] = AgentTelemetry()
-            self.client.subscribe(new_id + "/telemetry/+")
+            if not self.use_swarm_relay:
+                self.client.subscribe(new_id + "/telemetry/+")
             # publish ID so that new agent can add it to their dict
             self.client.publish(
                 "detection",
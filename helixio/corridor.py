@@ -0,0 +1,448 @@
+from __future__ import annotations
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+from corridor_curves import curve_from_definition
+import gtools
+
+# segments of two paths within this angle in degrees count as parallel for switching
+SWITCH_ANGLE_TOLERANCE = 0.01
+
+# compiled corridors are cached in this directory next to the experiment files
+CORRIDOR_CACHE_DIR = "corridor_cache"
+# part of the cache key, increment it whenever the compilation or the cached arrays
+# change so older cache entries are not loaded
+CORRIDOR_CACHE_VERSION = 2
+_CORRIDOR_ARRAYS = (
+    "points",
+    "directions",
+    "segment_length",
+    "length",
+    "lane_radius",
+    "rotation_dir",
+    "switch_path",
+    "switch_index",
+    "switch_vector",
+)
+
+
+def _row_dot(a, b):
+    # dot products of the rows of a and b, summed like np.dot so the directions are
+    # exactly those of the original per point loops
+    return (a[..., None, :] @ b[..., :, None])[..., 0, 0]
+
+
+class CorridorGeometry:
+    """
+    Corridor paths packed into padded arrays so the targets of a whole swarm can be
+    looked up with one fancy index instead of per agent list lookups
+
+    Attributes
+    ------------
+    points: (P, L, 3) array of corridor points, rows past length[j] are padding
+    directions: (P, L, 3) array of unit vectors from point i to point i + 1 of a path
+    length: (P,) number of points in each path
+    lane_radius: (P,) corridor radius of each path
+    rotation_dir: (P,) rotation direction of each path
+    switch_path: (P, L, K) lane graph, the paths an agent at point i of path j can
+        switch to, one slot per adjacent path starting from path j + 1, -1 if unused
+    switch_index: (P, L, K) adjacent point on switch_path, -1 if the slot is unused
+    switch_vector: (P, L, K, 3) unit vector from the adjacent point to point i
+    segment_length: (P, L) distance from point i to point i + 1 of a path
+    curves: List[Curve or None] closed form of each path given as a curve definition
+    """
+
+    def __init__(
+        self,
+        points,
+        directions,
+        length,
+        lane_radius,
+        rotation_dir,
+        switch_path,
+        switch_index,
+        switch_vector,
+        segment_length=None,
+        curves=None,
+    ):
+        self.points = points
+        self.directions = directions
+        self.length = length
+        self.lane_radius = lane_radius
+        self.rotation_dir = rotation_dir
+        self.switch_path = switch_path
+        self.switch_index = switch_index
+        self.switch_vector = switch_vector
+        if segment_length is None:
+            # the last point of a path connects back to the first
+            row = np.arange(points.shape[1])
+            following = (row[None, :] + 1) % np.maximum(length[:, None], 1)
+            step = points[np.arange(len(length))[:, None], following] - points
+            segment_length = np.where(
+                row[None, :] < length[:, None], np.sqrt(_row_dot(step, step)), 0
+            )
+        self.segment_length = segment_length
+        self.curves = [None] * len(length) if curves is None else curves
+
+    @property
+    def path_count(self) -> int:
+        return len(self.length)
+
+    @classmethod
+    def compile(
+        cls,
+        points,
+        lane_radius,
+        rotation_dir,
+        switch_angle_tolerance=SWITCH_ANGLE_TOLERANCE,
+    ) -> CorridorGeometry:
+        """
+        Computes the directions of the corridor paths and the lane graph linking the
+        points of every path to the adjacent points of the other paths
+
+        Parameters
+        ------------
+        points: List[List[point (list of 3)] or curve definition (Dict)] corridor
+            points of each path, curves are sampled into points, see corridor_curves
+        lane_radius: List[radius (float)] corridor radius of each path
+        rotation_dir: List[direction (int)] rotation direction of each path
+        switch_angle_tolerance: largest angle in degrees between two segments that
+            still counts as parallel
+
+        Returns
+        -----------
+        CorridorGeometry
+        """
+        curves = [corridor_curves(path) for path in points]
+        paths = [
+            np.asarray(
+                path if curve is None else curve.sample(), dtype="float64"
+            ).reshape(-1, 3)
+            for path, curve in zip(points, curves)
+        ]
+        path_count = len(paths)
+        length = np.array([len(path) for path in paths], dtype="int64")
+        max_length = int(length.max())
+
+        packed_points = np.zeros((path_count, max_length, 3), dtype="float64")
+        directions = np.zeros((path_count, max_length, 3), dtype="float64")
+        segment_length = np.zeros((path_count, max_length), dtype="float64")
+
+        for j, path in enumerate(paths):  # j is the number of a path
+            # the last point of a path points back to the first
+            step = np.roll(path, -1, axis=0) - path
+            norm = np.sqrt(_row_dot(step, step))
+            packed_points[j, : length[j]] = path
+            directions[j, : length[j]] = step / norm[:, None]
+            segment_length[j, : length[j]] = norm
+
+        switch_path, switch_index, switch_vector = _lane_graph(
+            packed_points,
+            directions,
+            length,
+            np.asarray(lane_radius, dtype="float64"),
+            np.cos(np.radians(switch_angle_tolerance)),
+        )
+        return cls(
+            packed_points,
+            directions,
+            length,
+            np.asarray(lane_radius, dtype="float64"),
+            np.asarray(rotation_dir, dtype="float64"),
+            switch_path,
+            switch_index,
+            switch_vector,
+            segment_length,
+            curves,
+        )
+
+    def save(self, directory) -> None:
+        # one .npy file per array so they can be memory mapped by load
+        os.makedirs(directory, exist_ok=True)
+        for name in _CORRIDOR_ARRAYS:
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r") -> CorridorGeometry:
+        arrays = {
+            name: np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+            for name in _CORRIDOR_ARRAYS
+        }
+        return cls(**arrays)
+
+    def path_points(self, j):
+        # the points of path j without padding
+        return self.points[j, : self.length[j]]
+
+    def path_directions(self, j):
+        return self.directions[j, : self.length[j]]
+
+    def adjacent_paths(self, j):
+        # the paths an agent on path j can switch to somewhere along it
+        paths = np.unique(self.switch_path[j, : self.length[j]])
+        return [int(path) for path in paths if path >= 0]
+
+
+def _lane_graph(points, directions, length, lane_radius, min_cos_of_angle):
+    """
+    Links every point of a path to the last point of each other path that lies within
+    the sum of both corridor radii on a parallel segment. The slots of a point are
+    filled in path order starting from the next path, so with two paths or with
+    adjacent paths numbered in sequence slot 0 holds the adjacent point of path j + 1.
+
+    Returns
+    -----------
+    switch_path, switch_index: (P, L, K) arrays, -1 in unused slots
+    switch_vector: (P, L, K, 3) unit vectors from the adjacent points
+    """
+    path_count, max_length = len(length), points.shape[1]
+    path = np.repeat(np.arange(path_count), length)
+    index = np.arange(len(path)) - np.repeat(np.cumsum(length) - length, length)
+    flat_points = points[path, index]
+    flat_directions = directions[path, index]
+
+    # candidate pairs within the largest sum of two radii, from the neighbour grid
+    max_reach = 2 * float(lane_radius.max(initial=0))
+    if max_reach > 0 and path_count > 1:
+        grid = gtools.NeighbourGrid(flat_points, max_reach)
+        rows, other, distance = grid.query_points(flat_points, max_reach)
+    else:
+        rows = other = np.zeros(0, dtype="int64")
+        distance = np.zeros(0)
+    adjacent = (
+        (path[rows] != path[other])
+        & (distance <= lane_radius[path[rows]] + lane_radius[path[other]])
+        & (
+            np.einsum("ij,ij->i", flat_directions[rows], flat_directions[other])
+            >= min_cos_of_angle
+        )
+    )
+    rows, other, distance = rows[adjacent], other[adjacent], distance[adjacent]
+
+    # the last adjacent point of each other path, in path order from path j + 1
+    order_of_path = (path[other] - path[rows] - 1) % path_count
+    order = np.lexsort((index[other], order_of_path, rows))
+    rows, other, distance = rows[order], other[order], distance[order]
+    group = np.stack((rows, order_of_path[order]))
+    last = np.ones(len(rows), dtype="bool")
+    last[:-1] = np.any(group[:, 1:] != group[:, :-1], axis=0)
+    rows, other, distance = rows[last], other[last], distance[last]
+
+    # slot of each link, counted from the first link of its point
+    first = np.ones(len(rows), dtype="bool")
+    first[1:] = rows[1:] != rows[:-1]
+    start = np.flatnonzero(first)
+    slot = np.arange(len(rows)) - np.repeat(start, np.diff(np.append(start, len(rows))))
+
+    slots = max(int(slot.max(initial=0)) + 1, 1)
+    switch_path = np.full((path_count, max_length, slots), -1, dtype="int64")
+    switch_index = np.full((path_count, max_length, slots), -1, dtype="int64")
+    switch_vector = np.zeros((path_count, max_length, slots, 3), dtype="float64")
+    vector = flat_points[rows] - flat_points[other]
+    nonzero = distance != 0
+    vector[nonzero] /= distance[nonzero, None]
+    switch_path[path[rows], index[rows], slot] = path[other]
+    switch_index[path[rows], index[rows], slot] = index[other]
+    switch_vector[path[rows], index[rows], slot] = vector
+    return switch_path, switch_index, switch_vector
+
+
+class SegmentIndex:
+    """
+    Finds the segment of a corridor path a position is on, i.e. the segment from point
+    i to point i + 1 closest to it, and how far along the path that is. A neighbour
+    grid over the segment midpoints of every path narrows the search down to the
+    segments near the position, positions far from the path check every segment.
+
+    Parameters
+    ------------
+    corridor: the CorridorGeometry indexed
+    repeat: the paths are closed loops, without it the segment from the last point
+        back to the first is left out as the agents never fly it
+    use_grid: without it every segment of the path is checked
+
+    Attributes
+    ------------
+    arc_length: (P, L + 1) distance along each path to the start of every segment,
+        arc_length[j, length[j]] is the length of the closed path j
+    """
+
+    def __init__(self, corridor, repeat=True, use_grid=True):
+        self.corridor = corridor
+        self.repeat = repeat
+        length = corridor.length
+        segment = np.arange(corridor.points.shape[1])
+        following = (segment[None, :] + 1) % np.maximum(length[:, None], 1)
+        self._step = (
+            corridor.points[np.arange(corridor.path_count)[:, None], following]
+            - corridor.points
+        )
+        self.arc_length = np.zeros((corridor.path_count, len(segment) + 1))
+        self.arc_length[:, 1:] = np.cumsum(corridor.segment_length, axis=1)
+        # segments searched on each path, open paths have no closing segment
+        self._segment_count = length.copy()
+        if not repeat:
+            self._segment_count[length > 1] -= 1
+        # half of the longest segment, a segment closer than the nearest midpoint has
+        # its midpoint within this much further
+        self._reach = np.array(
+            [
+                corridor.segment_length[j, : self._segment_count[j]].max(initial=0) / 2
+                for j in range(corridor.path_count)
+            ]
+        )
+        self._grids = None
+        if use_grid:
+            midpoints = corridor.points + self._step / 2
+            # positions up to twice the lane radius away from the path are found in
+            # the grid, see _candidates
+            cell_size = 2 * (np.asarray(corridor.lane_radius) + 2 * self._reach)
+            self._grids = [
+                gtools.NeighbourGrid(
+                    midpoints[j, : self._segment_count[j]], max(cell_size[j], 1e-3)
+                )
+                for j in range(corridor.path_count)
+            ]
+
+    def locate(self, paths, positions):
+        """
+        Parameters
+        ------------
+        paths: (N,) path searched for each position
+        positions: (N, 3) NED positions
+
+        Returns
+        -----------
+        segments: (N,) index of the closest segment, ties go to the lowest index
+        arc_length: (N,) distance along the path to the closest point of the segment
+        distance: (N,) distance from the position to that point
+        """
+        positions = np.asarray(positions, dtype="float64").reshape(-1, 3)
+        paths = np.broadcast_to(np.asarray(paths, dtype="int64"), (len(positions),))
+        rows, candidates = self._candidates(paths, positions)
+
+        path = paths[rows]
+        step = self._step[path, candidates]
+        squared_length = np.einsum("ij,ij->i", step, step)
+        offset = positions[rows] - self.corridor.points[path, candidates]
+        fraction = np.einsum("ij,ij->i", offset, step) / np.where(
+            squared_length == 0, 1, squared_length
+        )
+        fraction = np.clip(fraction, 0, 1)
+        error = offset - fraction[:, None] * step
+        distance = np.sqrt(np.einsum("ij,ij->i", error, error))
+
+        # the closest candidate of every row, by distance then by segment
+        order = np.lexsort((candidates, distance, rows))
+        _, first = np.unique(rows[order], return_index=True)
+        best = order[first]
+        segments = candidates[best]
+        along = fraction[best] * self.corridor.segment_length[paths, segments]
+        return segments, self.arc_length[paths, segments] + along, distance[best]
+
+    def _candidates(self, paths, positions):
+        # (rows, segments) pairs to check
+        if self._grids is None:
+            return self._all_segments(paths, np.arange(len(positions)))
+
+        rows = []
+        candidates = []
+        far = []
+        for j in np.unique(paths):
+            path_rows = np.flatnonzero(paths == j)
+            grid = self._grids[j]
+            point_rows, segments, distances = grid.query_points(positions[path_rows])
+            # a segment closer than the nearest midpoint m has its midpoint within
+            # m + reach, the grid holds all of them when m + reach is within its radius
+            nearest = np.full(len(path_rows), np.inf)
+            np.minimum.at(nearest, point_rows, distances)
+            found = nearest + self._reach[j] <= grid.cell_size
+            keep = found[point_rows] & (
+                distances <= nearest[point_rows] + self._reach[j] + 1e-9
+            )
+            rows.append(path_rows[point_rows[keep]])
+            candidates.append(segments[keep])
+            far.append(path_rows[~found])
+        far_rows, far_candidates = self._all_segments(paths, np.concatenate(far))
+        rows.append(far_rows)
+        candidates.append(far_candidates)
+        return np.concatenate(rows), np.concatenate(candidates).astype("int64")
+
+    def _all_segments(self, paths, rows):
+        # every segment of the path of each row
+        count = self._segment_count[paths[rows]]
+        starts = np.repeat(np.cumsum(count) - count, count)
+        return np.repeat(rows, count), np.arange(count.sum()) - starts
+
+
+def corridor_curves(path):
+    # the Curve of a path given as a curve definition, None for a list of points
+    if isinstance(path, dict):
+        return curve_from_definition(path)
+    return None
+
+
+def corridor_cache_key(experiment_file_path) -> str:
+    # the compiled corridor is only valid for the exact experiment file it came from,
+    # compiled by the same version of the code
+    key = hashlib.sha256(str(CORRIDOR_CACHE_VERSION).encode() + b"\n")
+    with open(experiment_file_path, "rb") as f:
+        key.update(f.read())
+    return key.hexdigest()
+
+
+def load_corridor(experiment_file_path, experiment_parameters, cache_dir=None):
+    """
+    Loads the compiled corridor of an experiment from the cache, compiling and caching
+    it when the experiment file has not been seen before
+
+    Parameters
+    ------------
+    experiment_file_path: path of the experiment json file
+    experiment_parameters: the parsed experiment json file
+    cache_dir: defaults to CORRIDOR_CACHE_DIR next to the experiment file
+
+    Returns
+    -----------
+    CorridorGeometry, memory mapped when it was loaded from the cache
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(
+            os.path.dirname(os.path.abspath(experiment_file_path)), CORRIDOR_CACHE_DIR
+        )
+    directory = os.path.join(cache_dir, corridor_cache_key(experiment_file_path))
+    if os.path.isdir(directory):
+        try:
+            corridor = CorridorGeometry.load(directory)
+            # the curves are not cached, they are cheap to build without sampling
+            corridor.curves = [
+                corridor_curves(path)
+                for path in experiment_parameters["corridor_points"]
+            ]
+            return corridor
+        except (OSError, ValueError):
+            # unreadable cache entry, e.g. from an older version, compile it again
+            shutil.rmtree(directory, ignore_errors=True)
+
+    corridor = CorridorGeometry.compile(
+        experiment_parameters["corridor_points"],
+        experiment_parameters["corridor_radius"],
+        experiment_parameters["path_rotation_dir"],
+        experiment_parameters.get("switch_angle_tolerance", SWITCH_ANGLE_TOLERANCE),
+    )
+    try:
+        # written to a temporary directory and renamed, so agents starting at the same
+        # time never load a partially written entry
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary = tempfile.mkdtemp(dir=cache_dir)
+        corridor.save(temporary)
+        try:
+            os.rename(temporary, directory)
+        except OSError:
+            # another process cached it first
+            shutil.rmtree(temporary, ignore_errors=True)
+    except OSError as error:
+        print("could not cache corridor: " + str(error))
+    return corridor
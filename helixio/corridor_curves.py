@@ -0,0 +1,232 @@
+from abc import ABC, abstractmethod
+import numpy as np
+
+# number of corridor points sampled from a curve without "samples" in its definition
+DEFAULT_SAMPLES = 100
+
+
+class Curve(ABC):
+    """
+    Corridor path given in closed form over the parameter u in [0, 1]. The path
+    following engine works on points sampled from the curve, the closed form is used
+    for the target point and direction between two samples. Subclasses implement
+    evaluate and tangent.
+
+    Attributes
+    ------------
+    samples: number of corridor points sampled from the curve
+    closed: the curve ends where it starts, the last sample is then left out as the
+        corridor closes the loop back to the first point itself
+    """
+
+    closed = False
+
+    def __init__(self, samples=DEFAULT_SAMPLES):
+        self.samples = int(samples)
+
+    @abstractmethod
+    def evaluate(self, u):
+        # (len(u), 3) points of the curve
+        pass
+
+    @abstractmethod
+    def tangent(self, u):
+        # (len(u), 3) derivative of the curve with respect to u, not normalised
+        pass
+
+    def sample_parameters(self):
+        if self.closed:
+            return np.arange(self.samples) / self.samples
+        return np.linspace(0, 1, self.samples)
+
+    def sample(self):
+        return self.evaluate(self.sample_parameters())
+
+    def parameter(self, index, fraction):
+        """
+        Parameters
+        ------------
+        index: (N,) corridor point the agents are heading from
+        fraction: (N,) how far the agents are towards the next point, from 0 to 1
+
+        Returns
+        -----------
+        u: (N,) curve parameter, nan on the segment an open curve closes its loop with
+        """
+        index = np.asarray(index, dtype="float64")
+        if self.closed:
+            return (index + fraction) / self.samples
+        return np.where(
+            index < self.samples - 1, (index + fraction) / (self.samples - 1), np.nan
+        )
+
+
+class Line(Curve):
+    def __init__(self, start, end, samples=DEFAULT_SAMPLES):
+        super().__init__(samples)
+        self.start = np.asarray(start, dtype="float64")
+        self.end = np.asarray(end, dtype="float64")
+
+    def evaluate(self, u):
+        u = np.asarray(u, dtype="float64").reshape(-1)
+        return self.start + u[:, None] * (self.end - self.start)
+
+    def tangent(self, u):
+        u = np.asarray(u, dtype="float64").reshape(-1)
+        return np.broadcast_to(self.end - self.start, (len(u), 3)).copy()
+
+
+class Arc(Curve):
+    """
+    Circular or elliptical arc, point = center + radius_u cos(angle) u_axis
+    + radius_v sin(angle) v_axis with the angle going from start_angle to end_angle in
+    degrees. A sweep of a whole number of turns gives a closed curve.
+    """
+
+    def __init__(
+        self,
+        center,
+        radius,
+        start_angle,
+        end_angle,
+        u_axis=(1, 0, 0),
+        v_axis=(0, 1, 0),
+        samples=DEFAULT_SAMPLES,
+    ):
+        super().__init__(samples)
+        self.center = np.asarray(center, dtype="float64")
+        self.radius = np.broadcast_to(np.asarray(radius, dtype="float64"), (2,))
+        self.start_angle = np.radians(start_angle)
+        self.sweep = np.radians(end_angle - start_angle)
+        self.u_axis = np.asarray(u_axis, dtype="float64")
+        self.v_axis = np.asarray(v_axis, dtype="float64")
+        turns = abs(end_angle - start_angle) / 360
+        self.closed = turns > 0 and np.isclose(turns, round(turns))
+
+    def evaluate(self, u):
+        angle = self.start_angle + self.sweep * np.asarray(u, dtype="float64").reshape(
+            -1
+        )
+        return (
+            self.center
+            + (self.radius[0] * np.cos(angle))[:, None] * self.u_axis
+            + (self.radius[1] * np.sin(angle))[:, None] * self.v_axis
+        )
+
+    def tangent(self, u):
+        angle = self.start_angle + self.sweep * np.asarray(u, dtype="float64").reshape(
+            -1
+        )
+        return self.sweep * (
+            (-self.radius[0] * np.sin(angle))[:, None] * self.u_axis
+            + (self.radius[1] * np.cos(angle))[:, None] * self.v_axis
+        )
+
+
+class Helix(Arc):
+    """
+    Arc moving climb metres along u_axis x v_axis over its sweep, i.e. downwards for
+    the default north and east axes, so a climbing helix has a negative climb
+    """
+
+    def __init__(
+        self,
+        center,
+        radius,
+        start_angle,
+        end_angle,
+        climb,
+        u_axis=(1, 0, 0),
+        v_axis=(0, 1, 0),
+        samples=DEFAULT_SAMPLES,
+    ):
+        super().__init__(
+            center, radius, start_angle, end_angle, u_axis, v_axis, samples
+        )
+        axis = np.cross(self.u_axis, self.v_axis)
+        self.climb = climb * axis / np.linalg.norm(axis)
+        self.closed = False
+
+    def evaluate(self, u):
+        u = np.asarray(u, dtype="float64").reshape(-1)
+        return super().evaluate(u) + u[:, None] * self.climb
+
+    def tangent(self, u):
+        return super().tangent(u) + self.climb
+
+
+class CubicSpline(Curve):
+    """
+    Cubic (Catmull-Rom) spline through the given points, closed back to the first
+    point if closed is set. Every span between two points takes the same share of u.
+    """
+
+    def __init__(self, points, closed=False, samples=DEFAULT_SAMPLES):
+        super().__init__(samples)
+        self.points = np.asarray(points, dtype="float64").reshape(-1, 3)
+        self.closed = bool(closed)
+        count = len(self.points)
+        self.spans = count if self.closed else count - 1
+
+    def _span(self, u):
+        # span of each u, the position within it and the 4 points defining it
+        position = np.asarray(u, dtype="float64").reshape(-1) * self.spans
+        span = np.clip(np.floor(position).astype("int64"), 0, self.spans - 1)
+        t = (position - span)[:, None]
+        index = span[:, None] + np.arange(-1, 3)[None, :]
+        count = len(self.points)
+        if self.closed:
+            index %= count
+        else:
+            index = np.clip(index, 0, count - 1)
+        p0, p1, p2, p3 = (self.points[index[:, k]] for k in range(4))
+        return t, p0, p1, p2, p3
+
+    def evaluate(self, u):
+        t, p0, p1, p2, p3 = self._span(u)
+        return 0.5 * (
+            2 * p1
+            + (p2 - p0) * t
+            + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t**2
+            + (3 * p1 - p0 - 3 * p2 + p3) * t**3
+        )
+
+    def tangent(self, u):
+        t, p0, p1, p2, p3 = self._span(u)
+        return (
+            0.5
+            * self.spans
+            * (
+                (p2 - p0)
+                + 2 * (2 * p0 - 5 * p1 + 4 * p2 - p3) * t
+                + 3 * (3 * p1 - p0 - 3 * p2 + p3) * t**2
+            )
+        )
+
+
+CORRIDOR_CURVES = {
+    "line": Line,
+    "arc": Arc,
+    "helix": Helix,
+    "spline": CubicSpline,
+}
+
+
+def curve_from_definition(definition) -> Curve:
+    """
+    Parameters
+    ------------
+    definition: Dict from an experiment json file, "type" is one of CORRIDOR_CURVES
+        and the other keys are the arguments of that curve, e.g.
+        {"type": "arc", "center": [0, 0, -60], "radius": 40, "start_angle": 0,
+        "end_angle": 360}
+
+    Returns
+    -----------
+    Curve
+    """
+    arguments = dict(definition)
+    curve_type = arguments.pop("type", None)
+    if curve_type not in CORRIDOR_CURVES:
+        raise ValueError("unknown corridor curve type: " + str(curve_type))
+    return CORRIDOR_CURVES[curve_type](**arguments)
@@ -1,3 +1,8 @@
+from __future__ import annotations
+import time
+import numpy as np
+
+
 class AgentTelemetry:
     def __init__(self):
         self.arm_status = False
@@ -6,3 +11,272 @@ class AgentTelemetry:
         self.heading = 0.0
         self.position_ned = [0, 0, 0]
         self.velocity_ned = [0, 0, 0]
+
+
+class SwarmState:
+    """
+    Telemetry of the whole swarm held in preallocated contiguous arrays, one row per
+    agent. An agent keeps the row it was given when it was added, so consumers can
+    read the arrays directly instead of rebuilding them from AgentTelemetry objects.
+
+    It can be used where a Dict{agent id (string): AgentTelemetry} is expected:
+    swarm_state[agent_id] returns an AgentView with the attributes of AgentTelemetry,
+    and assigning an AgentTelemetry to a new id adds the agent.
+
+    Attributes
+    ------------
+    rows: Dict{agent id (string): row (int)}
+    ids: List[agent id (string)] in row order
+    positions, velocities, geodetic: (N, 3) arrays of the N agents
+    heading: (N,) heading in degrees
+    arm_status: (N,) arm status flags
+    flight_mode: List[flight mode (string)] in row order
+    sequences: (N,) sequence number of the latest accepted state, -1 before the first
+    timestamps: (N,) unix time the latest position was sampled, the receive time
+        when the sender did not stamp it
+    received: (N,) unix time the latest state was received
+    position_version: incremented on every position update
+    """
+
+    def __init__(self, capacity=16):
+        self.rows = {}
+        self.ids = []
+        self.flight_mode = []
+        self.position_version = 0
+        self._views = {}
+        self._positions = np.zeros((capacity, 3), dtype="float64")
+        self._velocities = np.zeros((capacity, 3), dtype="float64")
+        self._geodetic = np.zeros((capacity, 3), dtype="float64")
+        self._heading = np.zeros(capacity, dtype="float64")
+        self._arm_status = np.zeros(capacity, dtype="bool")
+        self._sequences = np.full(capacity, -1, dtype="int64")
+        self._timestamps = np.zeros(capacity, dtype="float64")
+        self._received = np.zeros(capacity, dtype="float64")
+
+    @property
+    def positions(self):
+        return self._positions[: len(self.ids)]
+
+    @property
+    def velocities(self):
+        return self._velocities[: len(self.ids)]
+
+    @property
+    def geodetic(self):
+        return self._geodetic[: len(self.ids)]
+
+    @property
+    def heading(self):
+        return self._heading[: len(self.ids)]
+
+    @property
+    def arm_status(self):
+        return self._arm_status[: len(self.ids)]
+
+    @property
+    def sequences(self):
+        return self._sequences[: len(self.ids)]
+
+    @property
+    def timestamps(self):
+        return self._timestamps[: len(self.ids)]
+
+    @property
+    def received(self):
+        return self._received[: len(self.ids)]
+
+    def add_agent(self, agent_id) -> int:
+        # returns the row of the agent, adding it if it is not already present
+        if agent_id in self.rows:
+            return self.rows[agent_id]
+        row = len(self.ids)
+        if row == len(self._positions):
+            self._grow()
+        self.rows[agent_id] = row
+        self.ids.append(agent_id)
+        self.flight_mode.append("NONE")
+        self._positions[row] = 0
+        self._velocities[row] = 0
+        self._geodetic[row] = 0
+        self._heading[row] = 0
+        self._arm_status[row] = False
+        self._sequences[row] = -1
+        self._timestamps[row] = 0
+        self._received[row] = 0
+        self._views[agent_id] = AgentView(self, row)
+        return row
+
+    def _grow(self):
+        # doubles the capacity, rows keep their index so views stay valid
+        self._positions = np.concatenate(
+            (self._positions, np.zeros_like(self._positions))
+        )
+        self._velocities = np.concatenate(
+            (self._velocities, np.zeros_like(self._velocities))
+        )
+        self._geodetic = np.concatenate((self._geodetic, np.zeros_like(self._geodetic)))
+        self._heading = np.concatenate((self._heading, np.zeros_like(self._heading)))
+        self._arm_status = np.concatenate(
+            (self._arm_status, np.zeros_like(self._arm_status))
+        )
+        self._sequences = np.concatenate(
+            (self._sequences, np.full_like(self._sequences, -1))
+        )
+        self._timestamps = np.concatenate(
+            (self._timestamps, np.zeros_like(self._timestamps))
+        )
+        self._received = np.concatenate((self._received, np.zeros_like(self._received)))
+
+    def set_position(self, row, position):
+        self._positions[row] = position
+        self.position_version += 1
+
+    def stamp(
+        self, row, sequence=None, timestamp=None, received=None, position=True
+    ) -> bool:
+        """
+        Records when the state of a row was sampled and received. Call it before
+        writing the state and drop the update when it returns False.
+
+        Parameters
+        ------------
+        row: row of the agent
+        sequence: message counter of the sender, None when the message has none
+        timestamp: unix time the state was sampled, None when the message has none
+        received: unix time the message was received, defaults to now
+        position: False for messages without a position, e.g. a velocity. They are
+            checked against the same sequence but leave timestamps, which positions
+            are extrapolated from, as they are
+
+        Returns
+        -----------
+        accepted: False when the message is older than the latest state of the row,
+            i.e. an earlier sequence number that is not newer in time either (a
+            restarted sender starts counting from 0 again)
+        """
+        if received is None:
+            received = time.time()
+        last = self._sequences[row]
+        if sequence is not None and last >= 0:
+            # sequences wrap at 2**32, half the range behind counts as older
+            behind = (int(last) - sequence) % (1 << 32)
+            if 0 < behind < (1 << 31) and (
+                timestamp is None or timestamp <= self._timestamps[row]
+            ):
+                return False
+        if sequence is not None:
+            self._sequences[row] = sequence
+        if position:
+            self._timestamps[row] = received if timestamp is None else timestamp
+        self._received[row] = received
+        return True
+
+    def update_rows(
+        self, rows, positions, velocities, geodetic, heading, timestamps=None
+    ):
+        # writes the state of many agents at once, e.g. from a swarm snapshot
+        self._positions[rows] = positions
+        self._velocities[rows] = velocities
+        self._geodetic[rows] = geodetic
+        self._heading[rows] = heading
+        received = time.time()
+        self._timestamps[rows] = received if timestamps is None else timestamps
+        self._received[rows] = received
+        self.position_version += 1
+
+    # Dict of AgentTelemetry compatibility ---------------------------------------------
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, agent_id):
+        return agent_id in self.rows
+
+    def __iter__(self):
+        return iter(list(self.ids))
+
+    def __getitem__(self, agent_id) -> AgentView:
+        return self._views[agent_id]
+
+    def __setitem__(self, agent_id, telemetry):
+        self.add_agent(agent_id)
+        view = self._views[agent_id]
+        view.arm_status = telemetry.arm_status
+        view.flight_mode = telemetry.flight_mode
+        view.geodetic = telemetry.geodetic
+        view.heading = telemetry.heading
+        view.position_ned = telemetry.position_ned
+        view.velocity_ned = telemetry.velocity_ned
+
+    def keys(self):
+        return list(self.ids)
+
+    def values(self):
+        return [self._views[agent_id] for agent_id in self.ids]
+
+    def items(self):
+        return [(agent_id, self._views[agent_id]) for agent_id in self.ids]
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+
+class AgentView:
+    """
+    Row of a SwarmState with the attributes of AgentTelemetry. The vector attributes
+    are read only views into the swarm arrays, assigning to them writes the row.
+    """
+
+    def __init__(self, state, row):
+        self._state = state
+        self._row = row
+
+    @property
+    def arm_status(self):
+        return bool(self._state._arm_status[self._row])
+
+    @arm_status.setter
+    def arm_status(self, value):
+        self._state._arm_status[self._row] = value
+
+    @property
+    def flight_mode(self):
+        return self._state.flight_mode[self._row]
+
+    @flight_mode.setter
+    def flight_mode(self, value):
+        self._state.flight_mode[self._row] = value
+
+    @property
+    def geodetic(self):
+        return _read_only(self._state._geodetic[self._row])
+
+    @geodetic.setter
+    def geodetic(self, value):
+        self._state._geodetic[self._row] = value
+
+    @property
+    def heading(self):
+        return float(self._state._heading[self._row])
+
+    @heading.setter
+    def heading(self, value):
+        self._state._heading[self._row] = value
+
+    @property
+    def position_ned(self):
+        return _read_only(self._state._positions[self._row])
+
+    @position_ned.setter
+    def position_ned(self, value):
+        self._state.set_position(self._row, value)
+
+    @property
+    def velocity_ned(self):
+        return _read_only(self._state._velocities[self._row])
+
+    @velocity_ned.setter
+    def velocity_ned(self, value):
+        self._state._velocities[self._row] = value
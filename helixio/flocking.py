@@ -37,7 +37,9 @@ def limit_accelleration(desired_vel, current_vel, time_step, max_accel_mag):
     return output_vel
 
 
-def simple_flocking(drone_id, swarm_pos_vel, my_pos_vel, time_step, max_accel):
+def simple_flocking(
+    drone_id, swarm_pos_vel, my_pos_vel, time_step, max_accel, neighbour_grid=None
+):
     com = np.array([0, 0, 0])
     k_cohesion = 1
     for key in swarm_pos_vel:
@@ -53,7 +55,15 @@ def simple_flocking(drone_id, swarm_pos_vel, my_pos_vel, time_step, max_accel):
     # changing from 10
     r_0 = 20
     v_separation = np.array([0, 0, 0])
-    for key in swarm_pos_vel:
+    if neighbour_grid is None:
+        neighbours = swarm_pos_vel.keys()
+    else:
+        # only the agents within r_0 can contribute to the separation velocity
+        neighbours = [
+            neighbour_grid.ids[row]
+            for row in neighbour_grid.query(my_pos_vel.position_ned, r_0)
+        ]
+    for key in neighbours:
         if key == drone_id:
             continue
         p = np.array(swarm_pos_vel[key].position_ned)
@@ -78,13 +88,14 @@ def get_desired_yaw(north, east):
     return yaw
 
 
-def migration_test(migrated):
+def migration_test(migrated, rng=random):
+    # rng can be a seeded random.Random for repeatable targets
     if migrated == True:
         north = 0
     else:
         north = 200
 
-    east = random.randint(0, 50)
+    east = rng.randint(0, 50)
     down = -20
 
     return [north, east, down]
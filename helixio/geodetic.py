@@ -0,0 +1,143 @@
+import numpy as np
+
+# WGS84 ellipsoid, as used by pymap3d by default
+WGS84_SEMIMAJOR_AXIS = 6378137.0
+WGS84_FLATTENING = 1 / 298.257223563
+_E2 = WGS84_FLATTENING * (2 - WGS84_FLATTENING)
+# fixed point iterations of the ECEF to geodetic conversion, converged to well below
+# a millimetre for points near the surface of the earth
+_GEODETIC_ITERATIONS = 5
+
+
+def geodetic2ecef(lat, lon, alt):
+    """
+    Parameters
+    ------------
+    lat, lon: (N,) latitudes and longitudes in degrees
+    alt: (N,) altitudes in meters above the ellipsoid
+
+    Returns
+    -----------
+    ecef: (N, 3) earth centred earth fixed positions in meters
+    """
+    lat = np.radians(np.asarray(lat, dtype="float64"))
+    lon = np.radians(np.asarray(lon, dtype="float64"))
+    alt = np.asarray(alt, dtype="float64")
+    sin_lat = np.sin(lat)
+    cos_lat = np.cos(lat)
+    radius = WGS84_SEMIMAJOR_AXIS / np.sqrt(1 - _E2 * sin_lat**2)
+    return np.stack(
+        (
+            (radius + alt) * cos_lat * np.cos(lon),
+            (radius + alt) * cos_lat * np.sin(lon),
+            (radius * (1 - _E2) + alt) * sin_lat,
+        ),
+        axis=-1,
+    )
+
+
+def ecef2geodetic(ecef):
+    """
+    Parameters
+    ------------
+    ecef: (N, 3) earth centred earth fixed positions in meters
+
+    Returns
+    -----------
+    lat, lon: (N,) latitudes and longitudes in degrees
+    alt: (N,) altitudes in meters above the ellipsoid
+    """
+    ecef = np.asarray(ecef, dtype="float64")
+    x, y, z = ecef[..., 0], ecef[..., 1], ecef[..., 2]
+    lon = np.arctan2(y, x)
+    p = np.hypot(x, y)
+    lat = np.arctan2(z, p * (1 - _E2))
+    for _ in range(_GEODETIC_ITERATIONS):
+        sin_lat = np.sin(lat)
+        radius = WGS84_SEMIMAJOR_AXIS / np.sqrt(1 - _E2 * sin_lat**2)
+        lat = np.arctan2(z + _E2 * radius * sin_lat, p)
+    sin_lat = np.sin(lat)
+    alt = (
+        p * np.cos(lat)
+        + z * sin_lat
+        - WGS84_SEMIMAJOR_AXIS * np.sqrt(1 - _E2 * sin_lat**2)
+    )
+    return np.degrees(lat), np.degrees(lon), alt
+
+
+class NedFrame:
+    """
+    Local north east down frame at a geodetic reference point. The ECEF position of
+    the reference and the rotation from ECEF to NED are computed once, so conversions
+    are a subtraction and a matrix product over whole arrays of points.
+
+    Parameters
+    ------------
+    ref_lat, ref_lon: reference latitude and longitude in degrees
+    ref_alt: reference altitude in meters above the ellipsoid
+
+    Usage
+    ------------
+    frame = NedFrame(ref_lat, ref_lon, ref_alt)
+    north, east, down = frame.geodetic2ned(lat, lon, alt)
+    """
+
+    def __init__(self, ref_lat, ref_lon, ref_alt):
+        self.ref_lat = ref_lat
+        self.ref_lon = ref_lon
+        self.ref_alt = ref_alt
+        self.ref_ecef = geodetic2ecef(ref_lat, ref_lon, ref_alt)
+        lat = np.radians(ref_lat)
+        lon = np.radians(ref_lon)
+        # rows are the north, east and down axes in ECEF
+        self.rotation = np.array(
+            [
+                [-np.sin(lat) * np.cos(lon), -np.sin(lat) * np.sin(lon), np.cos(lat)],
+                [-np.sin(lon), np.cos(lon), 0],
+                [-np.cos(lat) * np.cos(lon), -np.cos(lat) * np.sin(lon), -np.sin(lat)],
+            ]
+        )
+
+    def geodetic2ned(self, lat, lon, alt):
+        """
+        Parameters
+        ------------
+        lat, lon: latitudes and longitudes in degrees, scalars or (N,) arrays
+        alt: altitudes in meters above the ellipsoid
+
+        Returns
+        -----------
+        north, east, down: in meters, floats for scalar inputs or arrays of the shape
+            of lat
+        """
+        ned = (geodetic2ecef(lat, lon, alt) - self.ref_ecef) @ self.rotation.T
+        return _unpack(ned[..., 0], ned[..., 1], ned[..., 2])
+
+    def ned2geodetic(self, north, east, down):
+        """
+        Parameters
+        ------------
+        north, east, down: in meters, scalars or (N,) arrays
+
+        Returns
+        -----------
+        lat, lon: latitudes and longitudes in degrees, floats for scalar inputs or
+            arrays of the shape of north
+        alt: altitudes in meters above the ellipsoid
+        """
+        ned = np.stack(
+            np.broadcast_arrays(
+                np.asarray(north, dtype="float64"),
+                np.asarray(east, dtype="float64"),
+                np.asarray(down, dtype="float64"),
+            ),
+            axis=-1,
+        )
+        return _unpack(*ecef2geodetic(self.ref_ecef + ned @ self.rotation))
+
+
+def _unpack(*coordinates):
+    # floats for single points, like pymap3d returns them
+    if np.ndim(coordinates[0]) == 0:
+        return tuple(float(coordinate) for coordinate in coordinates)
+    return coordinates
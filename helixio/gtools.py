@@ -1,75 +1,251 @@
+import hashlib
 import numpy as np
 
 
-def alt_calc(alt_dict, site_elevation):
+# return altitude window above the launch altitude and spacing in meters
+ALT_LIMITS = (10, 100)
+ALT_STEP = 2  # TODO change back to 1
+# smallest altitude difference between two agents returning at the same time
+ALT_MIN_STEP = 1
+
+
+def deconflicted_alts(
+    ids, altitudes, site_elevation, alt_step=ALT_STEP, min_step=ALT_MIN_STEP
+):
     """
+    Spreads the agents over distinct return altitudes centred on their mean altitude
+    and kept within ALT_LIMITS above site_elevation. The agents keep their vertical
+    order, ties are broken by ID so every agent computes the same assignment. When
+    the swarm does not fit in the window at alt_step, the altitudes are squeezed
+    together to fill the window, as long as vertical neighbours stay min_step apart.
+
     Parameters
     ------------
-    alt_dict: Dict{key drone_index (string): value altitude (float), ...}
+    ids: (N,) agent IDs (string)
+    altitudes: (N,) current altitudes (float)
+    site_elevation: altitude of the launch site (float)
+    alt_step: altitude difference between return altitudes in meters
+    min_step: smallest altitude difference accepted when the swarm does not fit
 
     Returns
     -----------
-    output_dict: Dict(key:drone_index (string), value: altitude (float))
+    alts: (N,) return altitude of each agent, in the order of ids
+    step: altitude difference between vertical neighbours, alt_step when the swarm
+        fits in the window
+
+    Raises
+    -----------
+    ValueError: when the swarm does not fit in the window at min_step
     """
-    # print("alt_dict=", alt_dict)
-    alt_lims = np.array(
-        [10, 100]
-    )  # in meters - min return altitude above launch altitude
-    alt_lims = alt_lims + site_elevation  # cant use += when mixing ints and floats
-    alt_step = 2  # in meters - the alt difference between return alts
-    # TODO change back to 1
-    size = len(alt_dict)
-    # Sorting dictionary by values and returning list of keys -----------------------------------------------------------------------------
-    sorted_idx = sorted(alt_dict, key=alt_dict.get)
-
-    # Calculating the mean of current alts -------------------------------------------------------------------------------
-    mean = sum(alt_dict.values()) / size
-
-    # Creating sorted return alts ------------------------------------------------------------------------------------------
-    alts = np.arange(size) - (size - 1) / 2  # Makes an array centered around 0
-    alts *= alt_step  # Increases to stepsize
-    alts += mean  # Adds to mean
-
-    # Checking minimum and maximum alt -----------------------------------------------------------------------------------------------
+    ids = np.asarray(ids)
+    altitudes = np.asarray(altitudes, dtype="float64")
+    size = len(altitudes)
+    alt_lims = np.array(ALT_LIMITS) + site_elevation
+    if size == 0:
+        return np.empty(0, dtype="float64"), alt_step
+    step = alt_step
+    if (size - 1) * alt_step > ALT_LIMITS[1] - ALT_LIMITS[0]:
+        step = (ALT_LIMITS[1] - ALT_LIMITS[0]) / (size - 1)
+        if step < min_step:
+            raise ValueError(
+                str(size)
+                + " agents do not fit in the return altitude window "
+                + str(min_step)
+                + " m apart"
+            )
+    # sorted by altitude, then by ID
+    order = np.lexsort((np.argsort(np.argsort(ids)), altitudes))
+
+    # return alts centred around the mean, then moved into the window
+    alts = (np.arange(size) - (size - 1) / 2) * step + altitudes.mean()
     if alts[0] < alt_lims[0]:
-        difference = alt_lims[0] - alts[0]
-        alts += difference  # Increase altitude so greater than min
+        alts += alt_lims[0] - alts[0]
     if alts[-1] > alt_lims[1]:
-        difference = alts[-1] - alt_lims[1]
-        alts -= difference  # Reduce altitude so less than max
+        alts -= alts[-1] - alt_lims[1]
+
+    assigned = np.empty(size, dtype="float64")
+    assigned[order] = alts
+    return assigned, step
 
-    # Assigning alts to ordered index  -----------------------------------------------
-    alt_return_dict = {}
-    for i, idx in enumerate(sorted_idx):
-        alt_return_dict[idx] = alts[i]
 
-    return alt_return_dict
+def alt_checksum(ids, alts):
+    """
+    Parameters
+    ------------
+    ids: (N,) agent IDs (string)
+    alts: (N,) return altitudes from deconflicted_alts
+
+    Returns
+    -----------
+    checksum: hex digest of the vertical order of the agents, equal on agents that
+        agree on it. The altitudes themselves depend on when each agent read the
+        telemetry, so only the order is compared.
+    """
+    order = np.argsort(np.asarray(alts), kind="stable")
+    assignment = ";".join(str(ids[i]) for i in order)
+    return hashlib.sha256(assignment.encode()).hexdigest()[:16]
+
+
+def alt_calc(alt_dict, site_elevation, min_step=ALT_MIN_STEP):
+    """
+    Parameters
+    ------------
+    alt_dict: Dict{key drone_index (string): value altitude (float), ...}
+    min_step: see deconflicted_alts, 0 always squeezes the swarm into the window
+
+    Returns
+    -----------
+    output_dict: Dict(key:drone_index (string), value: altitude (float))
+    """
+    ids = list(alt_dict)
+    alts, _ = deconflicted_alts(
+        ids, [alt_dict[key] for key in ids], site_elevation, min_step=min_step
+    )
+    return dict(zip(ids, alts))
 
 
-def proximity_check(swarm_telemetry, min_proximity):
+def proximity_check(swarm_telemetry, min_proximity, k_closest=None):
     """
     Parameters
     ------------
-    swarm_telemetry: Dict{key drone_index (string): AgentTelemetry (object), ...}
+    swarm_telemetry: Dict{key drone_index (string): AgentTelemetry (object), ...} or
+        SwarmState
+    min_proximity: separation below which a pair of drones is reported
+    k_closest: if given, only the k closest pairs are returned, sorted by separation
 
     Returns
     -----------
     output_dict: List[[drone_index (string), drone_index (string), distance],[...]
+    each unordered pair appears once, in the order of swarm_telemetry unless k_closest
+    """
+    keys = list(swarm_telemetry.keys())
+    if min_proximity <= 0 or len(keys) < 2:
+        return []
+    if hasattr(swarm_telemetry, "positions"):
+        # a SwarmState already holds the positions as one array in the order of keys
+        swarm_positions = swarm_telemetry.positions
+    else:
+        swarm_positions = np.array(
+            [swarm_telemetry[key].position_ned for key in keys], dtype="float64"
+        ).reshape(-1, 3)
+
+    rows_1, rows_2, seperations = NeighbourGrid(
+        swarm_positions, min_proximity
+    ).query_pairs()
+    below = seperations < min_proximity
+    rows_1, rows_2, seperations = rows_1[below], rows_2[below], seperations[below]
+
+    if k_closest is not None:
+        closest = np.argsort(seperations, kind="stable")[:k_closest]
+        rows_1, rows_2, seperations = (
+            rows_1[closest],
+            rows_2[closest],
+            seperations[closest],
+        )
+
+    return [
+        [keys[row_1], keys[row_2], float(seperation)]
+        for row_1, row_2, seperation in zip(rows_1, rows_2, seperations)
+    ]
+
+
+class NeighbourGrid:
     """
-    swarm_positions = {}
-    output = []
-    for key in swarm_telemetry.keys():
-        swarm_positions[key] = np.array(swarm_telemetry[key].position_ned)
-
-    for key_1 in swarm_positions.keys():
-        for key_2 in swarm_positions.keys():
-            if key_1 == key_2:
+    Uniform grid of cells of size cell_size built once from a set of positions, so
+    that the neighbours of a point are searched in the surrounding cells only
+
+    Parameters
+    ------------
+    positions: (N, 3) array of positions
+    cell_size: edge of a cell in meters, normally the radius queries are made with
+    ids: optional list of N agent ids, row i of positions belongs to ids[i]
+    """
+
+    _cell_bits = 21  # bits per axis in a cell key
+    _cell_offset = 1 << (_cell_bits - 1)
+
+    def __init__(self, positions, cell_size, ids=None):
+        self.positions = np.asarray(positions, dtype="float64").reshape(-1, 3)
+        self.cell_size = cell_size
+        self.ids = list(ids) if ids is not None else None
+        self.rows = {} if ids is None else {key: row for row, key in enumerate(ids)}
+        keys = self._cell_keys(np.floor(self.positions / cell_size).astype("int64"))
+        self._order = np.argsort(keys, kind="stable")
+        self._sorted_keys = keys[self._order]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _cell_keys(self, cells):
+        cells = cells + self._cell_offset
+        return (
+            (cells[:, 0] << (2 * self._cell_bits))
+            | (cells[:, 1] << self._cell_bits)
+            | cells[:, 2]
+        )
+
+    def query_points(self, points, radius=None):
+        """
+        Parameters
+        ------------
+        points: (Q, 3) array of query points
+        radius: search radius, defaults to cell_size
+
+        Returns
+        -----------
+        point_rows: (K,) row of the query point of each match
+        rows: (K,) row in positions of each match
+        distances: (K,) distance between the query point and the match
+        """
+        if radius is None:
+            radius = self.cell_size
+        points = np.asarray(points, dtype="float64").reshape(-1, 3)
+        query_cells = np.floor(points / self.cell_size).astype("int64")
+        reach = int(np.ceil(radius / self.cell_size))
+        steps = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps), axis=-1).reshape(-1, 3)
+
+        point_rows = []
+        rows = []
+        for offset in offsets:
+            keys = self._cell_keys(query_cells + offset)
+            start = np.searchsorted(self._sorted_keys, keys, side="left")
+            end = np.searchsorted(self._sorted_keys, keys, side="right")
+            counts = end - start
+            total = counts.sum()
+            if total == 0:
                 continue
-            seperation = np.linalg.norm(swarm_positions[key_2] - swarm_positions[key_1])
-            if seperation < min_proximity and [key_2, key_1, seperation] not in output:
-                output.append([key_1, key_2, seperation])
+            first = np.cumsum(counts) - counts
+            sorted_rows = np.repeat(start - first, counts) + np.arange(total)
+            point_rows.append(np.repeat(np.arange(len(points)), counts))
+            rows.append(self._order[sorted_rows])
+
+        if not rows:
+            empty = np.zeros(0, dtype="int64")
+            return empty, empty, np.zeros(0)
+        point_rows = np.concatenate(point_rows)
+        rows = np.concatenate(rows)
+        distances = np.linalg.norm(points[point_rows] - self.positions[rows], axis=1)
+        within = distances <= radius
+        return point_rows[within], rows[within], distances[within]
+
+    def query(self, point, radius=None):
+        # rows of all positions within radius of a single point
+        _, rows, _ = self.query_points(point, radius)
+        return rows
 
-    return output
+    def query_pairs(self, radius=None):
+        """
+        Returns
+        -----------
+        rows_1, rows_2, distances: unique pairs of rows with rows_1 < rows_2 that are
+        within radius of each other, sorted by rows_1 then rows_2
+        """
+        rows_1, rows_2, distances = self.query_points(self.positions, radius)
+        unique = rows_1 < rows_2
+        rows_1, rows_2, distances = rows_1[unique], rows_2[unique], distances[unique]
+        order = np.lexsort((rows_2, rows_1))
+        return rows_1[order], rows_2[order], distances[order]
 
 
 def create_swarm_dict(real_swarm_size, sitl_swarm_size):
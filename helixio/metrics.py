@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+from collections import deque
+import numpy as np
+from scheduler import PeriodicScheduler
+
+# percentiles reported for every timer and histogram
+METRIC_PERCENTILES = (50, 90, 99)
+
+
+class Metrics:
+    """
+    Lightweight instrumentation of the hot paths of an agent: named counters and
+    histograms of durations or other samples. Histograms keep the latest window
+    samples, so the percentiles describe recent behaviour. The MQTT callbacks record
+    from the network thread, so every method holds the lock of the metrics.
+
+    Usage
+    ------------
+    with metrics.timer("path_following"):
+        ...
+    metrics.count("mqtt_position")
+    metrics.record("telemetry_latency", latency)
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, increment=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + increment
+
+    def record(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = deque(maxlen=self.window)
+                self.histograms[name] = histogram
+            histogram.append(value)
+
+    def timer(self, name):
+        # context manager recording the duration of its block in seconds
+        return _Timer(self, name)
+
+    def snapshot(self, reset=True):
+        """
+        Parameters
+        ------------
+        reset: clear the counters and histograms after taking the snapshot
+
+        Returns
+        -----------
+        snapshot: Dict with the counters and, for every histogram, the sample count,
+            mean, max and the METRIC_PERCENTILES as "p50", "p90", "p99"
+        """
+        # the samples are copied under the lock and summarised outside of it
+        with self.lock:
+            counters = dict(self.counters)
+            samples_of = {
+                name: list(histogram)
+                for name, histogram in self.histograms.items()
+                if len(histogram) > 0
+            }
+            if reset:
+                self.counters = {}
+                self.histograms = {}
+        histograms = {}
+        for name, samples in samples_of.items():
+            samples = np.array(samples, dtype="float64")
+            summary = {
+                "count": len(samples),
+                "mean": float(samples.mean()),
+                "max": float(samples.max()),
+            }
+            for percentile, value in zip(
+                METRIC_PERCENTILES, np.percentile(samples, METRIC_PERCENTILES)
+            ):
+                summary["p" + str(percentile)] = float(value)
+            histograms[name] = summary
+        return {"counters": counters, "histograms": histograms}
+
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+async def publish_metrics(metrics, client, topic, logger, period):
+    # publishes and logs a snapshot of the metrics every period seconds
+    scheduler = PeriodicScheduler(period, "skip")
+    while True:
+        await scheduler.wait()
+        payload = json.dumps(metrics.snapshot())
+        client.publish(topic, payload)
+        logger.info("metrics: " + payload)
@@ -10,15 +10,20 @@ import flocking
 from mavsdk import System
 from mavsdk.action import ActionError
 from mavsdk.offboard import OffboardError, VelocityNedYaw
-import pymap3d as pm
+from geodetic import NedFrame
 from communication import DroneCommunication
 from data_structures import AgentTelemetry
 from experiment import Experiment
+from metrics import Metrics, publish_metrics
+from scheduler import PeriodicScheduler, wait_until
 import math
 import gtools
 import numpy as np
 from telemetry import SwarmManager, TelemetryUpdater
 
+# period in seconds of the checks for reached positions and altitudes
+POLL_PERIOD = 0.1
+
 
 # Class containing all methods for the drones.
 class Agent:
@@ -29,9 +34,13 @@ class Agent:
             parameters = json.load(f)
         self.load_parameters(parameters)
         self.swarm_manager = SwarmManager()
+        self.metrics = Metrics()
         self.swarm_manager.telemetry[self.id] = AgentTelemetry()
         self.current_experiment = "convergence_S_to_N_NZ"
         self.return_alt: float = 10
+        # counts the pre_start commands, so the return altitude checksums of one
+        # pre_start are only compared with those of the same one
+        self.alt_round: int = 0
         if self.logging == True:
             self.logger = setup_logger(self.id)
         self.logger.info("ref lat: " + str(self.ref_lat))
@@ -80,7 +89,20 @@ class Agent:
             event_loop,
             [self.ref_lat, self.ref_lon, self.ref_alt],
             self.download_ulog,
+            self.telemetry_format,
+            self.state_frame_rate,
+            self.metrics,
         )
+        if self.metrics_period > 0:
+            asyncio.ensure_future(
+                publish_metrics(
+                    self.metrics,
+                    self.comms.client,
+                    self.id + "/metrics",
+                    self.logger,
+                    self.metrics_period,
+                )
+            )
 
     async def on_disconnect(self):
         print("connection lost, timeout in 5s")
@@ -101,6 +123,26 @@ class Agent:
         self.ref_lat: float = parameters["ref_lat"]
         self.ref_lon: float = parameters["ref_lon"]
         self.ref_alt: float = parameters["ref_alt"]
+        self.ned_frame = NedFrame(self.ref_lat, self.ref_lon, self.ref_alt)
+        # optional, "text" or "binary", receivers accept both formats
+        self.telemetry_format: str = parameters.get("telemetry_format", "text")
+        # optional, rate in Hz of the combined <id>/telemetry/state messages, 0 disables
+        # them and publishes the separate telemetry topics instead
+        self.state_frame_rate: float = parameters.get("state_frame_rate", 0)
+        # optional, receive the swarm from the swarm/state messages of swarm_relay.py
+        # instead of subscribing to the telemetry of every agent
+        self.use_swarm_relay: bool = parameters.get("use_swarm_relay", False)
+        # optional, predict the neighbour positions to the time of each velocity command
+        # from their latest position and velocity, looking at most max_extrapolation
+        # seconds ahead
+        self.extrapolate_telemetry: bool = parameters.get(
+            "extrapolate_telemetry", False
+        )
+        self.max_extrapolation: float = parameters.get("max_extrapolation", 1.0)
+        # optional, period in seconds of the <id>/metrics messages, 0 disables them
+        self.metrics_period: float = parameters.get("metrics_period", 5)
+        # optional, seconds to wait for the return altitude checksums of the swarm
+        self.alt_agreement_timeout: float = parameters.get("alt_agreement_timeout", 5)
 
     def update_parameter(self, new_parameters_json):
 
@@ -162,13 +204,10 @@ class Agent:
         await self.drone.action.hold()
         await asyncio.sleep(1)
 
-        (desired_lat, desired_lon, desired_alt) = pm.ned2geodetic(
+        (desired_lat, desired_lon, desired_alt) = self.ned_frame.ned2geodetic(
             desired_positions_ned[self.id][0],
             desired_positions_ned[self.id][1],
             desired_positions_ned[self.id][2],
-            self.ref_lat,
-            self.ref_lon,
-            self.ref_alt,
         )
 
         # Go to the deconflicted travel altitude
@@ -180,8 +219,11 @@ class Agent:
         # wait until altitude is reached by all agents
         # while not self.swarm_manager.check_swarm_altitudes(deconflicted_alt_dict):
         #     await asyncio.sleep(0.1)
-        while abs(self.swarm_manager.telemetry[self.id].geodetic[2] - travel_alt) > 0.5:
-            await asyncio.sleep(1)
+        await wait_until(
+            lambda: abs(self.swarm_manager.telemetry[self.id].geodetic[2] - travel_alt)
+            <= 0.5,
+            POLL_PERIOD,
+        )
         await asyncio.sleep(10)
 
         # Go to the desired position at the travel alt
@@ -192,19 +234,19 @@ class Agent:
         except ActionError as error:
             self.report_error(error._result.result_str)
 
-        while (
-            abs(
+        await wait_until(
+            lambda: abs(
                 self.swarm_manager.telemetry[self.id].position_ned[0]
                 - desired_positions_ned[self.id][0]
             )
-            > 1
-            or abs(
+            <= 1
+            and abs(
                 self.swarm_manager.telemetry[self.id].position_ned[1]
                 - desired_positions_ned[self.id][1]
             )
-            > 1
-        ):
-            await asyncio.sleep(1)
+            <= 1,
+            POLL_PERIOD,
+        )
 
         # Waits until position is reached by all agents
         # while not self.swarm_manager.check_swarm_positions(
@@ -255,7 +297,6 @@ class Agent:
 
         await asyncio.sleep(1)
 
-        alt_dict = {}
         # get the intiial point and the intiial path
         swarm_priorities = self.experiment.get_swarm_priorities(
             self.swarm_manager.telemetry
@@ -265,11 +306,23 @@ class Agent:
             self.swarm_manager.telemetry, swarm_priorities
         )
 
-        for key in self.swarm_manager.telemetry.keys():
-            alt_dict[key] = self.swarm_manager.telemetry[key].geodetic[2]
-
-        # TODO add check that all agents calculate the same alts
-        deconflicted_alt_dict = gtools.alt_calc(alt_dict, self.ref_alt)
+        ids = list(self.swarm_manager.telemetry.keys())
+        self.alt_round += 1
+        try:
+            alts, step = gtools.deconflicted_alts(
+                ids,
+                [self.swarm_manager.telemetry[key].geodetic[2] for key in ids],
+                self.ref_alt,
+            )
+        except ValueError as error:
+            self.report_error(str(error))
+            return
+        if step < gtools.ALT_STEP:
+            self.logger.warning(
+                "return altitudes squeezed to " + str(round(step, 2)) + " m apart"
+            )
+        deconflicted_alt_dict = dict(zip(ids, alts))
+        await self.check_alt_agreement(ids, alts)
 
         # TODO add check if pre start position is current position
         await self.deconflicted_goto(pre_start_positions, deconflicted_alt_dict)
@@ -277,12 +330,42 @@ class Agent:
         # once in pre start position find the intiial nearest point
         self.experiment.initial_nearest_point(self.swarm_manager.telemetry)
 
+    async def check_alt_agreement(self, ids, alts):
+        # exchanges the checksum of the return altitudes so agents computing a different
+        # assignment from different telemetry are reported
+        checksum = gtools.alt_checksum(ids, alts)
+        alt_round = self.alt_round
+        self.comms.client.publish(
+            self.id + "/alt_checksum", str(alt_round) + ":" + checksum, qos=1
+        )
+        checksums = self.comms.alt_checksums.setdefault(alt_round, {})
+        try:
+            await asyncio.wait_for(
+                wait_until(lambda: all(key in checksums for key in ids), POLL_PERIOD),
+                self.alt_agreement_timeout,
+            )
+        except asyncio.TimeoutError:
+            self.report_error("return altitude checksums missing")
+        disagreeing = [
+            key for key in ids if key in checksums and checksums[key] != checksum
+        ]
+        if len(disagreeing) > 0:
+            self.report_error("return altitudes disagree with " + str(disagreeing))
+        # checksums of this and earlier rounds are not needed anymore
+        for key in list(self.comms.alt_checksums):
+            if key <= alt_round:
+                self.comms.alt_checksums.pop(key, None)
+
     async def run_experiment(self):
         print("running experiment")
+        # the agent may have moved away from its last corridor point during a hold
+        self.experiment.initial_nearest_point(self.swarm_manager.telemetry)
         await self.start_offboard(self.drone)
 
         # End of Init the drone
         offboard_loop_duration = 0.1  # duration of each loop
+        # loop iterations are released at absolute deadlines, late ones are skipped
+        scheduler = PeriodicScheduler(offboard_loop_duration, "skip")
 
         # Loop in which the velocity command outputs are generated
         while (
@@ -290,22 +373,35 @@ class Agent:
             and self.experiment.ready_flag == True
         ):
             offboard_loop_start_time = time.time()
+            extrapolate_to = (
+                offboard_loop_start_time if self.extrapolate_telemetry else None
+            )
 
-            await self.drone.offboard.set_velocity_ned(
-                self.experiment.path_following(
+            with self.metrics.timer("path_following"):
+                velocity_command = self.experiment.path_following(
                     self.swarm_manager.telemetry,
                     self.max_speed,
-                    offboard_loop_duration,
-                    10,
+                    self.swarm_manager.neighbour_grid(
+                        self.experiment.r_conflict,
+                        extrapolate_to,
+                        self.max_extrapolation,
+                    ),
                 )
-            )
 
-            await self.check_altitude()
+            with self.metrics.timer("set_velocity_ned"):
+                await self.drone.offboard.set_velocity_ned(velocity_command)
 
-            # Checking frequency of the loop
-            await asyncio.sleep(
-                offboard_loop_duration - (time.time() - offboard_loop_start_time)
-            )
+            with self.metrics.timer("check_altitude"):
+                await self.check_altitude()
+
+            self.metrics.record("loop_duration", time.time() - offboard_loop_start_time)
+            # Checking frequency of the loop, a stall over several periods counts
+            # every deadline it missed
+            missed = await scheduler.wait()
+            if missed > 0:
+                self.metrics.count("missed_deadlines", missed)
+
+        self.logger.info("offboard loop timing: " + str(scheduler.stats()))
 
     async def return_to_home(self):
         rtl_start_lat = self.swarm_manager.telemetry[self.id].geodetic[0]
@@ -325,14 +421,14 @@ class Agent:
         except ActionError as error:
             self.report_error(error._result.result_str)
 
-        while (
-            abs(
+        await wait_until(
+            lambda: abs(
                 self.swarm_manager.telemetry[self.id].geodetic[2]
                 - self.comms.return_alt
             )
-            > 0.5
-        ):
-            await asyncio.sleep(1)
+            <= 0.5,
+            POLL_PERIOD,
+        )
 
         try:
             await self.drone.action.goto_location(
@@ -0,0 +1,387 @@
+from __future__ import annotations
+import numpy as np
+from corridor import SegmentIndex
+
+
+def _norm(vectors):
+    return np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+
+
+def _limit(vectors, limit):
+    # scales down every row whose magnitude is above the limit
+    magnitude = _norm(vectors)
+    scale = np.ones_like(magnitude)
+    over = magnitude > limit
+    scale[over] = limit / magnitude[over]
+    return vectors * scale[:, None]
+
+
+def _unit(vectors, magnitude):
+    # divides every row by its magnitude, rows of zero magnitude stay zero
+    output = np.zeros_like(vectors)
+    nonzero = magnitude != 0
+    output[nonzero] = vectors[nonzero] / magnitude[nonzero, None]
+    return output
+
+
+class SwarmPathState:
+    """
+    Path following state of N agents stored as arrays, one row per agent
+
+    Attributes
+    ------------
+    current_path: (N,) path each agent is following
+    current_index: (N,) index of the corridor point each agent is heading from
+    pass_permission: (N,) permission to switch to the adjacent path
+    k_migration, k_lane_cohesion, k_rotation: (N,) gains, zeroed at the end of a path
+    least_distance: (N,) least distance to a neighbour seen so far
+    """
+
+    def __init__(
+        self,
+        current_path,
+        current_index,
+        pass_permission,
+        k_migration,
+        k_lane_cohesion,
+        k_rotation,
+        least_distance=2,
+    ):
+        self.current_path = np.array(current_path, dtype="int64", ndmin=1)
+        self.current_index = np.array(current_index, dtype="int64", ndmin=1)
+        self.pass_permission = np.array(pass_permission, dtype="bool", ndmin=1)
+        size = len(self.current_path)
+        self.k_migration = np.broadcast_to(
+            np.asarray(k_migration, dtype="float64"), (size,)
+        ).copy()
+        self.k_lane_cohesion = np.broadcast_to(
+            np.asarray(k_lane_cohesion, dtype="float64"), (size,)
+        ).copy()
+        self.k_rotation = np.broadcast_to(
+            np.asarray(k_rotation, dtype="float64"), (size,)
+        ).copy()
+        self.least_distance = np.broadcast_to(
+            np.asarray(least_distance, dtype="float64"), (size,)
+        ).copy()
+
+    def __len__(self):
+        return len(self.current_path)
+
+    @classmethod
+    def from_agents(cls, agents) -> SwarmPathState:
+        # agents are objects with the path following attributes of Experiment
+        return cls(
+            [agent.current_path for agent in agents],
+            [agent.current_index for agent in agents],
+            [agent.pass_permission for agent in agents],
+            [agent.k_migration for agent in agents],
+            [agent.k_lane_cohesion for agent in agents],
+            [agent.k_rotation for agent in agents],
+            [agent.least_distance for agent in agents],
+        )
+
+    def write_back(self, agents):
+        for row, agent in enumerate(agents):
+            agent.current_path = int(self.current_path[row])
+            agent.current_index = int(self.current_index[row])
+            agent.pass_permission = bool(self.pass_permission[row])
+            agent.k_migration = float(self.k_migration[row])
+            agent.k_lane_cohesion = float(self.k_lane_cohesion[row])
+            agent.k_rotation = float(self.k_rotation[row])
+            agent.least_distance = float(self.least_distance[row])
+
+
+class PathFollowingEngine:
+    """
+    Computes the path following velocities of a whole swarm in one vectorized pass
+
+    Parameters
+    ------------
+    corridor: CorridorGeometry of the experiment
+    k_separation: gain of the separation velocity
+    r_conflict: distance below which neighbours are pushed away
+    r_collision: distance below which neighbours are pushed away at full strength
+    repeat: if False the gains are zeroed once an agent passes the last point
+    """
+
+    limit_v_migration = 1
+    limit_v_lane_cohesion = 1
+    limit_v_rotation = 1
+    limit_v_separation = 5
+    switch_cos_of_angle = 0.9
+    # farther points walked one by one before the segment index is asked instead
+    advance_window = 8
+
+    def __init__(self, corridor, k_separation, r_conflict, r_collision, repeat):
+        self.corridor = corridor
+        self.k_separation = k_separation
+        self.r_conflict = r_conflict
+        self.r_collision = r_collision
+        self.repeat = repeat
+        self.segment_index = SegmentIndex(corridor, repeat)
+
+    def step(
+        self,
+        state,
+        positions,
+        max_speed,
+        swarm_positions=None,
+        swarm_rows=None,
+        neighbour_pairs=None,
+    ):
+        """
+        Parameters
+        ------------
+        state: SwarmPathState of the N agents, updated in place
+        positions: (N, 3) NED positions of the agents
+        max_speed: magnitude limit of the output velocities
+        swarm_positions: (M, 3) NED positions used for separation, defaults to positions
+        swarm_rows: (N,) row of each agent in swarm_positions, -1 if absent
+        neighbour_pairs: optional (agent rows, swarm_positions rows) of the pairs close
+            enough to separate, for example from NeighbourGrid, instead of all pairs
+
+        Returns
+        -----------
+        velocities: (N, 3) NED velocity commands
+        yaws: (N,) yaw commands in degrees
+        switched: (N,) agents that switched to the adjacent path during this step
+        """
+        positions = np.asarray(positions, dtype="float64").reshape(-1, 3)
+        if swarm_positions is None:
+            swarm_positions = positions
+            swarm_rows = np.arange(len(positions))
+        else:
+            swarm_positions = np.asarray(swarm_positions, dtype="float64").reshape(
+                -1, 3
+            )
+            if swarm_rows is None:
+                swarm_rows = np.full(len(positions), -1)
+
+        switched = self.switch_paths(state, positions)
+        self.advance_indices(state, positions)
+        velocities, yaws = self.velocities(
+            state,
+            positions,
+            max_speed,
+            swarm_positions,
+            np.asarray(swarm_rows),
+            neighbour_pairs,
+        )
+        return velocities, yaws, switched
+
+    def targets(self, state, positions):
+        # the corridor point and direction of the current segment of each agent, on
+        # paths given as curves the point and tangent of the curve at the agent
+        corridor = self.corridor
+        target_point = corridor.points[state.current_path, state.current_index]
+        target_direction = corridor.directions[state.current_path, state.current_index]
+        for j, curve in enumerate(corridor.curves):
+            if curve is None:
+                continue
+            (rows,) = np.nonzero(state.current_path == j)
+            if len(rows) == 0:
+                continue
+            index = state.current_index[rows]
+            step = corridor.segment_length[j, index]
+            fraction = np.einsum(
+                "ij,ij->i",
+                positions[rows] - target_point[rows],
+                target_direction[rows],
+            ) / np.where(step == 0, 1, step)
+            u = curve.parameter(index, np.clip(fraction, 0, 1))
+            on_curve = ~np.isnan(u)
+            rows = rows[on_curve]
+            tangent = curve.tangent(u[on_curve])
+            target_point[rows] = curve.evaluate(u[on_curve])
+            target_direction[rows] = _unit(tangent, _norm(tangent))
+        return target_point, target_direction
+
+    def lane_cohesion_error(self, state, positions):
+        # position error to the current target perpendicular to the target direction
+        target_point, target_direction = self.targets(state, positions)
+        error = target_point - positions
+        error -= (
+            np.einsum("ij,ij->i", error, target_direction)[:, None] * target_direction
+        )
+        return error, target_direction
+
+    def switch_paths(self, state, positions):
+        # An agent with pass permission switches through the first slot of the lane
+        # graph at its current point whose switch vector lines up with its lane
+        # cohesion error, i.e. the agent is already on the side of that path
+        corridor = self.corridor
+        switch_index = corridor.switch_index[state.current_path, state.current_index]
+        switching = (switch_index >= 0).any(axis=1) & state.pass_permission
+        if not switching.any():
+            return switching
+
+        rows = np.flatnonzero(switching)
+        switch_vector = corridor.switch_vector[
+            state.current_path[rows], state.current_index[rows]
+        ]
+        error, _ = self.lane_cohesion_error(state, positions)
+        error = error[rows]
+        norm_product = (
+            np.sqrt(np.einsum("ikx,ikx->ik", switch_vector, switch_vector))
+            * _norm(error)[:, None]
+        )
+        cos_of_angle = np.zeros(norm_product.shape)
+        nonzero = norm_product != 0
+        cos_of_angle[nonzero] = (
+            np.einsum("ikx,ix->ik", switch_vector, error)[nonzero]
+            / norm_product[nonzero]
+        )
+
+        aligned = (cos_of_angle >= self.switch_cos_of_angle) & (switch_index[rows] >= 0)
+        slot = np.argmax(aligned, axis=1)
+        switched = aligned.any(axis=1)
+        rows, slot = rows[switched], slot[switched]
+        switching[:] = False
+        switching[rows] = True
+        # the agent is not allowed to get back to previous path anymore
+        state.pass_permission[rows] = False
+        state.current_path[rows] = corridor.switch_path[
+            state.current_path[rows], state.current_index[rows], slot
+        ]
+        state.current_index[rows] = switch_index[rows, slot]
+        return switching
+
+    def advance_indices(self, state, positions):
+        corridor = self.corridor
+        length = corridor.length[state.current_path]
+        next_index = (state.current_index + 1) % length
+        range_to_next = positions - corridor.points[state.current_path, next_index]
+        passed = (
+            np.einsum(
+                "ij,ij->i",
+                range_to_next,
+                corridor.directions[state.current_path, state.current_index],
+            )
+            > 0
+        )  # drone has passed the point next to current one
+        if not passed.any():
+            return
+
+        rows = np.flatnonzero(passed)
+        path = state.current_path[rows]
+        length = length[rows]
+        current_index = next_index[rows]
+        farther_point = current_index.copy()
+        searching = np.ones(len(rows), dtype="bool")
+        iterator = 0
+        # Searching for farther points. Drones still searching after advance_window
+        # points are far from their last index, e.g. after a hold, and are placed on
+        # their closest segment by the segment index instead
+        while searching.any() and iterator < self.advance_window:
+            iterator += 1
+            active = np.flatnonzero(searching)
+            candidate = (current_index[active] + iterator) % length[active]
+            range_to_farther_point = (
+                positions[rows[active]] - corridor.points[path[active], candidate]
+            )
+            dot_fartherpoints = np.einsum(
+                "ij,ij->i",
+                range_to_farther_point,
+                corridor.directions[path[active], (candidate - 1) % length[active]],
+            )
+            farther_point[active] = candidate
+            searching[active[dot_fartherpoints < 0]] = False
+
+        # Now farther_point has negative dot product
+        passed_last = farther_point == 0
+        new_index = np.where(passed_last, length - 1, farther_point - 1)
+        if searching.any():
+            far = np.flatnonzero(searching)
+            new_index[far], _, _ = self.segment_index.locate(
+                path[far], positions[rows[far]]
+            )
+            passed_last[far] = new_index[far] == length[far] - 1
+        state.current_index[rows] = new_index
+        if not self.repeat:
+            finished = rows[passed_last]  # passed last point of path
+            state.k_lane_cohesion[finished] = 0
+            state.k_migration[finished] = 0
+            state.k_rotation[finished] = 0
+
+    def velocities(
+        self,
+        state,
+        positions,
+        max_speed,
+        swarm_positions,
+        swarm_rows,
+        neighbour_pairs=None,
+    ):
+        corridor = self.corridor
+        lane_radius = corridor.lane_radius[state.current_path]
+        error, target_direction = self.lane_cohesion_error(state, positions)
+
+        # Calculating migration velocity (normalized)---------------------
+        v_migration = _limit(
+            _unit(target_direction, _norm(target_direction)), self.limit_v_migration
+        )
+
+        # Calculating lane Cohesion Velocity ---------------
+        error_magnitude = _norm(error)
+        v_lane_cohesion = (error_magnitude - lane_radius)[:, None] * _unit(
+            error, error_magnitude
+        )
+        v_lane_cohesion[error_magnitude == 0] = 0.01
+        v_lane_cohesion = _limit(v_lane_cohesion, self.limit_v_lane_cohesion)
+
+        # Calculating v_rotation (normalized)---------------------
+        v_rotation_magnitude = np.where(
+            error_magnitude < lane_radius,
+            error_magnitude / lane_radius,
+            lane_radius / np.where(error_magnitude == 0, 1, error_magnitude),
+        )
+        cross_prod = np.cross(error, target_direction)
+        v_rotation = (corridor.rotation_dir[state.current_path] * v_rotation_magnitude)[
+            :, None
+        ] * _unit(cross_prod, _norm(cross_prod))
+        v_rotation = _limit(v_rotation, self.limit_v_rotation)
+
+        # Calculating v_separation (normalized) -----------------------------
+        v_separation = self.separation(
+            state, positions, swarm_positions, swarm_rows, neighbour_pairs
+        )
+
+        yaw_vel = (
+            state.k_lane_cohesion[:, None] * v_lane_cohesion
+            + state.k_migration[:, None] * v_migration
+            + state.k_rotation[:, None] * v_rotation
+        )
+        desired_vel = _limit(yaw_vel + self.k_separation * v_separation, max_speed)
+        yaws = np.degrees(np.arctan2(yaw_vel[:, 1], yaw_vel[:, 0]))
+        return desired_vel, yaws
+
+    def separation(
+        self, state, positions, swarm_positions, swarm_rows, neighbour_pairs=None
+    ):
+        r_conflict = self.r_conflict
+        r_collision = self.r_collision
+        if neighbour_pairs is None:
+            # every agent against every other member of the swarm
+            agent_rows = np.repeat(np.arange(len(positions)), len(swarm_positions))
+            neighbour_rows = np.tile(np.arange(len(swarm_positions)), len(positions))
+            others = neighbour_rows != swarm_rows[agent_rows]
+            agent_rows, neighbour_rows = agent_rows[others], neighbour_rows[others]
+        else:
+            agent_rows, neighbour_rows = (
+                np.asarray(rows, dtype="int64") for rows in neighbour_pairs
+            )
+        x = positions[agent_rows] - swarm_positions[neighbour_rows]
+        d = _norm(x)
+
+        least = np.full(len(positions), np.inf)
+        np.minimum.at(least, agent_rows, d)
+        np.minimum(state.least_distance, least, out=state.least_distance)
+
+        weight = np.zeros(len(d))
+        conflict = (d <= r_conflict) & (d > r_collision) & (d != 0)
+        weight[conflict] = r_conflict - d[conflict] / r_conflict - r_collision
+        weight[(d <= r_collision) & (d != 0)] = 1
+        weight[weight != 0] /= d[weight != 0]
+        v_separation = np.zeros(positions.shape)
+        np.add.at(v_separation, agent_rows, weight[:, None] * x)
+        return _limit(v_separation, self.limit_v_separation)
@@ -0,0 +1,102 @@
+import asyncio
+import math
+import time
+
+SCHEDULER_POLICIES = ("skip", "catch_up")
+
+
+class PeriodicScheduler:
+    """
+    Paces a loop at a fixed rate against absolute deadlines, so the time the loop body
+    takes does not add up to drift. Call wait() at the end of every iteration.
+
+    When the body runs past the next deadline it is counted as an overrun. The "skip"
+    policy drops the missed periods and waits for the next deadline still ahead, the
+    "catch_up" policy runs the missed iterations straight away.
+
+    Attributes
+    ------------
+    period: loop period in seconds
+    policy: "skip" or "catch_up"
+    ticks: number of completed waits
+    overruns: number of waits called after their deadline had passed
+    skipped: number of periods dropped by the "skip" policy
+    """
+
+    def __init__(self, period, policy="skip", clock=time.monotonic):
+        if policy not in SCHEDULER_POLICIES:
+            raise ValueError("unknown scheduler policy: " + str(policy))
+        self.period = period
+        self.policy = policy
+        self.clock = clock
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.deadline = None
+        # running mean and sum of squared differences of the wake up lateness
+        self._jitter_mean = 0.0
+        self._jitter_m2 = 0.0
+        self._jitter_max = 0.0
+
+    def start(self):
+        # the first deadline is one period after the start, wait() starts if needed
+        self.deadline = self.clock() + self.period
+
+    async def wait(self) -> int:
+        """
+        Sleeps until the next deadline
+
+        Returns
+        -----------
+        missed: number of deadlines that had already passed when wait was called
+        """
+        if self.deadline is None:
+            self.start()
+        now = self.clock()
+        missed = 0
+        if now > self.deadline:
+            self.overruns += 1
+            missed = int(math.floor((now - self.deadline) / self.period)) + 1
+            if self.policy == "skip":
+                self.skipped += missed
+                self.deadline += missed * self.period
+        if self.deadline > now:
+            await asyncio.sleep(self.deadline - now)
+        else:
+            # catching up, give the event loop a chance to run the other tasks
+            await asyncio.sleep(0)
+        self.record_jitter(max(self.clock() - self.deadline, 0.0))
+        self.deadline += self.period
+        return missed
+
+    def record_jitter(self, lateness):
+        self.ticks += 1
+        delta = lateness - self._jitter_mean
+        self._jitter_mean += delta / self.ticks
+        self._jitter_m2 += delta * (lateness - self._jitter_mean)
+        self._jitter_max = max(self._jitter_max, lateness)
+
+    def stats(self):
+        """
+        Returns
+        -----------
+        stats: Dict with the counts and the mean, standard deviation and maximum of
+            the time in seconds the loop was woken up after its deadlines
+        """
+        return {
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "jitter_mean": self._jitter_mean,
+            "jitter_std": math.sqrt(self._jitter_m2 / self.ticks)
+            if self.ticks
+            else 0.0,
+            "jitter_max": self._jitter_max,
+        }
+
+
+async def wait_until(condition, period, clock=time.monotonic):
+    # polls condition() every period seconds until it returns True
+    scheduler = PeriodicScheduler(period, "skip", clock)
+    while not condition():
+        await scheduler.wait()
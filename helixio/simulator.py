@@ -0,0 +1,235 @@
+import argparse
+import json
+from contextlib import nullcontext
+import numpy as np
+import gtools
+from corridor import CorridorGeometry, load_corridor
+from path_engine import PathFollowingEngine, SwarmPathState
+from traces import TraceRecorder, TraceWriter
+
+# dynamics the simulated drones can follow their velocity commands with
+SIMULATION_DYNAMICS = ("first_order", "point_mass")
+# experiment keys that change the corridor and so cannot share its cached geometry
+_CORRIDOR_KEYS = ("corridor_points", "corridor_radius", "path_rotation_dir")
+
+
+class Simulation:
+    """
+    Offline path following of a swarm flying an experiment json file, without MAVSDK,
+    MQTT or plotting. The whole swarm is stepped by one PathFollowingEngine.
+
+    Parameters
+    ------------
+    experiment_file_path: path of the experiment json file
+    drone_num: number of simulated drones, with ids S001, S002, ...
+    dt: time step in seconds
+    max_speed: magnitude limit of the velocity commands
+    dynamics: "first_order", the velocity follows the command with time_constant,
+        or "point_mass", the velocity moves towards the command at up to max_accel
+    time_constant: time constant of the first order dynamics in seconds, 0 applies
+        the commands directly like path_following_visualisation always did
+    max_accel: acceleration limit of the point mass dynamics
+    overrides: Dict of experiment parameters replacing those of the file, e.g. gains
+    seed: seed of the random start positions, runs with the same seed are identical
+    start_spread: drones past the pre start positions of the experiment start at
+        random north and east positions up to start_spread metres from the origin
+    metrics: optional Metrics timing the neighbour grid and path following of a step
+    cache_dir: directory of the compiled corridor cache, see corridor.load_corridor
+
+    Drones past the initial paths and pass permissions of the experiment reuse them
+    in turn.
+    """
+
+    def __init__(
+        self,
+        experiment_file_path,
+        drone_num=2,
+        dt=0.1,
+        max_speed=5,
+        dynamics="first_order",
+        time_constant=0,
+        max_accel=5,
+        overrides=None,
+        seed=None,
+        start_spread=0,
+        metrics=None,
+        cache_dir=None,
+    ):
+        if dynamics not in SIMULATION_DYNAMICS:
+            raise ValueError("unknown simulation dynamics: " + str(dynamics))
+        with open(experiment_file_path, "r") as f:
+            parameters = json.load(f)
+        overrides = {} if overrides is None else dict(overrides)
+        parameters.update(overrides)
+        if any(key in overrides for key in _CORRIDOR_KEYS):
+            corridor = CorridorGeometry.compile(
+                parameters["corridor_points"],
+                parameters["corridor_radius"],
+                parameters["path_rotation_dir"],
+            )
+        else:
+            corridor = load_corridor(experiment_file_path, parameters, cache_dir)
+
+        self.parameters = parameters
+        self.dt = dt
+        self.max_speed = max_speed
+        self.dynamics = dynamics
+        self.time_constant = time_constant
+        self.max_accel = max_accel
+        self.metrics = metrics
+        self.engine = PathFollowingEngine(
+            corridor,
+            parameters["k_seperation"],
+            parameters["r_conflict"],
+            parameters["r_collision"],
+            parameters["repeat"],
+        )
+
+        self.ids = ["S" + str(i + 1).zfill(3) for i in range(drone_num)]
+        pre_start_positions = parameters["pre_start_positions"]
+        self.positions = np.zeros((drone_num, 3), dtype="float64")
+        count = min(drone_num, len(pre_start_positions))
+        rng = np.random.default_rng(seed)
+        self.positions[count:, :2] = rng.uniform(
+            -start_spread, start_spread, (drone_num - count, 2)
+        )
+        self.positions[:count] = np.asarray(pre_start_positions, dtype="float64")[
+            :count
+        ]
+        self.velocities = np.zeros((drone_num, 3), dtype="float64")
+        initial_paths = parameters["initial_paths"]
+        pass_permission = parameters["pass_permission"]
+        self.state = SwarmPathState(
+            [initial_paths[i % len(initial_paths)] for i in range(drone_num)],
+            np.zeros(drone_num, dtype="int64"),
+            [pass_permission[i % len(pass_permission)] for i in range(drone_num)],
+            parameters["k_migration"],
+            parameters["k_lane_cohesion"],
+            parameters["k_rotation"],
+        )
+        self.t = 0.0
+        self.steps = 0
+
+    def step(self):
+        # one time step of the whole swarm, returns the velocity commands
+        with self.timer("neighbour_grid"):
+            grid = gtools.NeighbourGrid(self.positions, self.engine.r_conflict)
+            rows_1, rows_2, _ = grid.query_pairs()
+            neighbour_pairs = (
+                np.concatenate((rows_1, rows_2)),
+                np.concatenate((rows_2, rows_1)),
+            )
+        with self.timer("path_following"):
+            commands, _, _ = self.engine.step(
+                self.state,
+                self.positions,
+                self.max_speed,
+                neighbour_pairs=neighbour_pairs,
+            )
+        self.velocities = self.follow(commands)
+        self.positions = self.positions + self.velocities * self.dt
+        self.t += self.dt
+        self.steps += 1
+        return commands
+
+    def timer(self, name):
+        if self.metrics is None:
+            return nullcontext()
+        return self.metrics.timer(name)
+
+    def follow(self, commands):
+        # velocities of the drones after one time step towards the commands
+        if self.dynamics == "first_order":
+            if self.time_constant <= 0:
+                return commands
+            gain = min(self.dt / self.time_constant, 1)
+            return self.velocities + gain * (commands - self.velocities)
+        change = commands - self.velocities
+        magnitude = np.linalg.norm(change, axis=1)
+        limit = self.max_accel * self.dt
+        scale = np.ones_like(magnitude)
+        over = magnitude > limit
+        scale[over] = limit / magnitude[over]
+        return self.velocities + change * scale[:, None]
+
+    def run(self, simulation_time, sink=None):
+        """
+        Steps the swarm until simulation_time has passed
+
+        Parameters
+        ------------
+        simulation_time: duration in seconds, the last step ends past it like in
+            path_following_visualisation
+        sink: optional callable sink(t, ids, positions, velocities) called after
+            every step, the arrays are only valid during the call
+        """
+        while self.t <= simulation_time:
+            self.step()
+            if sink is not None:
+                sink(self.t, self.ids, self.positions, self.velocities)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description="Headless simulation of the path following of an experiment"
+    )
+    parser.add_argument("experiment_file_path")
+    parser.add_argument("--drones", type=int, default=2)
+    parser.add_argument("--time", type=float, default=100, help="seconds")
+    parser.add_argument("--dt", type=float, default=0.1)
+    parser.add_argument("--max-speed", type=float, default=5)
+    parser.add_argument(
+        "--dynamics", choices=SIMULATION_DYNAMICS, default="first_order"
+    )
+    parser.add_argument("--time-constant", type=float, default=0)
+    parser.add_argument("--max-accel", type=float, default=5)
+    parser.add_argument(
+        "--trace", help="path of the output trace, .csv or .parquet (needs pyarrow)"
+    )
+    parser.add_argument(
+        "--plot", action="store_true", help="animate the trace, requires plotly"
+    )
+    parser.add_argument("--cache-dir", help="directory of the compiled corridors")
+    arguments = parser.parse_args(arguments)
+
+    simulation = Simulation(
+        arguments.experiment_file_path,
+        arguments.drones,
+        arguments.dt,
+        arguments.max_speed,
+        arguments.dynamics,
+        arguments.time_constant,
+        arguments.max_accel,
+        cache_dir=arguments.cache_dir,
+    )
+    sinks = []
+    if arguments.trace:
+        sinks.append(TraceWriter(arguments.trace))
+    if arguments.plot:
+        sinks.append(TraceRecorder())
+
+    def sink(t, ids, positions, velocities):
+        for each in sinks:
+            each(t, ids, positions, velocities)
+
+    simulation.run(arguments.time, sink)
+    for each in sinks:
+        if hasattr(each, "close"):
+            each.close()
+    print(
+        "simulated "
+        + str(simulation.steps)
+        + " steps of "
+        + str(len(simulation.ids))
+        + " drones"
+    )
+
+    if arguments.plot:
+        # plotly is only imported when a plot is asked for
+        from path_following_visualisation import plot_traces
+
+        plot_traces(sinks[-1], dt=arguments.dt)
+
+
+if __name__ == "__main__":
+    main()
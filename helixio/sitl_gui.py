@@ -257,12 +257,24 @@ class App:
             self.alt_dict[key] = self.comms.swarm_telemetry[key].geodetic[2]
             print(self.comms.swarm_telemetry[key].geodetic[0])
 
-        output_alt_dict = gtools.alt_calc(self.alt_dict, self.site_elevation)
+        # the swarm is sent home even when it does not fit the return altitudes at a
+        # safe spacing, squeezed into the window, and the error is shown afterwards
+        error = None
+        try:
+            output_alt_dict = gtools.alt_calc(self.alt_dict, self.site_elevation)
+        except ValueError as alt_error:
+            error = str(alt_error)
+            print(error)
+            output_alt_dict = gtools.alt_calc(
+                self.alt_dict, self.site_elevation, min_step=0
+            )
         print(output_alt_dict)
         for key in output_alt_dict:
             self.comms.client.publish(key + "/home/altitude", str(output_alt_dict[key]))
         time.sleep(1)
         self.send_command("return")
+        if error is not None:
+            tk.messagebox.showwarning("Return altitudes", error)
 
     def on_click_launch(self):
         print("launch")
@@ -490,23 +502,35 @@ class App:
     async def ensure_seperation(self):
         print("task started")
         while self.experiment_running:
+            # every pair is checked, only the closest ones are listed so the panel
+            # stays readable and the others are counted below them
             proximity_list = gtools.proximity_check(
                 self.comms.swarm_telemetry, min_proximity=10
             )
 
             if proximity_list:
                 warning_string = ""
-                for i in range(0, len(proximity_list)):
+                shown = sorted(proximity_list, key=lambda pair: pair[2])[:10]
+                for i in range(0, len(shown)):
                     warning_string = (
                         warning_string
-                        + proximity_list[i][0]
+                        + shown[i][0]
                         + " is "
-                        + str(round(proximity_list[i][2], 2))
+                        + str(round(shown[i][2], 2))
                         + "m from "
-                        + proximity_list[i][1]
+                        + shown[i][1]
                     )
-                    if i != len(proximity_list) - 1:
+                    if i != len(shown) - 1:
                         warning_string = warning_string + "\n"
+                if len(proximity_list) > len(shown):
+                    warning_string = (
+                        warning_string
+                        + "\nand "
+                        + str(len(proximity_list) - len(shown))
+                        + " more of "
+                        + str(len(proximity_list))
+                        + " pairs closer than 10m"
+                    )
                 self.warning_frame.grid()
                 self.warning_label.config(text=warning_string)
             else:
@@ -0,0 +1,152 @@
+import asyncio
+import sys
+import threading
+import paho.mqtt.client as mqtt
+from data_structures import AgentTelemetry, SwarmState
+from scheduler import PeriodicScheduler
+from telemetry_codec import (
+    decode_state_frame,
+    decode_telemetry,
+    encode_swarm_snapshot,
+)
+
+
+# Ground side relay collecting the telemetry of every agent and publishing the whole
+# swarm as one swarm/state message. Agents with "use_swarm_relay" set subscribe to
+# that topic only, so the broker sends N messages per tick instead of N squared.
+class SwarmRelay:
+    def __init__(self, broker_ip, rate=10):
+        self.broker_ip = broker_ip
+        self.rate = rate
+        self.swarm_state = SwarmState()
+        # held by the MQTT callbacks while they write a row and by publish_snapshot,
+        # so a snapshot never sees an agent added halfway
+        self.lock = threading.Lock()
+        # agents that reported a position, the others are left out of the snapshots
+        # instead of being sent at the origin
+        self.located = set()
+        self.sequence = 0
+        self.client = mqtt.Client()
+
+    def run(self):
+        self.client.message_callback_add("+/telemetry/state", self.on_message_state)
+        self.client.message_callback_add(
+            "+/telemetry/geodetic", self.on_message_geodetic
+        )
+        self.client.message_callback_add(
+            "+/telemetry/position_ned", self.on_message_position
+        )
+        self.client.message_callback_add(
+            "+/telemetry/velocity_ned", self.on_message_velocity
+        )
+        self.client.message_callback_add("+/telemetry/heading", self.on_message_heading)
+        self.client.on_connect = self.on_connect
+        self.client.connect(self.broker_ip, 1883, keepalive=5)
+        self.client.loop_start()
+        asyncio.run(self.publish_loop())
+
+    async def publish_loop(self):
+        # paced against absolute deadlines, so publishing does not slow the rate down
+        scheduler = PeriodicScheduler(1 / self.rate, "skip")
+        while True:
+            self.publish_snapshot()
+            await scheduler.wait()
+
+    def on_connect(self, client, userdata, flags, rc):
+        print("MQTT connected to broker with result code " + str(rc))
+        client.subscribe("+/telemetry/+")
+
+    def agent(self, msg):
+        # returns the telemetry of the agent that published msg, adding it if needed,
+        # call it with the lock held
+        agent_id = msg.topic.split("/")[0]
+        if agent_id not in self.swarm_state:
+            self.swarm_state[agent_id] = AgentTelemetry()
+        return self.swarm_state[agent_id]
+
+    def stamp(self, msg, sequence=None, timestamp=None, position=True):
+        # stamps the row of the sender with the time the state was sampled, returns
+        # False for messages arriving out of order, call it with the lock held. See
+        # SwarmState.stamp for position
+        self.agent(msg)
+        row = self.swarm_state.rows[msg.topic.split("/")[0]]
+        return self.swarm_state.stamp(row, sequence, timestamp, position=position)
+
+    def on_message_state(self, mosq, obj, msg):
+        (
+            position,
+            velocity,
+            geodetic,
+            heading,
+            sequence,
+            timestamp,
+        ) = decode_state_frame(msg.payload)
+        with self.lock:
+            if not self.stamp(msg, sequence, timestamp):
+                return
+            agent_telemetry = self.agent(msg)
+            agent_telemetry.position_ned = position
+            agent_telemetry.velocity_ned = velocity
+            agent_telemetry.geodetic = geodetic
+            agent_telemetry.heading = heading
+            self.located.add(msg.topic.split("/")[0])
+
+    def on_message_geodetic(self, mosq, obj, msg):
+        geodetic, sequence, timestamp = decode_telemetry(msg.payload)
+        with self.lock:
+            if self.stamp(msg, sequence, timestamp, position=False):
+                self.agent(msg).geodetic = geodetic
+
+    def on_message_position(self, mosq, obj, msg):
+        position, sequence, timestamp = decode_telemetry(msg.payload)
+        with self.lock:
+            if self.stamp(msg, sequence, timestamp):
+                self.agent(msg).position_ned = position
+                self.located.add(msg.topic.split("/")[0])
+
+    def on_message_velocity(self, mosq, obj, msg):
+        velocity, sequence, timestamp = decode_telemetry(msg.payload)
+        with self.lock:
+            if self.stamp(msg, sequence, timestamp, position=False):
+                self.agent(msg).velocity_ned = velocity
+
+    def on_message_heading(self, mosq, obj, msg):
+        heading, sequence, timestamp = decode_telemetry(msg.payload)
+        with self.lock:
+            if self.stamp(msg, sequence, timestamp, position=False):
+                self.agent(msg).heading = heading[0]
+
+    def snapshot(self):
+        # the swarm/state payload of the agents that reported a position, None before
+        # any agent did
+        with self.lock:
+            swarm_state = self.swarm_state
+            rows = [
+                row
+                for row, agent_id in enumerate(swarm_state.ids)
+                if agent_id in self.located
+            ]
+            if len(rows) == 0:
+                return None
+            self.sequence += 1
+            return encode_swarm_snapshot(
+                [swarm_state.ids[row] for row in rows],
+                swarm_state.positions[rows],
+                swarm_state.velocities[rows],
+                swarm_state.geodetic[rows],
+                swarm_state.heading[rows],
+                swarm_state.timestamps[rows],
+                self.sequence,
+            )
+
+    def publish_snapshot(self):
+        payload = self.snapshot()
+        if payload is not None:
+            self.client.publish("swarm/state", payload)
+
+
+if __name__ == "__main__":
+    # python swarm_relay.py <broker ip> [rate in Hz]
+    broker_ip = str(sys.argv[1]) if len(sys.argv) > 1 else "localhost"
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    SwarmRelay(broker_ip, rate).run()
@@ -0,0 +1,223 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from corridor import load_corridor
+from simulator import Simulation
+
+# experiment gains and radii a sweep can vary
+SWEEP_PARAMETERS = (
+    "k_migration",
+    "k_lane_cohesion",
+    "k_rotation",
+    "k_seperation",
+    "r_conflict",
+    "r_collision",
+)
+# metrics reported for every configuration, in the column order of the results
+SWEEP_METRICS = (
+    "min_separation",
+    "separation_violations",
+    "mean_lane_deviation",
+    "max_lane_deviation",
+    "throughput",
+)
+
+
+def sweep_configurations(ranges):
+    """
+    Parameters
+    ------------
+    ranges: Dict[parameter (str), List[value]] with parameters from SWEEP_PARAMETERS
+
+    Returns
+    -----------
+    configurations: List[Dict[parameter (str), value]] of every combination
+    """
+    for parameter in ranges:
+        if parameter not in SWEEP_PARAMETERS:
+            raise ValueError("unknown sweep parameter: " + str(parameter))
+    parameters = list(ranges)
+    return [
+        dict(zip(parameters, values))
+        for values in itertools.product(*(ranges[key] for key in parameters))
+    ]
+
+
+def run_configuration(
+    experiment_file_path,
+    overrides,
+    drone_num=2,
+    simulation_time=100,
+    dt=0.1,
+    max_speed=5,
+    least_distance=2,
+    cache_dir=None,
+):
+    """
+    Simulates one configuration of the experiment and measures it
+
+    Parameters
+    ------------
+    experiment_file_path: path of the experiment json file
+    overrides: Dict of experiment parameters replacing those of the file
+    least_distance: minimum allowed distance between two agents, as in Experiment
+    cache_dir: directory of the compiled corridor cache, see corridor.load_corridor
+
+    Returns
+    -----------
+    metrics: Dict with the overrides and
+        min_separation: least distance between two agents over the run
+        separation_violations: agent pairs and steps closer than least_distance
+        mean_lane_deviation, max_lane_deviation: distance of the agents from the
+            centre line of their lane
+        throughput: corridor points passed per second by the whole swarm
+    """
+    simulation = Simulation(
+        experiment_file_path,
+        drone_num,
+        dt,
+        max_speed,
+        overrides=overrides,
+        cache_dir=cache_dir,
+    )
+    engine = simulation.engine
+    state = simulation.state
+    length = engine.corridor.length
+    pairs = np.triu_indices(drone_num, 1)
+    min_separation = math.inf
+    separation_violations = 0
+    deviation_sum = 0.0
+    max_deviation = 0.0
+    passed = 0
+    while simulation.t <= simulation_time:
+        current_path = state.current_path.copy()
+        current_index = state.current_index.copy()
+        simulation.step()
+        # points passed by the agents that stayed on their path
+        stayed = state.current_path == current_path
+        passed += int(
+            np.sum(
+                ((state.current_index - current_index) % length[current_path])[stayed]
+            )
+        )
+        error, _ = engine.lane_cohesion_error(state, simulation.positions)
+        deviation = np.linalg.norm(error, axis=1)
+        deviation_sum += float(deviation.sum())
+        max_deviation = max(max_deviation, float(deviation.max()))
+        if len(pairs[0]) > 0:
+            separation = np.linalg.norm(
+                simulation.positions[pairs[0]] - simulation.positions[pairs[1]], axis=1
+            )
+            min_separation = min(min_separation, float(separation.min()))
+            separation_violations += int(np.count_nonzero(separation < least_distance))
+
+    metrics = dict(overrides)
+    metrics["min_separation"] = min_separation
+    metrics["separation_violations"] = separation_violations
+    metrics["mean_lane_deviation"] = deviation_sum / (simulation.steps * drone_num)
+    metrics["max_lane_deviation"] = max_deviation
+    metrics["throughput"] = passed / simulation.t
+    return metrics
+
+
+def run_sweep(
+    experiment_file_path,
+    ranges,
+    drone_num=2,
+    simulation_time=100,
+    dt=0.1,
+    max_speed=5,
+    max_workers=None,
+    cache_dir=None,
+):
+    """
+    Simulates every combination of the parameter ranges in a pool of processes
+
+    Parameters
+    ------------
+    experiment_file_path: path of the experiment json file
+    ranges: Dict[parameter (str), List[value]], see sweep_configurations
+    max_workers: number of processes, defaults to the number of CPUs
+    cache_dir: directory of the compiled corridor cache, see corridor.load_corridor
+
+    Returns
+    -----------
+    results: List[Dict] of run_configuration metrics, in the order of the
+        configurations
+    """
+    configurations = sweep_configurations(ranges)
+    # compile the corridor once so the workers all load it from the cache
+    with open(experiment_file_path, "r") as f:
+        load_corridor(experiment_file_path, json.load(f), cache_dir)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                run_configuration,
+                experiment_file_path,
+                overrides,
+                drone_num,
+                simulation_time,
+                dt,
+                max_speed,
+                cache_dir=cache_dir,
+            )
+            for overrides in configurations
+        ]
+        return [future.result() for future in futures]
+
+
+def write_results(results, path, parameters):
+    # one row per configuration, the swept parameters then the SWEEP_METRICS
+    header = list(parameters) + list(SWEEP_METRICS)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for result in results:
+            writer.writerow([result[key] for key in header])
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description="Parallel sweep of the path following gains of an experiment"
+    )
+    parser.add_argument("experiment_file_path")
+    for parameter in SWEEP_PARAMETERS:
+        parser.add_argument("--" + parameter, type=float, nargs="+")
+    parser.add_argument("--drones", type=int, default=2)
+    parser.add_argument("--time", type=float, default=100, help="seconds")
+    parser.add_argument("--dt", type=float, default=0.1)
+    parser.add_argument("--max-speed", type=float, default=5)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--csv", help="path of the results table")
+    parser.add_argument("--cache-dir", help="directory of the compiled corridors")
+    arguments = parser.parse_args(arguments)
+
+    ranges = {
+        parameter: getattr(arguments, parameter)
+        for parameter in SWEEP_PARAMETERS
+        if getattr(arguments, parameter) is not None
+    }
+    results = run_sweep(
+        arguments.experiment_file_path,
+        ranges,
+        arguments.drones,
+        arguments.time,
+        arguments.dt,
+        arguments.max_speed,
+        arguments.workers,
+        arguments.cache_dir,
+    )
+    if arguments.csv:
+        write_results(results, arguments.csv, ranges)
+    header = list(ranges) + list(SWEEP_METRICS)
+    print(",".join(header))
+    for result in results:
+        print(",".join(str(round(result[key], 3)) for key in header))
+
+
+if __name__ == "__main__":
+    main()
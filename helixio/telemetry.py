@@ -4,64 +4,86 @@ import time
 from mavsdk import System
 from mavsdk.action import ActionError
 from mavsdk.offboard import OffboardError, VelocityNedYaw
-import pymap3d as pm
-from data_structures import AgentTelemetry
+from geodetic import NedFrame
+from data_structures import SwarmState
+import gtools
+from telemetry_codec import encode_state_frame, encode_telemetry
+from scheduler import PeriodicScheduler
+from metrics import Metrics
 import numpy as np
 
 
 class SwarmManager:
     def __init__(self):
-        self.telemetry: dict[str, type[AgentTelemetry]] = {}
+        self.telemetry: SwarmState = SwarmState()
+        self._neighbour_grid = None
+        self._neighbour_grid_version = None
+
+    def ages(self, now=None):
+        # seconds since the latest telemetry of each agent was received, in row order
+        if now is None:
+            now = time.time()
+        return now - self.telemetry.received
+
+    def extrapolated_positions(self, now=None, max_extrapolation=1.0):
+        """
+        Constant velocity prediction of the positions at the control instant
+
+        Parameters
+        ------------
+        now: unix time to extrapolate to, defaults to now
+        max_extrapolation: longest prediction in seconds, older states are only
+            carried forward this far
+
+        Returns
+        -----------
+        positions: (N, 3) array in row order
+        """
+        if now is None:
+            now = time.time()
+        dt = np.clip(now - self.telemetry.timestamps, 0, max_extrapolation)
+        return self.telemetry.positions + self.telemetry.velocities * dt[:, None]
+
+    def neighbour_grid(self, cell_size, extrapolate_to=None, max_extrapolation=1.0):
+        # The grid is only rebuilt when a position has been updated since the last call,
+        # so every query between two telemetry updates shares the same grid. Grids of
+        # extrapolated positions depend on the time and are built on every call.
+        if extrapolate_to is not None:
+            return gtools.NeighbourGrid(
+                self.extrapolated_positions(extrapolate_to, max_extrapolation),
+                cell_size,
+                self.telemetry.ids,
+            )
+        grid = self._neighbour_grid
+        if (
+            grid is None
+            or grid.cell_size != cell_size
+            or self._neighbour_grid_version != self.telemetry.position_version
+        ):
+            self._neighbour_grid = gtools.NeighbourGrid(
+                self.telemetry.positions.copy(), cell_size, self.telemetry.ids
+            )
+            self._neighbour_grid_version = self.telemetry.position_version
+        return self._neighbour_grid
 
     def check_swarm_positions(self, required_positions, check_alt=True):
         # takes required positions as NED and checks positions of swarm
-        if check_alt == True:
-            for agent in self.telemetry.keys():
-                if (
-                    np.sqrt(
-                        (
-                            required_positions[agent][0]
-                            - self.telemetry[agent].position_ned[0]
-                        )
-                        ** 2
-                        + (
-                            required_positions[agent][1]
-                            - self.telemetry[agent].position_ned[1]
-                        )
-                        ** 2
-                        + (
-                            required_positions[agent][2]
-                            - self.telemetry[agent].position_ned[2]
-                        )
-                        ** 2
-                    )
-                ) > 0.3:
-                    return False
-        else:
-            for agent in self.telemetry.keys():
-                if (
-                    np.sqrt(
-                        (
-                            required_positions[agent][0]
-                            - self.telemetry[agent].position_ned[0]
-                        )
-                        ** 2
-                        + (
-                            required_positions[agent][1]
-                            - self.telemetry[agent].position_ned[1]
-                        )
-                        ** 2
-                    )
-                ) > 0.3:
-                    return False
-        return True
+        required = np.array(
+            [required_positions[agent] for agent in self.telemetry.ids],
+            dtype="float64",
+        ).reshape(-1, 3)
+        error = required - self.telemetry.positions
+        if check_alt == False:
+            error = error[:, :2]
+        return not np.any(np.linalg.norm(error, axis=1) > 0.3)
 
     def check_swarm_altitudes(self, required_altitudes):
         # takes required altitudes and checks positions of swarm
-        for agent in self.telemetry.keys():
-            if abs(self.telemetry[agent].geodetic[2] - required_altitudes[agent]) > 0.5:
-                return False
-        return True
+        required = np.array(
+            [required_altitudes[agent] for agent in self.telemetry.ids],
+            dtype="float64",
+        )
+        return not np.any(np.abs(self.telemetry.geodetic[:, 2] - required) > 0.5)
 
 
 class TelemetryUpdater:
@@ -74,13 +96,25 @@ class TelemetryUpdater:
         event_loop,
         geodetic_ref,
         ulog_callback,
+        telemetry_format="text",
+        state_frame_rate=0,
+        metrics=None,
     ):
         self.id = id
         self.drone = drone
         self.client = client
+        self.telemetry_format = telemetry_format
+        self.sequence = 0
+        # with state frames enabled the fields are no longer published one by one
+        self.state_frame_rate = state_frame_rate
+        self.publish_fields = state_frame_rate <= 0
+        self.position_timestamp = None
+        self.metrics = Metrics() if metrics is None else metrics
+        # the reference frame is set up once instead of for every position sample
+        self.frame = NedFrame(geodetic_ref[0], geodetic_ref[1], geodetic_ref[2])
 
         asyncio.ensure_future(
-            self.get_position(swarm_telem, geodetic_ref),
+            self.get_position(swarm_telem),
             loop=event_loop,
         )
         asyncio.ensure_future(self.get_heading(swarm_telem), loop=event_loop)
@@ -90,37 +124,58 @@ class TelemetryUpdater:
         )
         asyncio.ensure_future(self.get_battery_level(), loop=event_loop)
         asyncio.ensure_future(self.get_flight_mode(swarm_telem), loop=event_loop)
+        if not self.publish_fields:
+            asyncio.ensure_future(
+                self.publish_state_frames(swarm_telem), loop=event_loop
+            )
         time.sleep(10)
 
-    async def get_position(self, swarm_telem, geodetic_ref):
+    def encode(self, values, value_type="f", timestamp=None):
+        # every published sample gets the next sequence number of this agent
+        self.sequence += 1
+        self.metrics.count("published_fields")
+        return encode_telemetry(
+            values, self.telemetry_format, self.sequence, timestamp, value_type
+        )
+
+    async def get_position(self, swarm_telem):
         # set the rate of telemetry updates to 10Hz
         await self.drone.telemetry.set_rate_position(10)
         async for position in self.drone.telemetry.position():
-
-            swarm_telem[self.id].geodetic = (
+            # the payloads are encoded from the tuples, the swarm state holds arrays
+            geodetic = (
                 position.latitude_deg,
                 position.longitude_deg,
                 position.absolute_altitude_m,
             )
 
-            swarm_telem[self.id].position_ned = pm.geodetic2ned(
+            position_ned = self.frame.geodetic2ned(
                 position.latitude_deg,
                 position.longitude_deg,
                 position.absolute_altitude_m,
-                geodetic_ref[0],
-                geodetic_ref[1],
-                geodetic_ref[2],
             )
 
-            self.client.publish(
-                self.id + "/telemetry/geodetic",
-                str(swarm_telem[self.id].geodetic).strip("()"),
+            if self.position_timestamp is not None:
+                self.metrics.record(
+                    "position_interval", time.time() - self.position_timestamp
+                )
+            self.position_timestamp = time.time()
+            swarm_telem.stamp(
+                swarm_telem.rows[self.id], timestamp=self.position_timestamp
             )
+            swarm_telem[self.id].geodetic = geodetic
+            swarm_telem[self.id].position_ned = position_ned
 
-            self.client.publish(
-                self.id + "/telemetry/position_ned",
-                str(swarm_telem[self.id].position_ned).strip("()"),
-            )
+            if self.publish_fields:
+                self.client.publish(
+                    self.id + "/telemetry/geodetic",
+                    self.encode(geodetic, "d", self.position_timestamp),
+                )
+
+                self.client.publish(
+                    self.id + "/telemetry/position_ned",
+                    self.encode(position_ned, timestamp=self.position_timestamp),
+                )
 
             # if (
             #     -swarm_telem.position_ned[2] <= bottom_alt_limit
@@ -133,27 +188,52 @@ class TelemetryUpdater:
         # await drone.telemetry.set_rate_heading(10)
         async for heading in self.drone.telemetry.heading():
 
-            swarm_telem[self.id].heading = heading
+            swarm_telem[self.id].heading = heading.heading_deg
 
-            self.client.publish(
-                self.id + "/telemetry/heading",
-                str(swarm_telem[self.id].heading.heading_deg).strip("()"),
-            )
+            if self.publish_fields:
+                self.client.publish(
+                    self.id + "/telemetry/heading",
+                    self.encode((heading.heading_deg,)),
+                )
 
     async def get_velocity(self, swarm_telem):
         # set the rate of telemetry updates to 10Hz
         await self.drone.telemetry.set_rate_position_velocity_ned(10)
         async for position_velocity_ned in self.drone.telemetry.position_velocity_ned():
             # changed from list to tuple so formatting for all messages is the same
-            swarm_telem[self.id].velocity_ned = (
+            velocity_ned = (
                 position_velocity_ned.velocity.north_m_s,
                 position_velocity_ned.velocity.east_m_s,
                 position_velocity_ned.velocity.down_m_s,
             )
+            swarm_telem[self.id].velocity_ned = velocity_ned
+            if self.publish_fields:
+                self.client.publish(
+                    self.id + "/telemetry/velocity_ned",
+                    self.encode(velocity_ned),
+                )
+
+    async def publish_state_frames(self, swarm_telem):
+        # Publishes the latest position, velocity, geodetic and heading in one message,
+        # stamped with the time of the position sample they were taken with
+        scheduler = PeriodicScheduler(1 / self.state_frame_rate, "skip")
+        while True:
+            state = swarm_telem[self.id]
+            self.sequence += 1
+            self.metrics.count("published_state_frames")
             self.client.publish(
-                self.id + "/telemetry/velocity_ned",
-                str(swarm_telem[self.id].velocity_ned).strip("()"),
+                self.id + "/telemetry/state",
+                encode_state_frame(
+                    state.position_ned,
+                    state.velocity_ned,
+                    state.geodetic,
+                    state.heading,
+                    self.telemetry_format,
+                    self.sequence,
+                    self.position_timestamp,
+                ),
             )
+            await scheduler.wait()
 
     async def get_arm_status(self, swarm_telem, ulog_callback):
         async for is_armed in self.drone.telemetry.armed():
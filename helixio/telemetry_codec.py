@@ -0,0 +1,226 @@
+import struct
+import time
+import numpy as np
+
+# Telemetry payloads are either the original text format, the values separated by
+# ", ", or a packed binary frame. Binary frames start with BINARY_MAGIC, a byte that
+# can never start the text format, so receivers accept both without configuration.
+TELEMETRY_FORMATS = ("text", "binary")
+BINARY_MAGIC = 0xA5
+
+# magic, value type ("f" float32 or "d" float64), value count, sequence, timestamp
+_HEADER = struct.Struct("<BcBId")
+# position_ned, velocity_ned as float32, geodetic as float64, heading as float32
+_STATE_FRAME = struct.Struct("<3f3f3df")
+_STATE_FRAME_TYPE = b"S"
+
+
+def encode_telemetry(
+    values, telemetry_format="text", sequence=0, timestamp=None, value_type="f"
+):
+    """
+    Parameters
+    ------------
+    values: sequence of floats, e.g. a position_ned tuple
+    telemetry_format: "text" or "binary"
+    sequence: message counter of the sender, wraps at 2**32 (binary only)
+    timestamp: unix time of the sample in seconds, defaults to now (binary only)
+    value_type: "f" packs float32, "d" float64 for values like latitude (binary only)
+
+    Returns
+    -----------
+    payload: str for the text format, bytes for the binary format
+    """
+    if telemetry_format == "text":
+        return ", ".join(str(value) for value in values)
+    if telemetry_format != "binary":
+        raise ValueError("unknown telemetry format: " + str(telemetry_format))
+    if timestamp is None:
+        timestamp = time.time()
+    header = _HEADER.pack(
+        BINARY_MAGIC,
+        value_type.encode(),
+        len(values),
+        sequence % (1 << 32),
+        timestamp,
+    )
+    return header + struct.pack("<" + str(len(values)) + value_type, *values)
+
+
+def decode_telemetry(payload):
+    """
+    Parameters
+    ------------
+    payload: bytes of an MQTT message in either telemetry format
+
+    Returns
+    -----------
+    values: List[float]
+    sequence: message counter of the sender, None for the text format
+    timestamp: unix time of the sample, None for the text format
+    """
+    if payload[:1] == bytes((BINARY_MAGIC,)):
+        _, value_type, count, sequence, timestamp = _HEADER.unpack_from(payload)
+        values = struct.unpack_from(
+            "<" + str(count) + value_type.decode(), payload, _HEADER.size
+        )
+        return list(values), sequence, timestamp
+
+    # Remove none numeric parts of string and then split into the values
+    received_string = payload.decode().strip().strip("()[]")
+    return [float(i) for i in received_string.split(", ")], None, None
+
+
+def encode_state_frame(
+    position_ned,
+    velocity_ned,
+    geodetic,
+    heading,
+    telemetry_format="text",
+    sequence=0,
+    timestamp=None,
+):
+    """
+    Bundles the state of an agent into the payload of one <id>/telemetry/state message
+
+    Parameters
+    ------------
+    position_ned, velocity_ned, geodetic: sequences of 3 floats
+    heading: heading in degrees
+    telemetry_format: "text" or "binary"
+    sequence: message counter of the sender, wraps at 2**32
+    timestamp: unix time of the state in seconds, defaults to now
+
+    Returns
+    -----------
+    payload: str for the text format, bytes for the binary format
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    values = (*position_ned, *velocity_ned, *geodetic, heading)
+    if telemetry_format == "text":
+        # the sequence and timestamp are appended to the values
+        return encode_telemetry((*values, sequence % (1 << 32), timestamp))
+    if telemetry_format != "binary":
+        raise ValueError("unknown telemetry format: " + str(telemetry_format))
+    header = _HEADER.pack(
+        BINARY_MAGIC, _STATE_FRAME_TYPE, len(values), sequence % (1 << 32), timestamp
+    )
+    return header + _STATE_FRAME.pack(*values)
+
+
+def decode_state_frame(payload):
+    """
+    Parameters
+    ------------
+    payload: bytes of an <id>/telemetry/state message in either telemetry format
+
+    Returns
+    -----------
+    position_ned, velocity_ned, geodetic: List[float] of 3 values
+    heading: heading in degrees
+    sequence: message counter of the sender
+    timestamp: unix time of the state
+    """
+    if payload[:1] == bytes((BINARY_MAGIC,)):
+        _, _, _, sequence, timestamp = _HEADER.unpack_from(payload)
+        values = _STATE_FRAME.unpack_from(payload, _HEADER.size)
+    else:
+        values, _, _ = decode_telemetry(payload)
+        sequence, timestamp = int(values[10]), values[11]
+    return (
+        list(values[0:3]),
+        list(values[3:6]),
+        list(values[6:9]),
+        values[9],
+        sequence,
+        timestamp,
+    )
+
+
+# per agent record of a swarm snapshot published by the swarm relay
+_SNAPSHOT_RECORD = np.dtype(
+    [
+        ("position_ned", "<f4", 3),
+        ("velocity_ned", "<f4", 3),
+        ("geodetic", "<f8", 3),
+        ("heading", "<f4"),
+        ("timestamp", "<f8"),
+    ]
+)
+_SNAPSHOT_TYPE = b"W"
+_SNAPSHOT_COUNT = struct.Struct("<H")
+
+
+def encode_swarm_snapshot(
+    ids,
+    positions,
+    velocities,
+    geodetic,
+    heading,
+    timestamps,
+    sequence=0,
+    timestamp=None,
+):
+    """
+    Packs the state of the whole swarm into one binary swarm/state payload
+
+    Parameters
+    ------------
+    ids: List[agent id (string)] of the N agents
+    positions, velocities, geodetic: (N, 3) arrays
+    heading: (N,) heading in degrees
+    timestamps: (N,) unix time of the latest state of each agent
+    sequence: message counter of the relay, wraps at 2**32
+    timestamp: unix time of the snapshot, defaults to now
+
+    Returns
+    -----------
+    payload: bytes
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    records = np.zeros(len(ids), dtype=_SNAPSHOT_RECORD)
+    records["position_ned"] = positions
+    records["velocity_ned"] = velocities
+    records["geodetic"] = geodetic
+    records["heading"] = heading
+    records["timestamp"] = timestamps
+    encoded_ids = [agent_id.encode() for agent_id in ids]
+    return b"".join(
+        [
+            _HEADER.pack(
+                BINARY_MAGIC, _SNAPSHOT_TYPE, 0, sequence % (1 << 32), timestamp
+            ),
+            _SNAPSHOT_COUNT.pack(len(ids)),
+            *(bytes((len(agent_id),)) + agent_id for agent_id in encoded_ids),
+            records.tobytes(),
+        ]
+    )
+
+
+def decode_swarm_snapshot(payload):
+    """
+    Parameters
+    ------------
+    payload: bytes of a swarm/state message
+
+    Returns
+    -----------
+    ids: List[agent id (string)]
+    records: structured array with fields position_ned, velocity_ned, geodetic,
+        heading and timestamp, one element per agent
+    sequence: message counter of the relay
+    timestamp: unix time of the snapshot
+    """
+    _, _, _, sequence, timestamp = _HEADER.unpack_from(payload)
+    offset = _HEADER.size
+    (count,) = _SNAPSHOT_COUNT.unpack_from(payload, offset)
+    offset += _SNAPSHOT_COUNT.size
+    ids = []
+    for _ in range(count):
+        length = payload[offset]
+        ids.append(payload[offset + 1 : offset + 1 + length].decode())
+        offset += 1 + length
+    records = np.frombuffer(payload, dtype=_SNAPSHOT_RECORD, count=count, offset=offset)
+    return ids, records, sequence, timestamp
@@ -0,0 +1,634 @@
+from __future__ import annotations
+import csv
+import json
+import os
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, traces are then written as CSV only
+    pa = None
+    pq = None
+
+# columns of a trace, shared by the simulation and flight log CSV files. x is east, y
+# north and z up
+TRACE_COLUMNS = (
+    "x(m)",
+    "y(m)",
+    "z(m)",
+    "time(s)",
+    "drone id",
+    "offboard mode status",
+    "type of experiment",
+)
+# formats of stored traces, TraceWriter streams the csv and parquet ones
+TRACE_FORMATS = ("csv", "parquet", "npz")
+# level of detail of the plotly animations: most frames in an animation and the
+# distance in meters the drawn trace lines may deviate from the trajectories
+MAX_ANIMATION_FRAMES = 500
+LINE_TOLERANCE = 0.05
+_TRACE_EXTENSIONS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".npz": "npz",
+}
+
+
+class TraceRecorder:
+    """
+    Sink keeping the trace in memory, for plots and tests
+
+    Parameters
+    ------------
+    stride: only every stride-th step is kept, starting with the first
+
+    Attributes
+    ------------
+    times: List[t (float)]
+    positions: List[(N, 3) array] NED positions at each time
+    """
+
+    def __init__(self, stride=1):
+        self.stride = stride
+        self.steps = 0
+        self.ids = []
+        self.times = []
+        self.positions = []
+
+    def __call__(self, t, ids, positions, velocities):
+        self.steps += 1
+        if (self.steps - 1) % self.stride != 0:
+            return
+        self.ids = ids
+        self.times.append(t)
+        self.positions.append(positions.copy())
+
+
+class LineSimplifier:
+    """
+    Sink simplifying the trajectory of every drone while the simulation runs, so the
+    trace lines keep the full time resolution within tolerance without the whole
+    trajectory being kept in memory. A point is only dropped when every point since
+    the last kept one lies within tolerance of the line from that point to the newest
+    one. A point is also kept once window points have gone by, which bounds the work
+    per step.
+
+    Parameters
+    ------------
+    tolerance: largest distance in meters of a dropped point from the simplified line
+    window: most points between two kept points
+
+    Attributes
+    ------------
+    lines: List[(K_d, 3) array] NED simplified trajectory of each drone
+    """
+
+    def __init__(self, tolerance=LINE_TOLERANCE, window=256):
+        self.tolerance = tolerance
+        self.window = window
+        self.ids = []
+        self._vertices = []
+        self._points = None
+        self._counts = None
+
+    def __call__(self, t, ids, positions, velocities):
+        positions = np.asarray(positions, dtype="float64")
+        if self._points is None:
+            self.ids = ids
+            self._vertices = [[position.copy()] for position in positions]
+            self._points = np.empty((len(positions), self.window, 3), dtype="float64")
+            self._points[:, 0] = positions
+            self._counts = np.ones(len(positions), dtype="int64")
+            return
+        # distance of the points since the last kept one from the line to the newest
+        anchors = self._points[:, 0]
+        segment = positions - anchors
+        inner = self._points[:, 1:] - anchors[:, None]
+        length_2 = np.einsum("ij,ij->i", segment, segment)
+        along = np.einsum("ijk,ik->ij", inner, segment)
+        along = np.clip(
+            np.divide(along, length_2[:, None], where=length_2[:, None] > 0, out=along),
+            0,
+            1,
+        )
+        inner = inner - along[..., None] * segment[:, None]
+        distance_2 = np.einsum("ijk,ijk->ij", inner, inner)
+        distance_2[np.arange(self.window - 1) >= self._counts[:, None] - 1] = 0
+        full = (distance_2 > self.tolerance**2).any(axis=1) | (
+            self._counts == self.window
+        )
+        # the previous point is kept and starts the next line
+        for drone in np.flatnonzero(full):
+            last = self._points[drone, self._counts[drone] - 1].copy()
+            self._vertices[drone].append(last)
+            self._points[drone, 0] = last
+            self._counts[drone] = 1
+        drones = np.arange(len(positions))
+        self._points[drones, self._counts] = positions
+        self._counts += 1
+
+    @property
+    def lines(self):
+        if self._points is None:
+            return []
+        return [
+            np.array(vertices + ([points[count - 1]] if count > 1 else []))
+            for vertices, points, count in zip(
+                self._vertices, self._points, self._counts
+            )
+        ]
+
+
+class TraceWriter:
+    """
+    Sink writing a trace to a CSV or Parquet file while the simulation runs. Rows are
+    gathered into columnar chunks of chunk_steps time steps and written out when a
+    chunk is full, so memory stays bounded however long the simulation is.
+
+    Parameters
+    ------------
+    path: output file, the format is taken from its extension unless given
+    trace_format: "csv" or "parquet", parquet requires pyarrow
+    chunk_steps: time steps gathered before a chunk is written
+    experiment_type: value of the "type of experiment" column
+
+    Usage
+    ------------
+    with TraceWriter("trace.parquet") as writer:
+        simulation.run(100, writer)
+    """
+
+    def __init__(
+        self,
+        path,
+        trace_format=None,
+        chunk_steps=1000,
+        experiment_type="Python_simulation",
+    ):
+        if trace_format is None:
+            trace_format = _path_format(path)
+        if trace_format not in ("csv", "parquet"):
+            raise ValueError("traces cannot be streamed as: " + str(trace_format))
+        _check_format(trace_format)
+        self.path = path
+        self.trace_format = trace_format
+        self.chunk_steps = chunk_steps
+        self.experiment_type = experiment_type
+        self.rows = 0
+        self._ids = None
+        self._chunk = None
+        self._steps = 0
+        self._file = None
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __call__(self, t, ids, positions, velocities):
+        if self._chunk is None:
+            self._ids = np.asarray(ids, dtype="object")
+            size = self.chunk_steps * len(ids)
+            self._chunk = {
+                "position": np.empty((size, 3), dtype="float64"),
+                "time": np.empty(size, dtype="float64"),
+            }
+        drone_num = len(self._ids)
+        start = self._steps * drone_num
+        # x is east, y north and z up
+        self._chunk["position"][start : start + drone_num, 0] = positions[:, 1]
+        self._chunk["position"][start : start + drone_num, 1] = positions[:, 0]
+        self._chunk["position"][start : start + drone_num, 2] = -positions[:, 2]
+        self._chunk["time"][start : start + drone_num] = t
+        self._steps += 1
+        if self._steps == self.chunk_steps:
+            self.flush()
+
+    def columns(self, rows):
+        # the TRACE_COLUMNS of the first rows of the current chunk
+        position = self._chunk["position"][:rows]
+        steps = rows // len(self._ids)
+        return {
+            "x(m)": position[:, 0],
+            "y(m)": position[:, 1],
+            "z(m)": position[:, 2],
+            "time(s)": self._chunk["time"][:rows],
+            "drone id": np.tile(self._ids, steps),
+            "offboard mode status": np.ones(rows, dtype="int64"),
+            "type of experiment": np.full(rows, self.experiment_type, dtype="object"),
+        }
+
+    def flush(self):
+        # writes out the steps gathered in the current chunk
+        if self._steps == 0 and self._writer is not None:
+            return
+        rows = self._steps * (0 if self._ids is None else len(self._ids))
+        if self._chunk is None:
+            columns = {name: np.empty(0, dtype="object") for name in TRACE_COLUMNS}
+        else:
+            columns = self.columns(rows)
+        if self.trace_format == "csv":
+            if self._writer is None:
+                self._file = open(self.path, "w", newline="")
+                self._writer = csv.writer(self._file)
+                self._writer.writerow(TRACE_COLUMNS)
+            self._writer.writerows(
+                zip(*(columns[name].tolist() for name in TRACE_COLUMNS))
+            )
+            self._file.flush()
+        else:
+            table = _arrow_table(columns)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        self.rows += rows
+        self._steps = 0
+
+    def close(self):
+        self.flush()
+        if self.trace_format == "csv":
+            self._file.close()
+        else:
+            self._writer.close()
+
+
+class Trace:
+    """
+    One run of a swarm held column by column in per drone chunks, as stored by
+    save_trace and loaded by load_trace
+
+    Parameters
+    ------------
+    drones: Dict[drone id (str), Dict] with for every drone the arrays
+        "time": (T,) times in seconds
+        "position": (T, 3) x (east), y (north) and z (up) in meters
+        "offboard": (T,) offboard mode status, 1 in offboard mode
+    experiment_type: "type of experiment" of the run, e.g. Python_simulation or real
+    metadata: Dict of other JSON serialisable information about the run
+    """
+
+    def __init__(self, drones, experiment_type="", metadata=None):
+        self.drones = drones
+        self.experiment_type = experiment_type
+        self.metadata = {} if metadata is None else metadata
+
+    def __len__(self):
+        return sum(len(drone["time"]) for drone in self.drones.values())
+
+    @property
+    def ids(self):
+        return list(self.drones)
+
+    @classmethod
+    def from_columns(cls, columns, metadata=None) -> Trace:
+        """
+        Parameters
+        ------------
+        columns: Dict with an array for each of the TRACE_COLUMNS, rows of the drones
+            can be in any order and are kept in their order per drone
+
+        Returns
+        -----------
+        Trace with the drones in the order they first appear
+        """
+        ids = np.asarray(columns["drone id"]).astype("str")
+        experiment_types = np.asarray(columns["type of experiment"]).astype("str")
+        unique_ids, first, inverse = np.unique(
+            ids, return_index=True, return_inverse=True
+        )
+        rows = np.argsort(inverse, kind="stable")
+        counts = np.bincount(inverse, minlength=len(unique_ids))
+        starts = np.concatenate(([0], np.cumsum(counts)))
+        position = np.stack(
+            [np.asarray(columns[name], dtype="float64") for name in TRACE_COLUMNS[:3]],
+            axis=-1,
+        )
+        time = np.asarray(columns["time(s)"], dtype="float64")
+        offboard = np.asarray(columns["offboard mode status"]).astype("int8")
+        drones = {}
+        for drone in np.argsort(first):
+            drone_rows = rows[starts[drone] : starts[drone + 1]]
+            drones[str(unique_ids[drone])] = {
+                "time": time[drone_rows],
+                "position": position[drone_rows],
+                "offboard": offboard[drone_rows],
+            }
+        experiment_type = experiment_types[0] if len(experiment_types) > 0 else ""
+        return cls(drones, str(experiment_type), metadata)
+
+    def columns(self):
+        # the TRACE_COLUMNS of every row, drone after drone
+        drones = list(self.drones.values())
+        if len(drones) == 0:
+            return {name: np.empty(0) for name in TRACE_COLUMNS}
+        position = np.concatenate([drone["position"] for drone in drones])
+        return {
+            "x(m)": position[:, 0],
+            "y(m)": position[:, 1],
+            "z(m)": position[:, 2],
+            "time(s)": np.concatenate([drone["time"] for drone in drones]),
+            "drone id": np.repeat(
+                np.array(self.ids, dtype="object"),
+                [len(drone["time"]) for drone in drones],
+            ),
+            "offboard mode status": np.concatenate(
+                [drone["offboard"] for drone in drones]
+            ).astype("int64"),
+            "type of experiment": np.full(
+                len(position), self.experiment_type, dtype="object"
+            ),
+        }
+
+
+def save_trace(trace, path, trace_format=None):
+    """
+    Stores a trace, by default in the format of the extension of path
+
+    Parameters
+    ------------
+    trace: Trace
+    path: output file
+    trace_format: "npz" compressed numpy arrays of every drone, "parquet" one row
+        group per drone (requires pyarrow) or "csv" the TRACE_COLUMNS rows, which do
+        not keep the metadata
+    """
+    if trace_format is None:
+        trace_format = _path_format(path)
+    _check_format(trace_format)
+    metadata = json.dumps(
+        {
+            "ids": trace.ids,
+            "experiment_type": trace.experiment_type,
+            "metadata": trace.metadata,
+        }
+    )
+    if trace_format == "npz":
+        arrays = {"metadata": np.array(metadata)}
+        for index, drone in enumerate(trace.drones.values()):
+            for name, values in drone.items():
+                arrays[str(index) + "/" + name] = values
+        with open(path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+    elif trace_format == "parquet":
+        schema = _arrow_table(
+            {name: np.empty(0, dtype="object") for name in TRACE_COLUMNS}
+        ).schema.with_metadata({"helixio": metadata})
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            for drone_id in trace.ids:
+                drone_trace = Trace(
+                    {drone_id: trace.drones[drone_id]}, trace.experiment_type
+                )
+                writer.write_table(_arrow_table(drone_trace.columns(), schema))
+    else:
+        columns = trace.columns()
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(TRACE_COLUMNS)
+            writer.writerows(zip(*(columns[name].tolist() for name in TRACE_COLUMNS)))
+
+
+def load_trace(path, trace_format=None) -> Trace:
+    """
+    Loads a trace stored by save_trace, or any CSV file with the TRACE_COLUMNS such as
+    those of path_following_visualisation and visualizing_ulog
+    """
+    if trace_format is None:
+        trace_format = _path_format(path)
+    _check_format(trace_format)
+    if trace_format == "npz":
+        with np.load(path, allow_pickle=False) as arrays:
+            stored = json.loads(str(arrays["metadata"]))
+            drones = {
+                drone_id: {
+                    name: arrays[str(index) + "/" + name]
+                    for name in ("time", "position", "offboard")
+                }
+                for index, drone_id in enumerate(stored["ids"])
+            }
+        return Trace(drones, stored["experiment_type"], stored["metadata"])
+    if trace_format == "parquet":
+        table = pq.read_table(path)
+        columns = {name: table.column(name).to_numpy() for name in TRACE_COLUMNS}
+        stored = (table.schema.metadata or {}).get(b"helixio")
+        metadata = {} if stored is None else json.loads(stored)["metadata"]
+        return Trace.from_columns(columns, metadata)
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    header = rows[0]
+    values = list(zip(*rows[1:]))
+    if len(values) == 0:
+        values = [()] * len(header)
+    columns = dict(zip(header, values))
+    return Trace.from_columns(
+        {
+            "x(m)": np.array(columns["x(m)"], dtype="float64"),
+            "y(m)": np.array(columns["y(m)"], dtype="float64"),
+            "z(m)": np.array(columns["z(m)"], dtype="float64"),
+            "time(s)": np.array(columns["time(s)"], dtype="float64"),
+            "drone id": np.array(columns["drone id"], dtype="str"),
+            "offboard mode status": np.array(
+                columns["offboard mode status"], dtype="float64"
+            ),
+            "type of experiment": np.array(columns["type of experiment"], dtype="str"),
+        }
+    )
+
+
+def load_traces(folder):
+    """
+    Returns
+    -----------
+    traces: Dict[file name (str), Trace] of every csv, parquet and npz trace in folder
+    """
+    traces = {}
+    for file_name in sorted(os.listdir(folder)):
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension in _TRACE_EXTENSIONS:
+            traces[file_name] = load_trace(os.path.join(folder, file_name))
+    return traces
+
+
+def _path_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    return _TRACE_EXTENSIONS.get(extension, "csv")
+
+
+def _check_format(trace_format):
+    if trace_format not in TRACE_FORMATS:
+        raise ValueError("unknown trace format: " + str(trace_format))
+    if trace_format == "parquet" and pa is None:
+        raise ImportError("parquet traces require pyarrow")
+
+
+def _arrow_table(columns, schema=None):
+    return pa.table(
+        {
+            "x(m)": pa.array(columns["x(m)"], pa.float64()),
+            "y(m)": pa.array(columns["y(m)"], pa.float64()),
+            "z(m)": pa.array(columns["z(m)"], pa.float64()),
+            "time(s)": pa.array(columns["time(s)"], pa.float64()),
+            "drone id": pa.array(columns["drone id"], pa.string()),
+            "offboard mode status": pa.array(
+                columns["offboard mode status"], pa.int64()
+            ),
+            "type of experiment": pa.array(columns["type of experiment"], pa.string()),
+        },
+        schema=schema,
+    )
+
+
+def shared_time_grid(times, dt):
+    """
+    Parameters
+    ------------
+    times: List[(T_i,) array] sample times of each drone
+    dt: time step of the grid in seconds
+
+    Returns
+    -----------
+    grid: (T,) times every dt from the latest start to the earliest finish, the span
+        covered by the samples of every drone
+    """
+    start = max(float(np.min(drone_times)) for drone_times in times)
+    finish = min(float(np.max(drone_times)) for drone_times in times)
+    if finish < start:
+        return np.empty(0, dtype="float64")
+    count = int(np.floor((finish - start) / dt + 1e-9)) + 1
+    return start + dt * np.arange(count)
+
+
+def resample_trajectories(times, positions, grid):
+    """
+    Linear interpolation of the trajectories of all drones on a shared time grid, with
+    one np.interp call per axis for the whole swarm
+
+    Parameters
+    ------------
+    times: List[(T_i,) array] sample times of each drone, in any order (e.g. the logs of
+        several flights of one drone concatenated)
+    positions: List[(T_i, 3) array] positions of each drone at its sample times
+    grid: (T,) times to resample at, outside the samples of a drone its first or last
+        position is repeated
+
+    Returns
+    -----------
+    resampled: (D, T, 3) positions of the D drones at the grid times
+    """
+    grid = np.asarray(grid, dtype="float64")
+    drone_num = len(times)
+    if drone_num == 0:
+        return np.empty((0, len(grid), 3), dtype="float64")
+    # np.interp needs increasing times, the samples of each drone are sorted first
+    times = [np.asarray(drone_times, dtype="float64") for drone_times in times]
+    positions = [
+        np.asarray(drone_positions, dtype="float64") for drone_positions in positions
+    ]
+    for drone, drone_times in enumerate(times):
+        if np.any(np.diff(drone_times) < 0):
+            order = np.argsort(drone_times, kind="stable")
+            times[drone] = drone_times[order]
+            positions[drone] = positions[drone][order]
+    first = np.array([np.min(drone_times) for drone_times in times], dtype="float64")
+    last = np.array([np.max(drone_times) for drone_times in times], dtype="float64")
+    # the drones are laid end to end on one time axis, each shifted past the previous
+    # one, so a single interpolation covers all of them. The grid is clamped to the
+    # samples of each drone so it stays within that drone's part of the axis
+    origin = min(first.min(), grid.min(initial=np.inf))
+    span = max(last.max(), grid.max(initial=-np.inf)) - origin + 1
+    offsets = np.arange(drone_num) * span - origin
+    shifted_times = np.concatenate(
+        [drone_times + offsets[drone] for drone, drone_times in enumerate(times)]
+    )
+    shifted_grid = (
+        np.clip(grid[None, :], first[:, None], last[:, None]) + offsets[:, None]
+    ).reshape(-1)
+    stacked = np.concatenate(positions)
+    resampled = np.empty((drone_num * len(grid), 3), dtype="float64")
+    for axis in range(3):
+        resampled[:, axis] = np.interp(shifted_grid, shifted_times, stacked[:, axis])
+    return resampled.reshape(drone_num, len(grid), 3)
+
+
+def simplify_polyline(points, tolerance):
+    """
+    Ramer-Douglas-Peucker simplification of a trajectory
+
+    Parameters
+    ------------
+    points: (T, 3) positions along the trajectory
+    tolerance: largest distance in meters of a dropped point from the simplified line
+
+    Returns
+    -----------
+    kept: (K,) increasing indices of the points kept, always the first and the last
+    """
+    points = np.asarray(points, dtype="float64")
+    count = len(points)
+    if count <= 2:
+        return np.arange(count)
+    keep = np.zeros(count, dtype="bool")
+    keep[0] = keep[-1] = True
+    spans = [(0, count - 1)]
+    while len(spans) > 0:
+        start, end = spans.pop()
+        if end - start < 2:
+            continue
+        # distance of the inner points from the segment between the span ends
+        segment = points[end] - points[start]
+        inner = points[start + 1 : end] - points[start]
+        length_2 = segment @ segment
+        if length_2 > 0:
+            along = np.clip(inner @ segment / length_2, 0, 1)
+            inner = inner - along[:, None] * segment
+        distance = np.einsum("ij,ij->i", inner, inner)
+        farthest = int(np.argmax(distance))
+        if distance[farthest] > tolerance**2:
+            split = start + 1 + farthest
+            keep[split] = True
+            spans.append((start, split))
+            spans.append((split, end))
+    return np.nonzero(keep)[0]
+
+
+def level_of_detail(
+    positions, times, max_frames=MAX_ANIMATION_FRAMES, line_tolerance=LINE_TOLERANCE
+):
+    """
+    Decimates the trajectories of a swarm before they are handed to plotly, the
+    animation keeps every stride-th time and the trace lines are simplified within
+    line_tolerance
+
+    Parameters
+    ------------
+    positions: (D, T, 3) positions of the D drones at the shared times
+    times: (T,) times of the animation frames
+    max_frames: most frames in the animation, None keeps every frame
+    line_tolerance: see simplify_polyline, None keeps every point of the lines
+
+    Returns
+    -----------
+    frame_positions: (D, F, 3) positions of the drones at the kept frames
+    frame_times: (F,) times of the kept frames
+    lines: List[(K_d, 3) array] simplified trajectory of each drone
+    stride: number of samples between two kept frames
+    """
+    positions = np.asarray(positions, dtype="float64")
+    times = np.asarray(times)
+    count = len(times)
+    stride = 1
+    if max_frames is not None and count > max_frames:
+        stride = -(-count // max_frames)
+    frames = np.arange(0, count, stride)
+    if line_tolerance is None:
+        lines = list(positions)
+    else:
+        lines = [
+            trajectory[simplify_polyline(trajectory, line_tolerance)]
+            for trajectory in positions
+        ]
+    return positions[:, frames], times[frames], lines, stride
@@ -0,0 +1,35 @@
+import json
+import os
+import sys
+import pytest
+
+# the helixio modules import each other by module name as they are run from the
+# helixio directory, so the directory is put on the path for the tests as well
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "helixio"))
+# the same goes for the post flight tools
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "Post_flight_tools")
+)
+
+
+@pytest.fixture
+def experiment_file(tmp_path):
+    # two agents flying north along a single straight lane
+    parameters = {
+        "k_migration": 1,
+        "k_lane_cohesion": 2,
+        "k_rotation": 0,
+        "k_seperation": 2,
+        "r_conflict": 5,
+        "r_collision": 2.5,
+        "pass_permission": [False],
+        "repeat": True,
+        "pre_start_positions": [[0, 0, -20], [0, 10, -20]],
+        "initial_paths": [0],
+        "corridor_radius": [5],
+        "path_rotation_dir": [1],
+        "corridor_points": [[[10.0 * i, 0, -20] for i in range(20)]],
+    }
+    path = tmp_path / "experiment.json"
+    path.write_text(json.dumps(parameters))
+    return str(path)
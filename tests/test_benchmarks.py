@@ -0,0 +1,151 @@
+from helixio.simulator import Simulation
+from helixio.metrics import Metrics
+from helixio.gtools import NeighbourGrid
+import os
+import random
+import time
+import pytest
+import numpy as np
+
+# Seeded simulations of the bundled experiments, checked against the golden traces in
+# tests/golden and timed to give a baseline for the performance of the path following
+# engine and the neighbour grid. Run with HELIXIO_UPDATE_GOLDEN=1 to rewrite the
+# golden traces after an intended change of behaviour. The timings are recorded as
+# properties of the tests, e.g. in the report of --junitxml.
+
+EXPERIMENTS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "helixio", "experiments"
+)
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden")
+GOLDEN_EXPERIMENTS = (
+    "Circle_arc_S_to_N_NZ",
+    "Torus_S_to_N_NZ",
+    "convergence_S_to_N_NZ",
+)
+SWARM_SIZES = (2, 10, 50)
+SEED = 1
+SIMULATION_TIME = 20
+# every how many steps the positions are kept in the golden traces
+GOLDEN_STEP = 10
+# meters. Rounding differs between numpy versions and platforms by about 1e-12 m and
+# the swarm amplifies a perturbation at most ~1e4 times over a golden run (see
+# test_golden_tolerance_covers_rounding), while a change of the path following moves
+# the drones by a good part of a step, up to max_speed * dt = 0.5 m
+GOLDEN_TOLERANCE = 1e-3
+
+
+@pytest.fixture(scope="module")
+def cache_dir(tmp_path_factory):
+    # the compiled corridors are cached outside of the source tree
+    return str(tmp_path_factory.mktemp("corridor_cache"))
+
+
+def simulate(experiment, drone_num, cache_dir, seed=SEED, metrics=None):
+    simulation = Simulation(
+        os.path.join(EXPERIMENTS_DIR, experiment + ".json"),
+        drone_num,
+        seed=seed,
+        start_spread=20,
+        metrics=metrics,
+        cache_dir=cache_dir,
+    )
+    positions = []
+
+    def sink(t, ids, step_positions, velocities):
+        if simulation.steps % GOLDEN_STEP == 0:
+            positions.append(step_positions.copy())
+
+    simulation.run(SIMULATION_TIME, sink)
+    return simulation, np.array(positions)
+
+
+# test of golden traces ----------------------------------------------------------------------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("drone_num", SWARM_SIZES)
+@pytest.mark.parametrize("experiment", GOLDEN_EXPERIMENTS)
+def test_golden_trace(experiment, drone_num, cache_dir):
+    _, positions = simulate(experiment, drone_num, cache_dir)
+    path = os.path.join(GOLDEN_DIR, experiment + "_" + str(drone_num) + ".npy")
+    if os.environ.get("HELIXIO_UPDATE_GOLDEN"):
+        np.save(path, positions)
+    golden = np.load(path)
+    assert positions.shape == golden.shape
+    assert np.allclose(positions, golden, rtol=0, atol=GOLDEN_TOLERANCE)
+
+
+@pytest.mark.parametrize("experiment", GOLDEN_EXPERIMENTS)
+def test_golden_tolerance_covers_rounding(experiment, cache_dir):
+    # a perturbation far above rounding noise stays far below the tolerance. It is
+    # applied after the first step, as the pre start positions are exactly r_conflict
+    # apart, which rounds the same everywhere but not once perturbed
+    simulations = [
+        Simulation(
+            os.path.join(EXPERIMENTS_DIR, experiment + ".json"),
+            SWARM_SIZES[-1],
+            seed=SEED,
+            start_spread=20,
+            cache_dir=cache_dir,
+        )
+        for i in range(2)
+    ]
+    for simulation in simulations:
+        simulation.step()
+    simulations[1].positions += 1e-9 * np.random.default_rng(SEED).standard_normal(
+        simulations[1].positions.shape
+    )
+    divergence = 0
+    while simulations[0].t <= SIMULATION_TIME:
+        for simulation in simulations:
+            simulation.step()
+        divergence = max(
+            divergence,
+            np.abs(simulations[0].positions - simulations[1].positions).max(),
+        )
+    assert divergence < GOLDEN_TOLERANCE / 10
+
+
+def test_seeded_runs_repeat(cache_dir):
+    # the experiments have 10 pre start positions, the other drones start at random
+    _, first = simulate(GOLDEN_EXPERIMENTS[0], 50, cache_dir, seed=7)
+    _, second = simulate(GOLDEN_EXPERIMENTS[0], 50, cache_dir, seed=7)
+    _, other = simulate(GOLDEN_EXPERIMENTS[0], 50, cache_dir, seed=8)
+    assert np.array_equal(first, second)
+    assert not np.array_equal(first, other)
+
+
+def test_seeded_migration_test():
+    flocking = pytest.importorskip("helixio.flocking")
+    first = [flocking.migration_test(False, random.Random(3)) for i in range(5)]
+    second = [flocking.migration_test(False, random.Random(3)) for i in range(5)]
+    assert first == second
+
+
+# benchmarks ----------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("drone_num", SWARM_SIZES)
+def test_simulation_benchmark(drone_num, record_property, cache_dir):
+    metrics = Metrics(window=10000)
+    start = time.perf_counter()
+    simulation, _ = simulate(
+        GOLDEN_EXPERIMENTS[0], drone_num, cache_dir, metrics=metrics
+    )
+    steps_per_second = simulation.steps / (time.perf_counter() - start)
+    histograms = metrics.snapshot()["histograms"]
+    record_property("steps_per_second", steps_per_second)
+    for name in ("neighbour_grid", "path_following"):
+        for percentile in ("p50", "p99"):
+            record_property(name + "_" + percentile, histograms[name][percentile])
+    assert histograms["path_following"]["count"] == simulation.steps
+
+
+@pytest.mark.parametrize("point_num", (100, 1000, 10000))
+def test_neighbour_grid_benchmark(point_num, record_property):
+    positions = np.random.default_rng(SEED).uniform(0, 200, (point_num, 3))
+    start = time.perf_counter()
+    grid = NeighbourGrid(positions, 5)
+    rows_1, rows_2, _ = grid.query_pairs()
+    duration = time.perf_counter() - start
+    record_property("neighbour_grid_seconds", duration)
+    assert len(rows_1) == len(rows_2)
@@ -0,0 +1,139 @@
+from helixio import corridor as corridor_module
+from helixio.corridor import CorridorGeometry, SegmentIndex, load_corridor
+import json
+import pytest
+import numpy as np
+
+
+def two_lanes():
+    # two parallel lanes going north 4 m apart, with radii touching at 4 m
+    lane_0 = [[10.0 * i, 0.0, -20.0] for i in range(4)]
+    lane_1 = [[10.0 * i, 4.0, -20.0] for i in range(4)]
+    return [lane_0, lane_1], [2, 2], [1, -1]
+
+
+def test_compile():
+    points, lane_radius, rotation_dir = two_lanes()
+    corridor = CorridorGeometry.compile(points, lane_radius, rotation_dir)
+
+    assert corridor.path_count == 2
+    assert np.array_equal(corridor.directions[0, 0], [1, 0, 0])
+    assert np.array_equal(corridor.directions[0, 3], [-1, 0, 0])  # closes the loop
+    assert np.array_equal(corridor.segment_length[0], [10, 10, 10, 30])
+    # every point of each lane is adjacent to the same point of the other lane
+    assert corridor.switch_index.shape == (2, 4, 1)
+    assert list(corridor.switch_path[0, :, 0]) == [1, 1, 1, 1]
+    assert list(corridor.switch_index[0, :, 0]) == [0, 1, 2, 3]
+    assert np.array_equal(corridor.switch_vector[0, 1, 0], [0, -1, 0])
+    assert np.array_equal(corridor.switch_vector[1, 1, 0], [0, 1, 0])
+    assert corridor.adjacent_paths(0) == [1]
+
+
+def test_lane_graph_links_every_adjacent_lane():
+    # three lanes going north at east 0, 4 and 8, the middle lane is adjacent to both
+    # and the outer lanes only to the middle one. The middle lane is slightly skewed,
+    # within the angle tolerance but not exactly parallel
+    lanes = [
+        [[10.0 * i, 0.0, -20.0] for i in range(4)],
+        [[10.0 * i, 4.0 + i * 1e-6, -20.0] for i in range(4)],
+        [[10.0 * i, 8.0, -20.0] for i in range(4)],
+    ]
+    corridor = CorridorGeometry.compile(lanes, [2.5, 2.5, 2.5], [1, 1, 1])
+
+    assert corridor.switch_index.shape[2] == 2
+    assert list(corridor.switch_path[1, 1]) == [2, 0]  # starting from path j + 1
+    assert list(corridor.switch_path[2, 1]) == [1, -1]
+    assert list(corridor.switch_path[0, 1]) == [1, -1]
+    assert corridor.adjacent_paths(1) == [0, 2]
+    assert np.allclose(corridor.switch_vector[1, 1, 1], [0, 1, 0])
+
+    exact = CorridorGeometry.compile(lanes, [2.5, 2.5, 2.5], [1, 1, 1], 0)
+    assert np.all(exact.switch_index[0, :3] == -1)
+
+
+def test_cache_round_trip(tmp_path):
+    points, lane_radius, rotation_dir = two_lanes()
+    parameters = {
+        "corridor_points": points,
+        "corridor_radius": lane_radius,
+        "path_rotation_dir": rotation_dir,
+    }
+    experiment_file_path = tmp_path / "experiment.json"
+    experiment_file_path.write_text(json.dumps(parameters))
+    cache_dir = tmp_path / "cache"
+
+    compiled = load_corridor(str(experiment_file_path), parameters, str(cache_dir))
+    assert len(list(cache_dir.iterdir())) == 1
+    cached = load_corridor(str(experiment_file_path), parameters, str(cache_dir))
+    assert isinstance(cached.points, np.memmap)
+    for name in ("points", "directions", "switch_index", "switch_vector"):
+        assert np.array_equal(getattr(cached, name), getattr(compiled, name))
+
+    # a changed experiment file gets its own entry
+    parameters["corridor_radius"] = [1, 1]
+    experiment_file_path.write_text(json.dumps(parameters))
+    changed = load_corridor(str(experiment_file_path), parameters, str(cache_dir))
+    assert len(list(cache_dir.iterdir())) == 2
+    assert np.all(changed.switch_index == -1)
+
+
+def test_corridor_cache_key_changes_with_the_version(tmp_path, monkeypatch):
+    experiment_file_path = tmp_path / "experiment.json"
+    experiment_file_path.write_text("{}")
+    key = corridor_module.corridor_cache_key(str(experiment_file_path))
+    monkeypatch.setattr(
+        corridor_module,
+        "CORRIDOR_CACHE_VERSION",
+        corridor_module.CORRIDOR_CACHE_VERSION + 1,
+    )
+    assert corridor_module.corridor_cache_key(str(experiment_file_path)) != key
+
+
+@pytest.mark.parametrize("use_grid", [True, False])
+def test_segment_index(use_grid):
+    corridor = CorridorGeometry.compile(*two_lanes())
+    segment_index = SegmentIndex(corridor, use_grid=use_grid)
+    assert list(segment_index.arc_length[0]) == [0, 10, 20, 30, 60]
+
+    segments, arc_length, distance = segment_index.locate(
+        [0, 0, 1, 1],
+        [[15, 1, -20], [-5, 0, -20], [30, 4, -17], [25, 10, -20]],
+    )
+    assert list(segments) == [1, 0, 2, 2]  # ties go to the lower segment
+    assert arc_length == pytest.approx([15, 0, 30, 25])
+    assert distance == pytest.approx([1, 5, 3, 6])
+
+
+@pytest.mark.parametrize("use_grid", [True, False])
+def test_segment_index_open_path_has_no_closing_segment(use_grid):
+    # a bent open path, the chord from its last point back to the first is no segment
+    points = [[[0.0, 0.0, -20.0], [40.0, 0.0, -20.0], [40.0, 40.0, -20.0]]]
+    corridor = CorridorGeometry.compile(points, [5], [1])
+    position = [[30.0, 27.0, -20.0]]  # 2.1 m from the chord, 10 m from the path
+    closed, _, _ = SegmentIndex(corridor, True, use_grid).locate([0], position)
+    assert list(closed) == [2]
+    segments, arc_length, distance = SegmentIndex(corridor, False, use_grid).locate(
+        [0], position
+    )
+    assert list(segments) == [1]
+    assert arc_length == pytest.approx([67])
+    assert distance == pytest.approx([10])
+
+
+def test_segment_index_grid_matches_every_segment():
+    # a long winding path, positions near it and far from it
+    t = np.linspace(0, 20 * np.pi, 2000)
+    points = [np.stack((t * 5, 40 * np.sin(t), np.full_like(t, -20)), axis=1).tolist()]
+    corridor = CorridorGeometry.compile(points, [5], [1])
+    rng = np.random.default_rng(0)
+    positions = np.concatenate(
+        (
+            corridor.points[0, rng.integers(0, 2000, 200)] + rng.normal(0, 4, (200, 3)),
+            rng.uniform(-100, 400, (50, 3)),
+        )
+    )
+    for repeat in (True, False):
+        grid = SegmentIndex(corridor, repeat).locate(0, positions)
+        every = SegmentIndex(corridor, repeat, use_grid=False).locate(0, positions)
+        for grid_result, every_result in zip(grid, every):
+            assert np.allclose(grid_result, every_result)
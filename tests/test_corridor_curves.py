@@ -0,0 +1,90 @@
+from helixio.corridor import CorridorGeometry
+from helixio.corridor_curves import (
+    Arc,
+    CubicSpline,
+    Curve,
+    Helix,
+    Line,
+    curve_from_definition,
+)
+from helixio.path_engine import PathFollowingEngine, SwarmPathState
+import pytest
+import numpy as np
+
+
+@pytest.mark.parametrize(
+    "curve",
+    [
+        Line([0, 0, -20], [100, 50, -30]),
+        Arc([0, 0, -60], 40, 180, -180, (1, 0, 0), (0, 0, 1)),
+        Arc([0, 0, -40], [40, 20], 0, 90),  # elliptical quarter
+        Helix([0, 0, -20], 30, 0, 720, -40),
+        CubicSpline([[0, 0, -20], [50, 10, -25], [80, 60, -20], [60, 90, -30]]),
+        CubicSpline([[0, 0, -20], [50, 0, -20], [50, 50, -20]], closed=True),
+    ],
+)
+def test_tangent_is_derivative(curve):
+    u = np.linspace(0.01, 0.99, 37)
+    h = 1e-6
+    numeric = (curve.evaluate(u + h) - curve.evaluate(u - h)) / (2 * h)
+    assert np.allclose(curve.tangent(u), numeric, rtol=1e-5, atol=1e-4)
+
+
+def test_curve_definitions():
+    circle = curve_from_definition(
+        {
+            "type": "arc",
+            "center": [0, 0, -60],
+            "radius": 40,
+            "start_angle": 0,
+            "end_angle": 360,
+            "samples": 8,
+        }
+    )
+    assert circle.closed
+    points = circle.sample()
+    assert len(points) == 8  # the loop is closed by the corridor, not a repeated point
+    assert np.allclose(points[2], [0, 40, -60])
+    assert np.allclose(np.linalg.norm(points[:, :2], axis=1), 40)
+
+    spline = CubicSpline([[0, 0, 0], [10, 0, 0], [20, 5, 0]], samples=11)
+    assert np.allclose(spline.sample()[[0, 5, 10]], spline.points)
+    assert np.isnan(spline.parameter([10], [0.5])[0])  # segment closing the loop
+
+    with pytest.raises(ValueError):
+        curve_from_definition({"type": "clothoid"})
+
+
+def test_targets_follow_the_curve():
+    # with only 8 samples of a circle the chords are far inside it, the targets of
+    # the engine are still taken on the circle itself
+    definition = {
+        "type": "arc",
+        "center": [0, 0, -60],
+        "radius": 40,
+        "start_angle": 0,
+        "end_angle": 360,
+        "samples": 8,
+    }
+    corridor = CorridorGeometry.compile([definition], [5], [1])
+    engine = PathFollowingEngine(corridor, 1, 10, 2, True)
+    state = SwarmPathState([0, 0], [0, 1], [False, False], 1, 1, 1)
+    angle = np.radians([20, 60])
+    positions = np.c_[38 * np.cos(angle), 38 * np.sin(angle), [-60, -60]]
+
+    target_point, target_direction = engine.targets(state, positions)
+    assert np.allclose(np.linalg.norm(target_point[:, :2], axis=1), 40)
+    assert np.allclose(
+        np.einsum("ij,ij->i", target_point[:, :2], target_direction[:, :2]), 0
+    )
+    error, _ = engine.lane_cohesion_error(state, positions)
+    assert np.allclose(np.linalg.norm(error, axis=1), 2, atol=0.2)
+
+
+def test_incomplete_curve_fails_when_created():
+    class Straight(Curve):
+        def evaluate(self, u):
+            return np.zeros((len(u), 3))
+
+    with pytest.raises(TypeError):
+        Straight()
@@ -0,0 +1,93 @@
+from helixio.data_structures import AgentTelemetry, SwarmState
+from helixio.gtools import proximity_check
+import pytest
+import numpy as np
+
+
+def test_swarm_state_behaves_like_telemetry_dict():
+    swarm_state = SwarmState(capacity=2)
+    for i in range(5):  # more agents than the initial capacity
+        agent = AgentTelemetry()
+        agent.position_ned = [i, 2 * i, -10]
+        agent.geodetic = (47.0, 8.0, 500 + i)
+        swarm_state["P" + str(101 + i)] = agent
+
+    assert len(swarm_state) == 5
+    assert "P103" in swarm_state and "P106" not in swarm_state
+    assert list(swarm_state.keys()) == ["P101", "P102", "P103", "P104", "P105"]
+    assert list(swarm_state.positions[:, 1]) == [0, 2, 4, 6, 8]
+
+    swarm_state["P103"].position_ned = (1.5, 2.5, 3.5)
+    swarm_state["P103"].arm_status = True
+    assert list(swarm_state["P103"].position_ned) == [1.5, 2.5, 3.5]
+    assert list(swarm_state.positions[swarm_state.rows["P103"]]) == [1.5, 2.5, 3.5]
+    assert swarm_state["P103"].arm_status is True
+    assert swarm_state["P104"].geodetic[2] == 503
+
+
+def test_swarm_state_views_are_read_only():
+    swarm_state = SwarmState()
+    swarm_state["P101"] = AgentTelemetry()
+    version = swarm_state.position_version
+    with pytest.raises(ValueError):
+        swarm_state["P101"].position_ned[0] = 1
+    swarm_state["P101"].position_ned = [1, 0, 0]
+    assert swarm_state.position_version > version
+
+
+def test_proximity_check_with_swarm_state():
+    swarm_state = SwarmState()
+    for i, position in enumerate([[5.5, 4.5, 5], [6, 7.2, 8], [5.3, 5, 4.9]]):
+        agent = AgentTelemetry()
+        agent.position_ned = position
+        swarm_state["P" + str(101 + i)] = agent
+
+    output = proximity_check(swarm_state, 2)
+    assert [pair[:2] for pair in output] == [["P101", "P103"]]
+    assert np.isclose(output[0][2], 0.548, atol=1e-3)
+
+
+def test_out_of_order_states_are_rejected():
+    swarm_state = SwarmState()
+    swarm_state["P101"] = AgentTelemetry()
+    assert swarm_state.stamp(0, 5, 100.0, received=100.1)
+    assert not swarm_state.stamp(0, 4, 99.9, received=100.2)  # late packet
+    assert not swarm_state.stamp(0, 2**32 - 1, 99.95)  # behind across the wrap
+    assert swarm_state.stamp(0, 1, 200.0, received=200.0)  # sender restarted
+    assert swarm_state.sequences[0] == 1
+    assert swarm_state.timestamps[0] == 200.0
+    assert swarm_state.stamp(0, None, None, received=201.0)  # text payload
+    assert swarm_state.timestamps[0] == 201.0
+
+
+def test_messages_without_a_position_keep_its_timestamp():
+    swarm_state = SwarmState()
+    swarm_state["P101"] = AgentTelemetry()
+    assert swarm_state.stamp(0, 5, 100.0, received=100.1)
+    # a velocity sampled later is accepted but positions are still from 100.0
+    assert swarm_state.stamp(0, 7, 100.1, received=100.2, position=False)
+    assert swarm_state.timestamps[0] == 100.0
+    assert swarm_state.received[0] == 100.2
+    assert not swarm_state.stamp(0, 4, 99.9, position=False)  # late velocity
+    # a position sent before that velocity is still newer than the last position
+    assert swarm_state.stamp(0, 6, 100.05, received=100.3)
+    assert swarm_state.timestamps[0] == 100.05
+
+
+def test_ages_and_extrapolation():
+    SwarmManager = pytest.importorskip("helixio.telemetry").SwarmManager
+
+    swarm_manager = SwarmManager()
+    for i in range(2):
+        agent = AgentTelemetry()
+        agent.position_ned = [10 * i, 0, -10]
+        agent.velocity_ned = [0, 2, 0]
+        swarm_manager.telemetry["P" + str(101 + i)] = agent
+    swarm_manager.telemetry.stamp(0, 1, 100.0, received=100.2)
+    swarm_manager.telemetry.stamp(1, 1, 99.0, received=99.5)
+
+    assert np.allclose(swarm_manager.ages(101.0), [0.8, 1.5])
+    positions = swarm_manager.extrapolated_positions(100.5, max_extrapolation=1.0)
+    assert np.allclose(positions, [[0, 1, -10], [10, 2, -10]])
+    grid = swarm_manager.neighbour_grid(5, extrapolate_to=100.5)
+    assert np.allclose(grid.positions, positions)
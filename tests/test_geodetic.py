@@ -0,0 +1,33 @@
+from helixio.geodetic import NedFrame
+import pytest
+import numpy as np
+
+REF = (52.816522986211055, -4.1271978280723225, 6)
+
+
+def test_round_trip():
+    frame = NedFrame(*REF)
+    rng = np.random.default_rng(0)
+    north, east, down = rng.uniform(-2000, 2000, (3, 1000))
+    lat, lon, alt = frame.ned2geodetic(north, east, down)
+    assert np.allclose(
+        frame.geodetic2ned(lat, lon, alt), (north, east, down), atol=1e-6
+    )
+
+
+def test_reference_is_origin():
+    frame = NedFrame(*REF)
+    assert np.allclose(frame.geodetic2ned(*REF), 0, atol=1e-9)
+    assert isinstance(frame.geodetic2ned(*REF)[0], float)
+
+
+def test_matches_pymap3d():
+    pm = pytest.importorskip("pymap3d")
+    frame = NedFrame(*REF)
+    points = [(52.82, -4.12, 40), (52.81, -4.13, 0), (52.9, -4.0, 300)]
+    for lat, lon, alt in points:
+        expected = pm.geodetic2ned(lat, lon, alt, *REF)
+        assert np.allclose(frame.geodetic2ned(lat, lon, alt), expected, atol=1e-6)
+        assert np.allclose(
+            frame.ned2geodetic(*expected), (lat, lon, alt), rtol=0, atol=1e-7
+        )
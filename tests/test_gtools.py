@@ -1,6 +1,9 @@
 from helixio.gtools import (
     alt_calc,
+    alt_checksum,
+    deconflicted_alts,
     proximity_check,
+    NeighbourGrid,
 )  # importing the module we want to test its function (the test file should be in the same directory as module file)
 import pytest
 import numpy as np
@@ -166,6 +169,51 @@ def test_alt_calc(dict_in, site_elevation, dict_out):
     assert alt_calc(dict_in, site_elevation) == dict_out
 
 
+def test_deconflicted_alts_tie_break_by_id():
+    ids = ["P103", "P101", "P102"]
+    alts, step = deconflicted_alts(ids, [30, 30, 30], 0)
+    assert step == 2
+    assert list(alts) == [32, 28, 30]
+    # every ordering of the same swarm gives the same assignment and checksum
+    reordered, _ = deconflicted_alts(ids[::-1], [30, 30, 30], 0)
+    assert list(reordered) == list(alts[::-1])
+    assert alt_checksum(ids, alts) == alt_checksum(ids[::-1], reordered)
+    assert alt_checksum(ids, alts) != alt_checksum(ids, alts[::-1])
+
+
+def test_alt_checksum_compares_the_vertical_order():
+    # agents reading the telemetry at different instants get other altitudes
+    ids = ["P101", "P102", "P103"]
+    alts, _ = deconflicted_alts(ids, [30, 31, 29], 0)
+    later, _ = deconflicted_alts(ids, [30.4, 31.6, 29.3], 0)
+    assert not np.array_equal(alts, later)
+    assert alt_checksum(ids, alts) == alt_checksum(ids, later)
+
+
+def test_deconflicted_alts_squeezed_to_min_step():
+    # 46 altitudes fit in the 90 m window at 2 m, 61 agents are squeezed to 1.5 m
+    ids = ["P" + str(i).zfill(3) for i in range(61)]
+    alts, step = deconflicted_alts(ids, np.zeros(61), 15)
+    assert step == pytest.approx(1.5)
+    assert alts.min() == pytest.approx(25) and alts.max() == pytest.approx(115)
+    assert np.allclose(np.diff(np.sort(alts)), 1.5)
+    # 300 agents would be 0.3 m apart
+    ids = ["P" + str(i).zfill(3) for i in range(300)]
+    with pytest.raises(ValueError):
+        deconflicted_alts(ids, np.zeros(300), 15)
+
+
+def test_alt_calc_squeezes_without_min_step():
+    # the return command still gets altitudes for a swarm that does not fit
+    alt_dict = {"S" + str(i).zfill(3): 50.0 for i in range(300)}
+    with pytest.raises(ValueError):
+        alt_calc(alt_dict, 0)
+    output_dict = alt_calc(alt_dict, 0, min_step=0)
+    alts = np.sort(list(output_dict.values()))
+    assert len(np.unique(alts)) == 300
+    assert alts[0] == pytest.approx(10) and alts[-1] == pytest.approx(100)
+
+
 # test of proximity_check function -----------------------------------------------------------------------------------------------------------------------------
 
 
@@ -241,3 +289,57 @@ def test_proximity_check(positions, min_proximity, output):
         value[2] = round(value[2], 3)
 
     assert Function_output == output
+
+
+# test of NeighbourGrid class ----------------------------------------------------------------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "swarm_size, cell_size, radius",
+    [
+        (50, 5, 5),  # radius equal to the cell size
+        (200, 5, 12),  # radius spanning several cells
+        (1, 5, 5),  # a single drone has no pairs
+    ],
+)
+def test_neighbour_grid(swarm_size, cell_size, radius):
+    positions = np.random.default_rng(0).uniform(-40, 40, (swarm_size, 3))
+    grid = NeighbourGrid(positions, cell_size)
+
+    expected = [
+        (i, j)
+        for i in range(swarm_size)
+        for j in range(i + 1, swarm_size)
+        if np.linalg.norm(positions[i] - positions[j]) <= radius
+    ]
+    rows_1, rows_2, distances = grid.query_pairs(radius)
+    assert list(zip(rows_1, rows_2)) == expected
+    assert np.allclose(
+        distances, np.linalg.norm(positions[rows_1] - positions[rows_2], axis=1)
+    )
+
+    rows = grid.query(positions[0], radius)
+    assert sorted(rows) == [
+        j
+        for j in range(swarm_size)
+        if np.linalg.norm(positions[0] - positions[j]) <= radius
+    ]
+
+
+@pytest.mark.parametrize(
+    "k_closest, output",
+    [
+        (1, [["P103", "P104", 0.5]]),
+        (2, [["P103", "P104", 0.5], ["P101", "P102", 1.0]]),
+        (None, [["P101", "P102", 1.0], ["P102", "P103", 1.5], ["P103", "P104", 0.5]]),
+    ],
+)
+def test_proximity_check_k_closest(k_closest, output):
+    positions = [[0, 0, 0], [1, 0, 0], [2.5, 0, 0], [3, 0, 0], [50, 0, 0]]
+    swarm_telem = {}
+    for i in range(len(positions)):
+        agent = AgentTelemetry()
+        agent.position_ned = positions[i]
+        swarm_telem["P" + str(101 + i)] = agent
+
+    assert proximity_check(swarm_telem, 2, k_closest=k_closest) == output
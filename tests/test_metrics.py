@@ -0,0 +1,49 @@
+from helixio.metrics import Metrics
+import threading
+import pytest
+
+
+def test_counters_and_histograms():
+    metrics = Metrics(window=100)
+    for value in range(1, 201):  # only the latest 100 samples are kept
+        metrics.record("loop_duration", value / 1000)
+    metrics.count("missed_deadlines")
+    metrics.count("missed_deadlines", 2)
+    with metrics.timer("path_following"):
+        pass
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"] == {"missed_deadlines": 3}
+    loop_duration = snapshot["histograms"]["loop_duration"]
+    assert loop_duration["count"] == 100
+    assert loop_duration["max"] == pytest.approx(0.2)
+    assert loop_duration["p50"] == pytest.approx(0.1505)
+    assert loop_duration["p99"] == pytest.approx(0.19901)
+    assert 0 <= snapshot["histograms"]["path_following"]["max"] < 1
+
+    # the snapshot resets the metrics
+    assert metrics.snapshot() == {"counters": {}, "histograms": {}}
+
+
+def test_snapshots_while_other_threads_record():
+    metrics = Metrics(window=10)
+    counts = 20000
+    snapshots = []
+
+    def callback(thread):
+        for i in range(counts):
+            metrics.count("mqtt_position")
+            metrics.record("mqtt_" + str(thread) + "_" + str(i % 50), i)
+
+    threads = [threading.Thread(target=callback, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        snapshots.append(metrics.snapshot())
+    for thread in threads:
+        thread.join()
+    snapshots.append(metrics.snapshot())
+
+    # no increment is lost between the snapshot and the reset
+    total = sum(snapshot["counters"].get("mqtt_position", 0) for snapshot in snapshots)
+    assert total == 2 * counts
@@ -0,0 +1,84 @@
+from helixio.corridor import CorridorGeometry
+from helixio.path_engine import PathFollowingEngine, SwarmPathState
+import pytest
+import numpy as np
+
+
+def straight_corridor():
+    # single path going north, the last direction closes the loop back to the start
+    points = [[[10.0 * i, 0.0, -20.0] for i in range(4)]]
+    return CorridorGeometry.compile(points, [5], [1])
+
+
+# test of index advance ----------------------------------------------------------------------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "position, current_index, index_out",
+    [
+        ([5, 0, -20], 0, 0),  # between point 0 and 1
+        ([12, 0, -20], 0, 1),  # passed point 1
+        ([25, 0, -20], 0, 2),  # passed points 1 and 2 in one step
+    ],
+)
+def test_advance_indices(position, current_index, index_out):
+    engine = PathFollowingEngine(straight_corridor(), 2, 5, 2.5, True)
+    state = SwarmPathState([0], [current_index], [False], 2, 1, 1)
+    engine.step(state, [position], max_speed=5)
+    assert state.current_index[0] == index_out
+
+
+# test of batched and single agent steps ------------------------------------------------------------------------------------------------------------------------
+
+
+def test_batch_matches_single_agent():
+    engine = PathFollowingEngine(straight_corridor(), 2, 5, 2.5, True)
+    positions = np.array(
+        [[5, 0, -20], [6, 1, -21], [5, -4, -16], [15, 8, -20], [16, 2, -20]],
+        dtype="float64",
+    )
+    batch_state = SwarmPathState(np.zeros(5), np.zeros(5), np.zeros(5), 2, 1, 1)
+    velocities, yaws, _ = engine.step(batch_state, positions, max_speed=5)
+
+    for row in range(len(positions)):
+        state = SwarmPathState([0], [0], [False], 2, 1, 1)
+        velocity, yaw, _ = engine.step(
+            state, positions[row], 5, swarm_positions=positions, swarm_rows=[row]
+        )
+        assert np.allclose(velocity[0], velocities[row])
+        assert np.isclose(yaw[0], yaws[row])
+        assert state.least_distance[0] == batch_state.least_distance[row]
+
+    assert np.all(np.linalg.norm(velocities, axis=1) <= 5 + 1e-9)
+
+
+def test_separation_pushes_agents_apart():
+    engine = PathFollowingEngine(straight_corridor(), 2, 5, 2.5, True)
+    state = SwarmPathState([0, 0], [0, 0], [False, False], 0, 0, 0)
+    velocities, _, _ = engine.step(state, [[5, -0.5, -20], [5, 0.5, -20]], 5)
+    assert velocities[0][1] < 0 and velocities[1][1] > 0
+    assert np.allclose(state.least_distance, 1)
+
+
+def test_far_agent_is_placed_on_closest_segment():
+    # an agent that moved many points ahead, e.g. during a hold, skips the point by
+    # point walk and is placed on its segment directly
+    points = [[[10.0 * i, 0.0, -20.0] for i in range(20)]]
+    corridor = CorridorGeometry.compile(points, [5], [1])
+    engine = PathFollowingEngine(corridor, 1, 10, 2, True)
+    state = SwarmPathState([0], [0], [False], 1, 1, 1)
+    engine.advance_indices(state, np.array([[155.0, 0, -20]]))
+    assert state.current_index[0] == 15
+
+
+@pytest.mark.parametrize("east, path_out", [(1.5, 0), (6.5, 2), (4.0, 1)])
+def test_switch_to_the_lane_on_the_agents_side(east, path_out):
+    lanes = [[[10.0 * i, 4.0 * j, -20.0] for i in range(4)] for j in range(3)]
+    corridor = CorridorGeometry.compile(lanes, [2.5, 2.5, 2.5], [1, 1, 1])
+    engine = PathFollowingEngine(corridor, 1, 10, 2, True)
+    state = SwarmPathState([1], [1], [True], 1, 1, 1)
+    switched = engine.switch_paths(state, np.array([[12.0, east, -20]]))
+    assert switched[0] == (path_out != 1)
+    assert state.current_path[0] == path_out
+    assert state.current_index[0] == 1
+    assert state.pass_permission[0] == (path_out == 1)
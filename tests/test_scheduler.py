@@ -0,0 +1,71 @@
+from helixio import scheduler
+from helixio.scheduler import PeriodicScheduler, wait_until
+import asyncio
+import pytest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, duration):
+        self.now += duration
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(scheduler.asyncio, "sleep", fake_clock.sleep)
+    return fake_clock
+
+
+def run_loop(periodic_scheduler, clock, body_durations):
+    # runs a loop whose body takes the given durations, returns the start times
+    async def loop():
+        starts = []
+        periodic_scheduler.start()
+        for duration in body_durations:
+            starts.append(clock.now)
+            clock.now += duration
+            await periodic_scheduler.wait()
+        return starts
+
+    return asyncio.run(loop())
+
+
+def test_deadlines_do_not_drift(clock):
+    periodic_scheduler = PeriodicScheduler(0.1, "skip", clock)
+    starts = run_loop(periodic_scheduler, clock, [0.03, 0.07, 0.01, 0.09])
+    assert starts == pytest.approx([0.0, 0.1, 0.2, 0.3])
+    assert periodic_scheduler.overruns == 0
+
+
+def test_skip_policy(clock):
+    periodic_scheduler = PeriodicScheduler(0.1, "skip", clock)
+    starts = run_loop(periodic_scheduler, clock, [0.05, 0.25, 0.05, 0.05])
+    # the 0.25 s iteration misses the deadlines at 0.2 and 0.3
+    assert starts == pytest.approx([0.0, 0.1, 0.4, 0.5])
+    assert (periodic_scheduler.overruns, periodic_scheduler.skipped) == (1, 2)
+
+
+def test_catch_up_policy(clock):
+    periodic_scheduler = PeriodicScheduler(0.1, "catch_up", clock)
+    starts = run_loop(periodic_scheduler, clock, [0.05, 0.25, 0.0, 0.0, 0.0])
+    # the missed iterations run straight away until the schedule is met again
+    assert starts == pytest.approx([0.0, 0.1, 0.35, 0.35, 0.4])
+    stats = periodic_scheduler.stats()
+    assert (stats["ticks"], stats["overruns"], stats["skipped"]) == (5, 2, 0)
+    assert stats["jitter_max"] == pytest.approx(0.15)
+
+
+def test_wait_until(clock):
+    asyncio.run(wait_until(lambda: clock.now >= 0.95, 0.1, clock))
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        PeriodicScheduler(0.1, "drop")
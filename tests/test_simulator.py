@@ -0,0 +1,70 @@
+from helixio.simulator import Simulation
+from helixio.traces import TraceRecorder
+import subprocess
+import sys
+import os
+import pytest
+import numpy as np
+
+
+def test_sink_receives_every_step(experiment_file):
+    simulation = Simulation(experiment_file, drone_num=3, dt=0.1)
+    trace = TraceRecorder()
+    simulation.run(1, trace)
+    # like the visualiser, steps go on while t <= 1 and the accumulated t lags 1.0
+    assert simulation.steps == len(trace.times) == 11
+    assert trace.ids == ["S001", "S002", "S003"]
+    # the third drone has no pre start position and starts at the origin
+    assert np.all(trace.positions[0][:, 0] > 0)
+
+
+def test_sink_keeps_every_stride_step(experiment_file):
+    simulation = Simulation(experiment_file, drone_num=3, dt=0.1)
+    full = TraceRecorder()
+    strided = TraceRecorder(stride=4)
+
+    def sink(t, ids, positions, velocities):
+        full(t, ids, positions, velocities)
+        strided(t, ids, positions, velocities)
+
+    simulation.run(1, sink)
+    assert strided.times == full.times[::4]
+    assert np.array_equal(strided.positions[-1], full.positions[8])
+
+
+@pytest.mark.parametrize(
+    "dynamics, time_constant",
+    [("first_order", 0), ("first_order", 1), ("point_mass", 0)],
+)
+def test_dynamics_limit_velocity_change(experiment_file, dynamics, time_constant):
+    simulation = Simulation(
+        experiment_file,
+        dt=0.1,
+        max_speed=5,
+        dynamics=dynamics,
+        time_constant=time_constant,
+        max_accel=2,
+    )
+    commands = simulation.step()
+    change = np.linalg.norm(simulation.velocities, axis=1)
+    if dynamics == "point_mass":
+        assert np.all(change <= 2 * 0.1 + 1e-9)
+    elif time_constant == 0:
+        assert np.allclose(simulation.velocities, commands)
+    else:
+        assert np.allclose(simulation.velocities, 0.1 * commands)
+
+
+def test_overrides_replace_gains(experiment_file):
+    simulation = Simulation(experiment_file, overrides={"k_migration": 3})
+    assert np.all(simulation.state.k_migration == 3)
+
+
+def test_plotly_not_imported(experiment_file):
+    helixio = os.path.join(os.path.dirname(os.path.dirname(__file__)), "helixio")
+    script = (
+        "import sys; sys.path.insert(0, %r); import simulator; "
+        "simulator.main([%r, '--time', '1']); "
+        "assert 'plotly' not in sys.modules" % (helixio, experiment_file)
+    )
+    subprocess.run([sys.executable, "-c", script], check=True)
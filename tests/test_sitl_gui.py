@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("mavsdk")
+pytest.importorskip("paho.mqtt.client")
+pytest.importorskip("tkinter")
+from helixio import sitl_gui
+
+
+class FakeClient:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, *args, **kwargs):
+        self.published.append((topic, payload))
+
+
+def test_return_is_sent_when_the_swarm_does_not_fit(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(sitl_gui.time, "sleep", lambda duration: None)
+    monkeypatch.setattr(
+        sitl_gui.tk.messagebox,
+        "showwarning",
+        lambda title, message: warnings.append(message),
+    )
+    # 120 drones do not fit the return altitude window 1 m apart
+    swarm_telemetry = {
+        "S" + str(i).zfill(3): SimpleNamespace(geodetic=[51.4, -2.6, 50.0])
+        for i in range(1, 121)
+    }
+    app = SimpleNamespace(
+        real_swarm_size=0,
+        sitl_swarm_size=120,
+        site_elevation=0,
+        comms=SimpleNamespace(swarm_telemetry=swarm_telemetry, client=FakeClient()),
+    )
+    app.send_command = lambda command: sitl_gui.App.send_command(app, command)
+
+    sitl_gui.App.on_click_return(app)
+
+    published = app.comms.client.published
+    assert published[-1] == ("commands", "return")
+    altitudes = [float(payload) for topic, payload in published[:-1]]
+    assert len(set(altitudes)) == 120
+    assert len(warnings) == 1
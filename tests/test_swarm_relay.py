@@ -0,0 +1,67 @@
+from helixio.telemetry_codec import (
+    decode_swarm_snapshot,
+    encode_state_frame,
+    encode_telemetry,
+)
+from types import SimpleNamespace
+import pytest
+import numpy as np
+
+pytest.importorskip("paho.mqtt.client")
+from helixio.swarm_relay import SwarmRelay
+
+
+def state_message(agent_id, north, sequence, timestamp):
+    payload = encode_state_frame(
+        (north, 0, -20), (1, 0, 0), (51.4, -2.6, 100), 90, "binary", sequence, timestamp
+    )
+    return SimpleNamespace(topic=agent_id + "/telemetry/state", payload=payload)
+
+
+def test_snapshot_carries_the_sender_timestamps():
+    relay = SwarmRelay("localhost")
+    relay.on_message_state(None, None, state_message("P101", 1, 0, 1000.0))
+    relay.on_message_state(None, None, state_message("P102", 2, 0, 1000.5))
+    ids, records, sequence, _ = decode_swarm_snapshot(relay.snapshot())
+    assert ids == ["P101", "P102"]
+    np.testing.assert_array_equal(records["timestamp"], [1000.0, 1000.5])
+    assert sequence == 1
+
+
+def test_out_of_order_state_frames_are_dropped():
+    relay = SwarmRelay("localhost")
+    relay.on_message_state(None, None, state_message("P101", 5, 3, 1000.3))
+    relay.on_message_state(None, None, state_message("P101", 2, 2, 1000.2))
+    _, records, _, _ = decode_swarm_snapshot(relay.snapshot())
+    assert records["position_ned"][0][0] == 5
+    assert records["timestamp"][0] == 1000.3
+
+
+def test_agents_without_a_position_are_left_out():
+    relay = SwarmRelay("localhost")
+    velocity = encode_telemetry((1, 0, 0), "binary", 0, 1000.0)
+    relay.on_message_velocity(
+        None,
+        None,
+        SimpleNamespace(topic="P101/telemetry/velocity_ned", payload=velocity),
+    )
+    assert relay.snapshot() is None
+    relay.on_message_state(None, None, state_message("P102", 2, 0, 1000.5))
+    ids, records, _, _ = decode_swarm_snapshot(relay.snapshot())
+    assert ids == ["P102"]
+    assert records["position_ned"][0][0] == 2
+
+
+def test_out_of_order_velocities_are_dropped():
+    relay = SwarmRelay("localhost")
+    relay.on_message_state(None, None, state_message("P101", 1, 3, 1000.3))
+    for sequence, east in ((5, 2), (4, 9)):
+        velocity = encode_telemetry((0, east, 0), "binary", sequence, 1000.2)
+        relay.on_message_velocity(
+            None,
+            None,
+            SimpleNamespace(topic="P101/telemetry/velocity_ned", payload=velocity),
+        )
+    _, records, _, _ = decode_swarm_snapshot(relay.snapshot())
+    assert records["velocity_ned"][0][1] == 2
+    assert records["timestamp"][0] == 1000.3
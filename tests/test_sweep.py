@@ -0,0 +1,42 @@
+from helixio.sweep import (
+    SWEEP_METRICS,
+    run_configuration,
+    run_sweep,
+    sweep_configurations,
+    write_results,
+)
+import csv
+import pytest
+
+
+def test_sweep_configurations():
+    configurations = sweep_configurations(
+        {"k_migration": [1, 2], "r_conflict": [4, 5, 6]}
+    )
+    assert len(configurations) == 6
+    assert configurations[0] == {"k_migration": 1, "r_conflict": 4}
+    assert configurations[-1] == {"k_migration": 2, "r_conflict": 6}
+    with pytest.raises(ValueError):
+        sweep_configurations({"corridor_radius": [1]})
+
+
+def test_run_configuration(experiment_file):
+    metrics = run_configuration(experiment_file, {"k_migration": 2}, simulation_time=5)
+    assert metrics["k_migration"] == 2
+    # the agents start 10 m apart on the lane and keep their distance
+    assert 2 < metrics["min_separation"] <= 10
+    assert metrics["separation_violations"] == 0
+    assert metrics["throughput"] > 0
+
+
+def test_run_sweep(experiment_file, tmp_path):
+    ranges = {"k_migration": [1, 2]}
+    results = run_sweep(experiment_file, ranges, simulation_time=5, max_workers=2)
+    assert [result["k_migration"] for result in results] == [1, 2]
+    # a stronger migration gain moves the swarm along the lane faster
+    assert results[1]["throughput"] > results[0]["throughput"]
+    write_results(results, str(tmp_path / "results.csv"), ranges)
+    with open(tmp_path / "results.csv") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["k_migration"] + list(SWEEP_METRICS)
+    assert len(rows) == 3
@@ -0,0 +1,114 @@
+from helixio.data_structures import AgentTelemetry, SwarmState
+from helixio.telemetry_codec import (
+    decode_state_frame,
+    decode_swarm_snapshot,
+    decode_telemetry,
+    encode_state_frame,
+    encode_swarm_snapshot,
+    encode_telemetry,
+)
+import pytest
+import numpy as np
+
+
+@pytest.mark.parametrize(
+    "values, value_type, tolerance",
+    [
+        ((12.5, -3.25, -20.0), "f", 0),  # position_ned as float32
+        ((47.397971057728974, 8.546163739800146, 488.1), "d", 0),  # geodetic
+        ((1.2345678,), "f", 1e-6),  # heading, rounded to float32
+    ],
+)
+def test_binary_round_trip(values, value_type, tolerance):
+    payload = encode_telemetry(values, "binary", 7, 1650000000.5, value_type)
+    decoded, sequence, timestamp = decode_telemetry(payload)
+    assert decoded == pytest.approx(list(values), abs=tolerance)
+    assert sequence == 7
+    assert timestamp == 1650000000.5
+    assert len(payload) == 15 + len(values) * (4 if value_type == "f" else 8)
+
+
+@pytest.mark.parametrize(
+    "payload, values",
+    [
+        (b"12.5, -3.25, -20.0", [12.5, -3.25, -20.0]),
+        (b"(1.0, 2.0, 3.0)", [1.0, 2.0, 3.0]),  # tuple string before stripping
+        (b"[0.1, 0.2, 0.3]", [0.1, 0.2, 0.3]),  # list string
+        (b"180.0", [180.0]),
+    ],
+)
+def test_text_payloads_are_accepted(payload, values):
+    assert decode_telemetry(payload) == (values, None, None)
+    text = encode_telemetry(values, "text")
+    assert decode_telemetry(text.encode())[0] == values
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        encode_telemetry((1.0, 2.0, 3.0), "json")
+
+
+@pytest.mark.parametrize("telemetry_format", ["text", "binary"])
+def test_state_frame_round_trip(telemetry_format):
+    payload = encode_state_frame(
+        (12.5, -3.25, -20.0),
+        (1.5, 0.0, -0.25),
+        (47.397971057728974, 8.546163739800146, 488.1),
+        270.0,
+        telemetry_format,
+        42,
+        1650000000.25,
+    )
+    if telemetry_format == "text":
+        payload = payload.encode()
+    position, velocity, geodetic, heading, sequence, timestamp = decode_state_frame(
+        payload
+    )
+    assert position == [12.5, -3.25, -20.0]
+    assert velocity == [1.5, 0.0, -0.25]
+    assert geodetic == [47.397971057728974, 8.546163739800146, 488.1]
+    assert (heading, sequence, timestamp) == (270.0, 42, 1650000000.25)
+
+
+def test_swarm_snapshot_round_trip():
+    ids = ["P101", "P102", "P103"]
+    positions = np.array([[1.0, 2.0, -10.0], [3.0, 4.0, -11.0], [5.0, 6.0, -12.0]])
+    velocities = np.array([[0.5, 0.0, 0.0], [0.0, 0.5, 0.0], [0.0, 0.0, 0.5]])
+    geodetic = np.array([[47.39797105, 8.5461637, 488.1]] * 3)
+    heading = np.array([0.0, 90.0, 180.0])
+    timestamps = np.array([1650000000.0, 1650000000.1, 1650000000.2])
+    payload = encode_swarm_snapshot(
+        ids, positions, velocities, geodetic, heading, timestamps, 9, 1650000001.0
+    )
+    decoded_ids, records, sequence, timestamp = decode_swarm_snapshot(payload)
+    assert decoded_ids == ids
+    assert (sequence, timestamp) == (9, 1650000001.0)
+    assert np.array_equal(records["position_ned"], positions)
+    assert np.array_equal(records["geodetic"], geodetic)
+    assert np.array_equal(records["heading"], heading)
+    assert np.array_equal(records["timestamp"], timestamps)
+
+
+def test_swarm_snapshot_updates_swarm_state():
+    swarm_state = SwarmState()
+    swarm_state["P101"] = AgentTelemetry()
+    payload = encode_swarm_snapshot(
+        ["P101"],
+        [[1.0, 2.0, 3.0]],
+        [[0.0, 0.0, 0.0]],
+        [[47.0, 8.0, 500.0]],
+        [45.0],
+        [0],
+    )
+    _, records, _, _ = decode_swarm_snapshot(payload)
+    version = swarm_state.position_version
+    swarm_state.update_rows(
+        np.array([0]),
+        records["position_ned"],
+        records["velocity_ned"],
+        records["geodetic"],
+        records["heading"],
+    )
+    assert list(swarm_state["P101"].position_ned) == [1.0, 2.0, 3.0]
+    assert swarm_state["P101"].heading == 45.0
+    assert swarm_state.position_version > version
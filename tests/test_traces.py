@@ -0,0 +1,230 @@
+from helixio.simulator import Simulation
+from helixio.traces import (
+    TRACE_COLUMNS,
+    LineSimplifier,
+    Trace,
+    TraceWriter,
+    level_of_detail,
+    load_trace,
+    load_traces,
+    save_trace,
+    resample_trajectories,
+    shared_time_grid,
+    simplify_polyline,
+)
+import csv
+import pytest
+import numpy as np
+
+
+def test_csv_trace_is_written_in_chunks(tmp_path, experiment_file):
+    path = str(tmp_path / "trace.csv")
+    simulation = Simulation(experiment_file)
+    writer = TraceWriter(path, chunk_steps=4)
+    simulation.run(0.5, writer)
+    # the first chunk is on disk before the trace is closed
+    assert writer.rows == 2 * 4
+    with open(path) as f:
+        assert len(list(csv.reader(f))) == 1 + 2 * 4
+    writer.close()
+    with open(path) as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == list(TRACE_COLUMNS)
+    assert len(rows) == 1 + 2 * simulation.steps == 1 + writer.rows
+    # rows go step by step, x is east, y north and z up
+    assert [row[4] for row in rows[1:5]] == ["S001", "S002", "S001", "S002"]
+    assert float(rows[1][0]) == pytest.approx(simulation.positions[0][1], abs=1)
+    assert float(rows[1][2]) == pytest.approx(20, abs=1)
+    assert rows[-1][3] == str(simulation.t)
+
+
+def test_empty_csv_trace(tmp_path):
+    path = str(tmp_path / "trace.csv")
+    with TraceWriter(path):
+        pass
+    with open(path) as f:
+        assert list(csv.reader(f)) == [list(TRACE_COLUMNS)]
+
+
+def test_parquet_trace(tmp_path, experiment_file):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "trace.parquet")
+    simulation = Simulation(experiment_file)
+    with TraceWriter(path, chunk_steps=3) as writer:
+        simulation.run(1, writer)
+    table = pq.read_table(path)
+    assert table.column_names == list(TRACE_COLUMNS)
+    assert table.num_rows == 2 * simulation.steps
+    assert np.allclose(table.column("z(m)").to_numpy(), 20, atol=1)
+
+
+# test of trajectory resampling ------------------------------------------------------------------------------------------------------------------------------------
+
+
+def test_resample_trajectories_matches_per_drone_interpolation():
+    rng = np.random.default_rng(0)
+    # unix times, as in the flight logs, with a different sampling for every drone
+    times = [1.6e9 + np.sort(rng.uniform(0, 100, count)) for count in (50, 80, 120)]
+    positions = [rng.uniform(-50, 50, (len(drone_times), 3)) for drone_times in times]
+    grid = shared_time_grid(times, 0.1)
+    resampled = resample_trajectories(times, positions, grid)
+    assert resampled.shape == (3, len(grid), 3)
+    for drone, drone_times in enumerate(times):
+        for axis in range(3):
+            expected = np.interp(grid, drone_times, positions[drone][:, axis])
+            assert np.allclose(resampled[drone, :, axis], expected, atol=1e-5)
+
+
+def test_resample_trajectories_sorts_out_of_order_times():
+    # one drone logged in two flights, the later flight's file read first
+    times = [np.array([10.0, 11.0, 12.0, 0.0, 1.0, 2.0])]
+    positions = [np.arange(6, dtype="float64")[:, None] * np.ones(3)]
+    resampled = resample_trajectories(times, positions, [0.5, 1.5, 10.5, 11.5])
+    expected = [
+        np.interp(t, [0, 1, 2, 10, 11, 12], [3, 4, 5, 0, 1, 2])
+        for t in (0.5, 1.5, 10.5, 11.5)
+    ]
+    assert np.allclose(resampled[0, :, 0], expected)
+
+
+def test_shared_time_grid():
+    times = [np.array([0.0, 10.0]), np.array([2.05, 5.0, 12.0])]
+    grid = shared_time_grid(times, 0.5)
+    # from the latest start to the earliest finish, like the while t <= finish loops
+    assert grid[0] == 2.05
+    assert len(grid) == 16
+    assert grid[-1] <= 10
+
+
+def test_resample_trajectories_clamps_outside_samples():
+    times = [np.array([0.0, 1.0]), np.array([5.0, 6.0])]
+    positions = [np.zeros((2, 3)), np.ones((2, 3))]
+    resampled = resample_trajectories(times, positions, [0.5, 5.5])
+    assert np.allclose(resampled[0], 0)
+    assert np.allclose(resampled[1], 1)
+
+
+# test of trace store ----------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def example_columns():
+    # rows of two drones interleaved step by step, as TraceWriter writes them
+    return {
+        "x(m)": np.array([0.0, 10.0, 1.0, 11.0, 2.0, 12.0]),
+        "y(m)": np.array([0.0, 0.0, 0.5, 0.5, 1.0, 1.0]),
+        "z(m)": np.full(6, 20.0),
+        "time(s)": np.array([0.1, 0.1, 0.2, 0.2, 0.3, 0.3]),
+        "drone id": np.array(["S002", "S001"] * 3),
+        "offboard mode status": np.ones(6, dtype="int64"),
+        "type of experiment": np.full(6, "Python_simulation"),
+    }
+
+
+def test_trace_from_columns():
+    trace = Trace.from_columns(example_columns(), {"dt": 0.1})
+    assert trace.ids == ["S002", "S001"]
+    assert len(trace) == 6
+    assert trace.experiment_type == "Python_simulation"
+    assert np.array_equal(trace.drones["S001"]["time"], [0.1, 0.2, 0.3])
+    assert np.array_equal(trace.drones["S001"]["position"][:, 0], [10, 11, 12])
+    # the columns go back drone after drone
+    assert list(trace.columns()["drone id"]) == ["S002"] * 3 + ["S001"] * 3
+
+
+@pytest.mark.parametrize("extension", [".npz", ".csv", ".parquet"])
+def test_trace_round_trip(tmp_path, extension):
+    if extension == ".parquet":
+        pytest.importorskip("pyarrow")
+    trace = Trace.from_columns(example_columns(), {"dt": 0.1})
+    path = str(tmp_path / ("run" + extension))
+    save_trace(trace, path)
+    loaded = load_trace(path)
+    assert loaded.ids == trace.ids
+    assert loaded.experiment_type == trace.experiment_type
+    for drone_id in trace.ids:
+        for name in ("time", "position", "offboard"):
+            assert np.array_equal(
+                loaded.drones[drone_id][name], trace.drones[drone_id][name]
+            )
+    if extension != ".csv":
+        assert loaded.metadata == {"dt": 0.1}
+
+
+def test_load_traces_reads_simulation_csv(tmp_path, experiment_file):
+    simulation = Simulation(experiment_file)
+    with TraceWriter(str(tmp_path / "sim.csv")) as writer:
+        simulation.run(1, writer)
+    save_trace(load_trace(str(tmp_path / "sim.csv")), str(tmp_path / "sim.npz"))
+    traces = load_traces(str(tmp_path))
+    assert list(traces) == ["sim.csv", "sim.npz"]
+    for trace in traces.values():
+        assert trace.ids == ["S001", "S002"]
+        assert len(trace.drones["S001"]["time"]) == simulation.steps
+
+
+def test_simplify_polyline_keeps_corners():
+    # a straight leg, a right angle turn and a second straight leg
+    first = np.stack((np.linspace(0, 10, 11), np.zeros(11), np.zeros(11)), axis=1)
+    second = np.stack((np.full(10, 10.0), np.linspace(1, 10, 10), np.zeros(10)), axis=1)
+    points = np.concatenate((first, second))
+    assert simplify_polyline(points, 0.05).tolist() == [0, 10, 20]
+    assert len(simplify_polyline(points[:2], 0.05)) == 2
+
+
+def test_simplify_polyline_error_bound():
+    angles = np.linspace(0, 2 * np.pi, 1000)
+    points = np.stack((np.cos(angles), np.sin(angles), angles), axis=1)
+    kept = simplify_polyline(points, 0.01)
+    assert 2 < len(kept) < len(points)
+    assert kept[0] == 0 and kept[-1] == len(points) - 1
+    # every dropped point lies within the tolerance of its simplified segment
+    for start, end in zip(kept[:-1], kept[1:]):
+        segment = points[end] - points[start]
+        inner = points[start + 1 : end] - points[start]
+        along = np.clip(inner @ segment / (segment @ segment), 0, 1)
+        distance = np.linalg.norm(inner - along[:, None] * segment, axis=1)
+        assert np.all(distance <= 0.01)
+
+
+def test_level_of_detail():
+    times = np.arange(1200) * 0.1
+    positions = np.zeros((2, 1200, 3))
+    positions[:, :, 0] = times
+    frames, frame_times, lines, stride = level_of_detail(positions, times, 500, 0.05)
+    assert stride == 3
+    assert frames.shape == (2, 400, 3)
+    np.testing.assert_array_equal(frame_times, times[::3])
+    assert [len(line) for line in lines] == [2, 2]
+    # short traces and disabled limits are kept as they are
+    frames, frame_times, lines, stride = level_of_detail(positions, times, None, None)
+    assert stride == 1 and frames.shape == (2, 1200, 3) and len(lines[0]) == 1200
+
+
+@pytest.mark.parametrize("window", [256, 8])
+def test_line_simplifier_error_bound(window):
+    # two drones, one on a helix and one on a straight line, streamed step by step
+    angles = np.linspace(0, 4 * np.pi, 2000)
+    helix = np.stack((np.cos(angles), np.sin(angles), angles), axis=1)
+    straight = np.stack((angles, angles, np.zeros_like(angles)), axis=1)
+    simplifier = LineSimplifier(0.01, window)
+    for step in range(len(angles)):
+        positions = np.stack((helix[step], straight[step]))
+        simplifier(0.1 * step, ["S001", "S002"], positions, None)
+
+    for points, line in zip((helix, straight), simplifier.lines):
+        assert len(line) < len(points) / 5
+        assert np.array_equal(line[0], points[0])
+        assert np.array_equal(line[-1], points[-1])
+        # every point lies within the tolerance of the simplified line
+        segment = line[1:] - line[:-1]
+        inner = points[:, None] - line[None, :-1]
+        along = np.clip(
+            np.einsum("ijk,jk->ij", inner, segment)
+            / np.einsum("jk,jk->j", segment, segment),
+            0,
+            1,
+        )
+        distance = np.linalg.norm(inner - along[..., None] * segment, axis=2)
+        assert np.all(distance.min(axis=1) <= 0.01 + 1e-12)
+    # on the straight line a point is only kept when the window is full
+    assert len(simplifier.lines[1]) == -(-1999 // (window - 1)) + 1
@@ -0,0 +1,162 @@
+import ulog_ingest
+from ulog_ingest import offboard_intervals
+from types import SimpleNamespace
+import multiprocessing
+import os
+import time
+import pytest
+import numpy as np
+
+
+def nested_loop_offboard(gps_timestamp, offboard_timestamp, max_gap=None):
+    # the loop visualize_ulg used before offboard_intervals, a gps sample is in
+    # offboard mode between two consecutive offboard_control_mode messages
+    mask = np.zeros(len(gps_timestamp), dtype="bool")
+    for l in range(len(offboard_timestamp) - 1):
+        if max_gap is not None and (
+            offboard_timestamp[l + 1] - offboard_timestamp[l] > max_gap
+        ):
+            continue
+        for m in range(len(gps_timestamp)):
+            if (
+                gps_timestamp[m] >= offboard_timestamp[l]
+                and gps_timestamp[m] <= offboard_timestamp[l + 1]
+            ):
+                mask[m] = True
+    return mask
+
+
+def test_offboard_intervals_matches_nested_loop():
+    rng = np.random.default_rng(0)
+    gps_timestamp = np.sort(rng.uniform(0, 100, 500))
+    offboard_timestamp = np.sort(rng.uniform(20, 80, 60))
+    starts, ends, mask = offboard_intervals(gps_timestamp, offboard_timestamp)
+    assert starts.tolist() == [offboard_timestamp[0]]
+    assert ends.tolist() == [offboard_timestamp[-1]]
+    np.testing.assert_array_equal(
+        mask, nested_loop_offboard(gps_timestamp, offboard_timestamp)
+    )
+
+
+def test_offboard_intervals_unsorted_messages():
+    # the messages are taken in time order, as the loop saw them in the logs
+    rng = np.random.default_rng(1)
+    gps_timestamp = rng.uniform(0, 100, 500)
+    offboard_timestamp = rng.uniform(20, 80, 60)
+    _, _, mask = offboard_intervals(gps_timestamp, offboard_timestamp)
+    np.testing.assert_array_equal(
+        mask, nested_loop_offboard(gps_timestamp, np.sort(offboard_timestamp))
+    )
+
+
+@pytest.mark.parametrize("offboard_timestamp", [[], [5.0]])
+def test_offboard_intervals_needs_two_messages(offboard_timestamp):
+    gps_timestamp = np.linspace(0, 10, 11)
+    starts, ends, mask = offboard_intervals(gps_timestamp, offboard_timestamp)
+    assert len(starts) == 0 and len(ends) == 0
+    assert not mask.any()
+    np.testing.assert_array_equal(
+        mask, nested_loop_offboard(gps_timestamp, offboard_timestamp)
+    )
+
+
+def test_offboard_intervals_max_gap():
+    # two offboard phases, 10 to 20 s and 40 to 50 s, with samples before, between
+    # and after them
+    offboard_timestamp = np.concatenate((np.arange(10, 20.5, 0.5), np.arange(40, 51)))
+    gps_timestamp = np.arange(0, 60, 0.25)
+    starts, ends, mask = offboard_intervals(gps_timestamp, offboard_timestamp, 2)
+    assert starts.tolist() == [10, 40]
+    assert ends.tolist() == [20, 50]
+    np.testing.assert_array_equal(
+        mask, nested_loop_offboard(gps_timestamp, offboard_timestamp, 2)
+    )
+    assert not mask[gps_timestamp < 10].any()
+    assert not mask[(gps_timestamp > 20) & (gps_timestamp < 40)].any()
+    assert not mask[gps_timestamp > 50].any()
+    # without max_gap the drone counts as in offboard mode from 10 to 50 s
+    _, _, mask = offboard_intervals(gps_timestamp, offboard_timestamp)
+    assert mask[(gps_timestamp >= 10) & (gps_timestamp <= 50)].all()
+
+
+# test of ulog parsing with a stand in for pyulog ----------------------------------------------------------------------------------------------------------------
+
+
+class FakeULog:
+    # the datasets pyulog returns for the files named in DATASETS, where a file named
+    # "slow..." takes longer to parse than the others
+    def __init__(self, ulg_path, message_names):
+        self.name = os.path.basename(ulg_path).replace(".ulg", "")
+        assert message_names == ulog_ingest.ULOG_TOPICS
+        if self.name.startswith("slow"):
+            time.sleep(0.2)
+
+    def get_dataset(self, name):
+        data = DATASETS[self.name].get(name)
+        if data is None:
+            # pyulog raises an IndexError for topics missing from the log
+            raise IndexError(name)
+        return SimpleNamespace(data=data)
+
+
+GPS_TIMESTAMP = np.array([1000000, 2000000, 3000000], dtype="uint64")
+GPS_TIME = np.array([1600000000000000, 1600000001000000, 1600000002000000])
+DATASETS = {
+    # older PX4, integer position in 1e-7 degrees and millimetres
+    "P101": {
+        "vehicle_gps_position": {
+            "timestamp": GPS_TIMESTAMP,
+            "time_utc_usec": GPS_TIME,
+            "lat": np.array([514000000, 514000010, 514000020], dtype="int32"),
+            "lon": np.array([-26000000, -26000010, -26000020], dtype="int32"),
+            "alt": np.array([100000, 101000, 102500], dtype="int32"),
+        },
+        "offboard_control_mode": {
+            "timestamp": np.array([1500000, 2500000], dtype="uint64")
+        },
+    },
+    # newer PX4, position in degrees and metres, never in offboard mode
+    "slow_P102": {
+        "vehicle_gps_position": {
+            "timestamp": GPS_TIMESTAMP,
+            "time_utc_usec": GPS_TIME,
+            "latitude_deg": np.array([51.4, 51.400001, 51.400002]),
+            "longitude_deg": np.array([-2.6, -2.600001, -2.600002]),
+            "altitude_msl_m": np.array([100.0, 101.0, 102.5], dtype="float32"),
+        },
+    },
+}
+
+
+@pytest.fixture
+def fake_ulog(monkeypatch):
+    monkeypatch.setattr(ulog_ingest, "ULog", FakeULog)
+
+
+def test_ingest_ulog_integer_position(fake_ulog):
+    drone = ulog_ingest.ingest_ulog("/logs/P101.ulg")
+    assert drone["name"] == "P101"
+    np.testing.assert_allclose(drone["gps_timestamp"], [1, 2, 3])
+    np.testing.assert_allclose(drone["time"], [1.6e9, 1.6e9 + 1, 1.6e9 + 2])
+    np.testing.assert_allclose(drone["lat"], [51.4, 51.400001, 51.400002])
+    np.testing.assert_allclose(drone["lon"], [-2.6, -2.600001, -2.600002])
+    np.testing.assert_allclose(drone["alt"], [100, 101, 102.5])
+    np.testing.assert_allclose(drone["offboard_timestamp"], [1.5, 2.5])
+
+
+def test_ingest_ulog_degree_position_without_offboard(fake_ulog):
+    drone = ulog_ingest.ingest_ulog("/logs/slow_P102.ulg")
+    assert drone["lat"].dtype == np.float64
+    np.testing.assert_allclose(drone["lat"], [51.4, 51.400001, 51.400002])
+    np.testing.assert_allclose(drone["alt"], [100, 101, 102.5])
+    assert len(drone["offboard_timestamp"]) == 0
+
+
+def test_ingest_ulogs_keeps_the_order_of_the_paths(fake_ulog):
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("the workers only see the stand in for pyulog when forked")
+    # the first file is parsed last
+    paths = ["/logs/slow_P102.ulg", "/logs/P101.ulg"]
+    drones = ulog_ingest.ingest_ulogs(paths, max_workers=2)
+    assert [drone["name"] for drone in drones] == ["slow_P102", "P101"]
+    np.testing.assert_allclose(drones[1]["offboard_timestamp"], [1.5, 2.5])